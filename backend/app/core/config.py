@@ -13,6 +13,116 @@ class Settings(BaseSettings):
     environment: str
     FYERS_TOKEN_EXPIRES_AT: int  # Added this line
 
+    FYERS_REQUEST_TIMEOUT_SECONDS: float = 10.0
+
+    # Fyers REST endpoints; overridable to point at a mock server
+    FYERS_API_URL: str = "https://api-t1.fyers.in/api/v3"
+    FYERS_DATA_URL: str = "https://api-t1.fyers.in/data"
+    FYERS_SPAN_MARGIN_URL: str = "https://api.fyers.in/api/v2/span_margin"
+
+    # Client-side request budget per Fyers endpoint, in requests per second
+    # of each worker process. The rate drops on HTTP 429 (never below
+    # FYERS_RATE_LIMIT_MIN_FRACTION of the budget) and recovers on success
+    FYERS_RATE_LIMITS: str = "optionchain=8,span_margin=8,refresh=1,symbol_master=1"
+    FYERS_RATE_LIMIT_MIN_FRACTION: float = 0.1
+    # Retries of requests failing with HTTP 429/5xx or a connection error,
+    # after full-jitter exponential backoff
+    FYERS_RETRY_ATTEMPTS: int = 3
+    FYERS_RETRY_BASE_DELAY_SECONDS: float = 0.25
+    FYERS_RETRY_MAX_DELAY_SECONDS: float = 5.0
+
+    # Refresh the access token this many seconds before it expires
+    FYERS_TOKEN_REFRESH_MARGIN_SECONDS: int = 300
+
+    # Access token shared by all worker processes (SQLite). Workers re-read
+    # it every SYNC seconds; one worker at a time refreshes, holding a lease
+    # that lapses after LEASE seconds if it dies mid-refresh
+    FYERS_TOKEN_STORE_PATH: str = ".cache/fyers_tokens.sqlite3"
+    FYERS_TOKEN_STORE_SYNC_SECONDS: float = 5.0
+    FYERS_TOKEN_REFRESH_LEASE_SECONDS: float = 30.0
+
+    # SPAN margin requests
+    MARGIN_BATCH_SIZE: int = 20
+    MARGIN_REQUEST_TIMEOUT_SECONDS: float = 10.0
+    MARGIN_MAX_CONCURRENCY: int = 10
+    MARGIN_POOL_SIZE: int = 20
+
+    # SPAN margin cache; entries also expire at each IST 'HH:MM' listed
+    MARGIN_CACHE_TTL_SECONDS: float = 300.0
+    MARGIN_CACHE_MAX_ENTRIES: int = 20000
+    MARGIN_CACHE_INVALIDATE_AT: str = "09:15,15:30"
+    # A cached margin is recomputed once the underlying or the option price
+    # moves more than this fraction away from the prices it was computed at
+    MARGIN_REPRICE_UNDERLYING_MOVE: float = 0.01
+    MARGIN_REPRICE_OPTION_MOVE: float = 0.10
+
+    # Offline margin estimate used by margin_mode=estimate|hybrid. Per unit
+    # of the underlying price S, a short option's margin is modelled as
+    # max(span_rate * S - otm_credit * OTM amount, min_rate * S) + exposure_rate * S;
+    # span_rate and otm_credit are refitted per instrument from exact margins
+    MARGIN_ESTIMATE_SPAN_RATE: float = 0.10
+    MARGIN_ESTIMATE_EXPOSURE_RATE: float = 0.02
+    MARGIN_ESTIMATE_OTM_CREDIT: float = 0.5
+    MARGIN_ESTIMATE_MIN_RATE: float = 0.02
+    MARGIN_ESTIMATE_MIN_SAMPLES: int = 20
+    MARGIN_ESTIMATE_MAX_SAMPLES: int = 2000
+    # Rows confirmed with span_margin in hybrid mode, best yield first
+    MARGIN_HYBRID_TOP_K: int = 10
+
+    # Bulk scans
+    BULK_MAX_ITEMS: int = 200
+    BULK_MAX_CONCURRENCY: int = 8
+
+    # Implied volatility and Greeks (Black-76 on the implied forward)
+    RISK_FREE_RATE: float = 0.065
+
+    # Yield screener
+    SCREENER_DEFAULT_TOP_K: int = 20
+    SCREENER_MAX_TOP_K: int = 500
+
+    # Option chain response cache
+    OPTION_CHAIN_CACHE_TTL_SECONDS: float = 3.0
+    OPTION_CHAIN_CACHE_MAX_ENTRIES: int = 256
+    OPTION_CHAIN_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+
+    # Symbol master cache
+    SYMBOL_MASTER_URL: str = "https://public.fyers.in/sym_details/NSE_FO_sym_master.json"
+    SYMBOL_MASTER_CACHE_DIR: str = ".cache"
+    SYMBOL_MASTER_TTL_SECONDS: int = 86400
+
+    # Background prefetch of popular chains, e.g. 'NIFTY:2030-01-30:PE,
+    # BANKNIFTY:2030-01-28' (side defaults to BOTH); empty disables it.
+    # Runs on weekdays within PREFETCH_MARKET_HOURS (IST), and only while
+    # the Fyers budgets have PREFETCH_MIN_HEADROOM of their burst unused
+    PREFETCH_WATCHLIST: str = ""
+    PREFETCH_INTERVAL_SECONDS: float = 3.0
+    PREFETCH_MARKET_HOURS: str = "09:00-15:30"
+    PREFETCH_MAX_CONCURRENCY: int = 2
+    PREFETCH_MIN_HEADROOM: float = 0.5
+
+    # History of computed option chains, appended to Parquet files under
+    # SNAPSHOT_STORE_DIR (partitioned by IST date and instrument). Off
+    # unless a directory is set, since nothing is ever deleted from it.
+    # Rows are written every FLUSH_INTERVAL seconds or once FLUSH_ROWS are
+    # pending, and dropped beyond MAX_PENDING_ROWS. Every COMPACT_INTERVAL
+    # seconds the files of past days are merged, and those of today once
+    # there are COMPACT_MIN_FILES of them
+    SNAPSHOT_STORE_DIR: str = ""
+    SNAPSHOT_FLUSH_INTERVAL_SECONDS: float = 5.0
+    SNAPSHOT_FLUSH_ROWS: int = 50000
+    SNAPSHOT_MAX_PENDING_ROWS: int = 500000
+    SNAPSHOT_COMPACT_INTERVAL_SECONDS: float = 600.0
+    SNAPSHOT_COMPACT_MIN_FILES: int = 32
+    SNAPSHOT_QUERY_MAX_ROWS: int = 200000
+
+    # Add a Server-Timing header with the per-stage breakdown to responses
+    SERVER_TIMING_HEADER: bool = False
+
+    # Live option chain subscriptions (WebSocket)
+    LIVE_POLL_INTERVAL_SECONDS: float = 3.0
+    LIVE_QUEUE_SIZE: int = 32
+    LIVE_MAX_SUBSCRIPTIONS_PER_CONNECTION: int = 20
+
     class Config:
         env_file = ".env"
 
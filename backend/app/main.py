@@ -1,21 +1,103 @@
 # backend/app/main.py
+import logging
+from contextlib import asynccontextmanager
+from functools import partial
 from fastapi import FastAPI
-from app.routers import option_chain  # Change to absolute import
+from app.routers import cache, metrics, option_chain, screener  # Change to absolute import
 from app.core.config import settings  # Change to absolute import
+from app.services.fyers import FyersService, FyersServiceError
+from app.services.live_chain import ChainSubscriptionManager
+from app.services.margin import SpanMarginClient
+from app.services.margin_estimator import MarginEstimator
+from app.services.prefetch import PrefetchScheduler, parse_watchlist
+from app.services.snapshot_store import SnapshotStore
+from app.services.symbol_master import symbol_master
+from app.utils.cache import AsyncTTLCache
+from app.utils.metrics import MetricsMiddleware
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create application-scoped clients shared by all requests"""
+    fyers_service = None
+    try:
+        fyers_service = FyersService()
+        # Warm up the token so the first request doesn't pay for a refresh
+        await fyers_service.authenticate()
+    except FyersServiceError as e:
+        if fyers_service is None:
+            logger.error(f"Fyers service unavailable, Fyers-backed endpoints will answer 503: {str(e)}")
+        else:
+            logger.error(f"Initial Fyers authentication failed, will retry on first request: {str(e)}")
+
+    margin_client = SpanMarginClient(auth_header=lambda: fyers_service.auth_header if fyers_service else "")
+
+    app.state.fyers_service = fyers_service
+    app.state.margin_client = margin_client
+    app.state.margin_estimator = MarginEstimator()
+    app.state.option_chain_cache = AsyncTTLCache(
+        ttl_seconds=settings.OPTION_CHAIN_CACHE_TTL_SECONDS,
+        max_entries=settings.OPTION_CHAIN_CACHE_MAX_ENTRIES,
+        max_bytes=settings.OPTION_CHAIN_CACHE_MAX_BYTES,
+        name="option_chain"
+    )
+    # Raw chains, shared by every page and window of the same fetch
+    app.state.chain_quote_cache = AsyncTTLCache(
+        ttl_seconds=settings.OPTION_CHAIN_CACHE_TTL_SECONDS,
+        max_entries=settings.OPTION_CHAIN_CACHE_MAX_ENTRIES,
+        max_bytes=settings.OPTION_CHAIN_CACHE_MAX_BYTES,
+        name="chain_quotes"
+    )
+    # Every computed chain is recorded for /option-chain/history
+    snapshot_store = SnapshotStore() if settings.SNAPSHOT_STORE_DIR else None
+    if snapshot_store is not None:
+        snapshot_store.start()
+    app.state.snapshot_store = snapshot_store
+    chain_subscriptions = ChainSubscriptionManager(fetch=partial(option_chain.fetch_live_chain, app.state))
+    app.state.chain_subscriptions = chain_subscriptions
+    # Prefetched chains are kept one interval longer than regular entries,
+    # so they are still cached when the next cycle replaces them
+    prefetch_scheduler = PrefetchScheduler(
+        refresh=partial(
+            option_chain.prefetch_chain, app.state,
+            ttl_seconds=settings.PREFETCH_INTERVAL_SECONDS + settings.OPTION_CHAIN_CACHE_TTL_SECONDS
+        ),
+        watchlist=parse_watchlist(settings.PREFETCH_WATCHLIST),
+        load_symbols=symbol_master.ensure_loaded
+    )
+    prefetch_scheduler.start()
+    app.state.prefetch_scheduler = prefetch_scheduler
+    yield
+    await prefetch_scheduler.close()
+    await chain_subscriptions.close()
+    if snapshot_store is not None:
+        await snapshot_store.close()
+    await margin_client.close()
+    if fyers_service is not None:
+        await fyers_service.close()
+    app.state.fyers_service = None
+    app.state.margin_client = None
+
 app = FastAPI(
     title="Options Trading Analysis API",
     version="1.0.0",
-    description="API for fetching option chain data and calculating margins and premiums."
+    description="API for fetching option chain data and calculating margins and premiums.",
+    lifespan=lifespan
 )
 
+app.add_middleware(MetricsMiddleware, timing_header=settings.SERVER_TIMING_HEADER)
+
 # Include routers
 app.include_router(option_chain.router, prefix="/api/v1")
+app.include_router(screener.router, prefix="/api/v1")
+app.include_router(cache.router, prefix="/api/v1")
+app.include_router(metrics.router)
 
 # You can add middleware or exception handlers here if needed
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("app.main:app", host=settings.api_host, port=settings.api_port, reload=True)
\ No newline at end of file
+    uvicorn.run("app.main:app", host=settings.api_host, port=settings.api_port, reload=True)
@@ -0,0 +1,19 @@
+from fastapi import APIRouter, Request
+from typing import Dict, Any
+
+router = APIRouter()
+
+@router.get("/cache/stats", response_model=Dict[str, Dict[str, Any]])
+async def cache_stats(request: Request):
+    """
+    Get hit/miss counters for the in-process caches.
+    
+    Returns:
+        Dict: Stats per cache, keyed by cache name
+    """
+    caches = [
+        request.app.state.option_chain_cache,
+        request.app.state.chain_quote_cache,
+        request.app.state.margin_client.cache
+    ]
+    return {cache.name: cache.stats() for cache in caches}
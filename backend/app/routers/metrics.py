@@ -0,0 +1,21 @@
+from fastapi import APIRouter, Request, Response
+
+from app.services.rate_limit import fyers_rate_limiter
+from app.utils.metrics import PROMETHEUS_CONTENT_TYPE, cache_metrics, rate_limit_metrics, registry
+
+router = APIRouter()
+
+@router.get("/metrics", response_class=Response, include_in_schema=False)
+async def metrics(request: Request):
+    """
+    Prometheus metrics: pipeline stage durations, request durations by
+    route, Fyers upstream requests, retries and rate limits, and cache
+    counters.
+    """
+    caches = [
+        request.app.state.option_chain_cache,
+        request.app.state.chain_quote_cache,
+        request.app.state.margin_client.cache
+    ]
+    content = registry.render() + cache_metrics(caches) + rate_limit_metrics(fyers_rate_limiter.stats())
+    return Response(content=content, media_type=PROMETHEUS_CONTENT_TYPE)
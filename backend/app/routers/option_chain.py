@@ -1,10 +1,51 @@
-from fastapi import APIRouter, HTTPException, status
-from typing import Optional, Dict, Any, List
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import StreamingResponse
+from typing import Optional, Dict, Any, AsyncIterator, List, Tuple
+import asyncio
+import base64
+import binascii
+import contextlib
+import json
 import logging
+import time
+import orjson
 from datetime import datetime
 from pandas.errors import EmptyDataError
+from pydantic import BaseModel, Field
 import pandas as pd
-from app.utils.calculations import get_option_chain_data, calculate_margin_and_premium
+from app.core.config import settings
+from app.services.fyers import FyersService
+from app.services.margin import SpanMarginClient
+from app.services.margin_estimator import MarginEstimator
+from app.services.snapshot_store import SnapshotStore, SnapshotStoreError
+from app.utils.cache import AsyncTTLCache
+from app.utils.calculations import (
+    DEFAULT_STRIKE_COUNT,
+    MARGIN_MODES,
+    apply_margin_and_premium,
+    find_atm_strike,
+    get_option_chain_data,
+    get_bulk_option_chain_data,
+    calculate_margin_and_premium,
+    iter_margin_updates,
+    select_strike_window
+)
+from app.utils.greeks import chain_greeks
+from app.utils.market_time import now_ist
+from app.utils.response_formats import (
+    ARROW,
+    COLUMNAR,
+    JSON,
+    ORJSON_OPTIONS,
+    PARQUET,
+    STREAM_MEDIA_TYPES,
+    encode_event,
+    frame_to_columns,
+    frame_to_records,
+    negotiate_format,
+    render_frame,
+    render_json
+)
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -12,6 +53,11 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+RESPONSE_COLUMNS = ['instrument_name', 'strike_price', 'option_type', 'bid/ask', 'margin', 'margin_available', 'margin_source', 'premium']
+
+# Fyers serves at most this many strikes on each side of ATM
+MAX_STRIKE_COUNT = 50
+
 class OptionChainError(Exception):
     """Base exception for option chain related errors"""
     pass
@@ -24,6 +70,99 @@ class DataFetchError(OptionChainError):
     """Raised when there's an error fetching option chain data"""
     pass
 
+class OptionChainQuery(BaseModel):
+    """One (instrument, expiry, side) combination in a bulk scan"""
+    instrument_name: str
+    expiry_date: str
+    side: str
+
+class BulkOptionChainRequest(BaseModel):
+    """Body of a bulk option chain scan"""
+    requests: List[OptionChainQuery] = Field(..., min_length=1)
+    combine: bool = False
+    strike_count: int = Field(DEFAULT_STRIKE_COUNT, ge=1, le=MAX_STRIKE_COUNT)
+
+def get_fyers_service(request: Request) -> FyersService:
+    """Return the application-scoped FyersService created in the lifespan"""
+    fyers_service = getattr(request.app.state, "fyers_service", None)
+    if fyers_service is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Fyers service is not available"
+        )
+    return fyers_service
+
+def get_margin_client(request: Request) -> SpanMarginClient:
+    """Return the application-scoped SPAN margin client"""
+    margin_client = getattr(request.app.state, "margin_client", None)
+    if margin_client is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Margin service is not available"
+        )
+    return margin_client
+
+def get_option_chain_cache(request: Request) -> AsyncTTLCache:
+    """Return the application-scoped option chain response cache"""
+    return request.app.state.option_chain_cache
+
+def get_chain_quote_cache(request: Request) -> AsyncTTLCache:
+    """Return the application-scoped raw option chain cache"""
+    return request.app.state.chain_quote_cache
+
+def get_margin_estimator(request: Request) -> Optional[MarginEstimator]:
+    """Return the application-scoped offline margin estimator"""
+    return getattr(request.app.state, "margin_estimator", None)
+
+def get_snapshot_store(request: Request) -> Optional[SnapshotStore]:
+    """Return the application-scoped snapshot store, if recording is enabled"""
+    return getattr(request.app.state, "snapshot_store", None)
+
+def response_cache_key(
+    instrument_name: str,
+    expiry_date: str,
+    side: str,
+    strike_count: int = DEFAULT_STRIKE_COUNT,
+    moneyness_range: Optional[float] = None,
+    page_size: Optional[int] = None,
+    cursor: Optional[str] = None,
+    margin_mode: str = 'exact',
+    confirm_top_k: Optional[int] = None
+) -> tuple:
+    """
+    Response cache key of an option chain request. Unpaginated exact
+    requests share entries across /option-chain, bulk, stream and live.
+    """
+    if margin_mode != 'hybrid':
+        confirm_top_k = None
+    return (
+        instrument_name, expiry_date, side, strike_count, moneyness_range,
+        page_size, cursor, margin_mode, confirm_top_k
+    )
+
+def encode_cursor(atm_strike: float, key: Tuple[float, float, int]) -> str:
+    """Encode the position after the last returned row as an opaque cursor"""
+    payload = json.dumps({"atm": atm_strike, "after": list(key)}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor: str) -> Tuple[float, Tuple[float, float, int]]:
+    """
+    Decode a cursor produced by `encode_cursor`.
+    
+    Returns:
+        Tuple of (ATM strike the pages are anchored to, sort key of the last
+        row already returned)
+        
+    Raises:
+        InvalidParameterError: If the cursor is malformed
+    """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        distance, strike, is_put = payload["after"]
+        return float(payload["atm"]), (float(distance), float(strike), int(is_put))
+    except (binascii.Error, ValueError, KeyError, TypeError) as e:
+        raise InvalidParameterError(f"Invalid cursor: {str(e)}")
+
 def validate_parameters(instrument_name: str, expiry_date: str, side: str) -> None:
     """Validate input parameters"""
     if not instrument_name or not isinstance(instrument_name, str):
@@ -35,8 +174,70 @@ def validate_parameters(instrument_name: str, expiry_date: str, side: str) -> No
     except ValueError:
         raise InvalidParameterError("Invalid expiry date format. Use YYYY-MM-DD")
     
-    if side.upper() not in ['CE', 'PE']:
-        raise InvalidParameterError("Side must be either 'CE' or 'PE'")
+    if side.upper() not in ['CE', 'PE', 'BOTH']:
+        raise InvalidParameterError("Side must be one of 'CE', 'PE' or 'BOTH'")
+
+async def compute_option_chain(
+    instrument_name: str,
+    expiry_date: str,
+    side: str,
+    fyers_service: FyersService,
+    margin_client: SpanMarginClient,
+    quote_cache: Optional[AsyncTTLCache] = None,
+    strike_count: int = DEFAULT_STRIKE_COUNT,
+    moneyness_range: Optional[float] = None,
+    page_size: Optional[int] = None,
+    cursor: Optional[str] = None,
+    margin_mode: str = 'exact',
+    estimator: Optional[MarginEstimator] = None,
+    confirm_top_k: int = settings.MARGIN_HYBRID_TOP_K,
+    snapshot_store: Optional[SnapshotStore] = None
+) -> Tuple[pd.DataFrame, Optional[str]]:
+    """
+    Run the full symbol, chain and margin pipeline for one request.
+    
+    Only the strikes inside the requested window and page are priced, so
+    later pages cost one margin round trip each instead of all up front.
+    See `calculate_margin_and_premium` for the margin modes. The priced
+    rows are queued on `snapshot_store`, if given.
+    
+    Returns:
+        Tuple of (priced rows, cursor for the next page or None)
+    """
+    after = None
+    if cursor:
+        cursor_atm, after = decode_cursor(cursor)
+
+    # Fetch option chain data; pages of the same chain share one fetch
+    fetch = lambda: get_option_chain_data(instrument_name, expiry_date, side, fyers_service, strike_count)
+    if quote_cache is None:
+        data, lot_size = await fetch()
+    else:
+        data, lot_size = await quote_cache.get_or_compute(
+            (instrument_name, expiry_date, side, strike_count), fetch
+        )
+    if data.empty:
+        raise DataFetchError("No data found for the specified parameters")
+
+    spot, atm_strike = find_atm_strike(data)
+    if cursor:
+        # Keep ordering pages around the ATM strike of the first page
+        atm_strike = cursor_atm
+
+    page, next_key = select_strike_window(data, spot, atm_strike, moneyness_range, page_size, after)
+    next_cursor = encode_cursor(atm_strike, next_key) if next_key is not None else None
+    if page.empty:
+        if cursor:
+            return page.reindex(columns=RESPONSE_COLUMNS), None
+        raise DataFetchError("No strikes found within the requested moneyness range")
+
+    # Calculate margin and premium
+    priced = await calculate_margin_and_premium(
+        page, lot_size, margin_client, margin_mode, estimator, confirm_top_k
+    )
+    if snapshot_store is not None:
+        snapshot_store.append(instrument_name, expiry_date, side, priced)
+    return priced, next_cursor
 
 @router.get("/option-chain", 
     response_model=List[Dict[str, Any]],
@@ -44,19 +245,56 @@ def validate_parameters(instrument_name: str, expiry_date: str, side: str) -> No
         200: {"description": "Successfully retrieved option chain data"},
         400: {"description": "Invalid parameters"},
         404: {"description": "Data not found"},
+        406: {"description": "Requested format not supported"},
         500: {"description": "Internal server error"}
     })
-def option_chain(instrument_name: str, expiry_date: str, side: str):
+async def option_chain(
+    request: Request,
+    instrument_name: str,
+    expiry_date: str,
+    side: str,
+    strike_count: int = Query(DEFAULT_STRIKE_COUNT, ge=1, le=MAX_STRIKE_COUNT),
+    moneyness_range: Optional[float] = Query(None, gt=0),
+    page_size: Optional[int] = Query(None, ge=1),
+    cursor: Optional[str] = None,
+    margin_mode: str = Query('exact', pattern=f"^({'|'.join(MARGIN_MODES)})$"),
+    confirm_top_k: int = Query(settings.MARGIN_HYBRID_TOP_K, ge=0),
+    include_greeks: bool = Query(False, alias="greeks"),
+    response_format: Optional[str] = Query(None, alias="format"),
+    fyers_service: FyersService = Depends(get_fyers_service),
+    margin_client: SpanMarginClient = Depends(get_margin_client),
+    cache: AsyncTTLCache = Depends(get_option_chain_cache),
+    quote_cache: AsyncTTLCache = Depends(get_chain_quote_cache),
+    estimator: Optional[MarginEstimator] = Depends(get_margin_estimator),
+    snapshot_store: Optional[SnapshotStore] = Depends(get_snapshot_store)
+):
     """
     Get option chain data for specified instrument and expiry date.
     
     Args:
         instrument_name (str): Name of the instrument
         expiry_date (str): Expiry date in YYYY-MM-DD format
-        side (str): Option type (CE/PE)
+        side (str): Option type (CE/PE), or BOTH for CE asks and PE bids
+            from a single chain fetch
+        strike_count (int): Number of strikes to fetch on each side of ATM
+        moneyness_range (float): Only return strikes within this fraction
+            of the underlying price (e.g. 0.05 for +/-5%)
+        page_size (int): Return at most this many rows, nearest ATM first;
+            the cursor for the next page is sent in the X-Next-Cursor header
+        cursor (str): X-Next-Cursor value of the previous page
+        margin_mode (str): 'exact' prices every row with span_margin,
+            'estimate' uses the offline estimator only, and 'hybrid'
+            estimates every row and confirms the best confirm_top_k rows by
+            premium/margin yield with span_margin
+        confirm_top_k (int): Rows confirmed in hybrid mode
+        greeks (bool): Add iv, delta, gamma, theta (per day) and vega (per
+            volatility point) columns, implied from the bid/ask quotes
+        format (str): json, columnar, arrow or parquet; overrides the
+            Accept header
         
     Returns:
-        List[Dict]: List of option chain records
+        List[Dict]: List of option chain records, or the same rows in the
+        negotiated columnar/binary format
     """
     request_id = datetime.now().strftime("%Y%m%d%H%M%S%f")
     logger.info(f"Request {request_id} - Processing option chain request for {instrument_name}, {expiry_date}, {side}")
@@ -64,22 +302,35 @@ def option_chain(instrument_name: str, expiry_date: str, side: str):
     try:
         # Validate input parameters
         validate_parameters(instrument_name, expiry_date, side)
+        fmt = negotiate_format(request, response_format)
         
-        # Fetch option chain data
-        data, lot_size = get_option_chain_data(instrument_name, expiry_date, side)
-        if data.empty:
-            raise DataFetchError("No data found for the specified parameters")
-            
-        # Calculate margin and premium
-        data = calculate_margin_and_premium(data, lot_size)
-        
-        # Select required columns
-        result_data = data[['instrument_name', 'strike_price', 'option_type', 'bid/ask', 'margin', 'premium']]
+        # Serve from cache, coalescing identical in-flight requests
+        data, next_cursor = await cache.get_or_compute(
+            response_cache_key(
+                instrument_name, expiry_date, side, strike_count, moneyness_range,
+                page_size, cursor, margin_mode, confirm_top_k
+            ),
+            lambda: compute_option_chain(
+                instrument_name, expiry_date, side, fyers_service, margin_client, quote_cache,
+                strike_count, moneyness_range, page_size, cursor, margin_mode, estimator, confirm_top_k,
+                snapshot_store
+            )
+        )
+        headers = {"X-Next-Cursor": next_cursor} if next_cursor is not None else None
         
-        response_data = result_data.to_dict(orient='records')
+        # Select required columns and encode them in the negotiated format.
+        # Greeks are computed per request, after the cache, so theta and the
+        # time to expiry stay current.
+        rows = data[RESPONSE_COLUMNS]
+        if include_greeks:
+            rows = pd.concat([rows, chain_greeks(data, expiry_date)], axis=1)
+        response = render_frame(rows, fmt, headers)
         logger.info(f"Request {request_id} - Successfully processed option chain request")
         
-        return response_data
+        return response
+        
+    except HTTPException:
+        raise
         
     except InvalidParameterError as e:
         logger.error(f"Request {request_id} - Invalid parameters: {str(e)}")
@@ -107,4 +358,438 @@ def option_chain(instrument_name: str, expiry_date: str, side: str):
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="An unexpected error occurred while processing your request"
-        )
\ No newline at end of file
+        )
+
+@router.get("/option-chain/history",
+    response_model=List[Dict[str, Any]],
+    responses={
+        200: {"description": "Successfully read recorded snapshots"},
+        400: {"description": "Invalid parameters"},
+        406: {"description": "Requested format not supported"},
+        500: {"description": "Internal server error"},
+        503: {"description": "Snapshot recording is disabled"}
+    })
+async def option_chain_history(
+    request: Request,
+    instrument_name: str,
+    start: datetime,
+    end: Optional[datetime] = None,
+    strike_price: Optional[float] = Query(None, gt=0),
+    option_type: Optional[str] = Query(None, pattern="^(CE|PE)$"),
+    expiry_date: Optional[str] = None,
+    columns: Optional[str] = None,
+    limit: int = Query(settings.SNAPSHOT_QUERY_MAX_ROWS, ge=1, le=settings.SNAPSHOT_QUERY_MAX_ROWS),
+    response_format: Optional[str] = Query(None, alias="format"),
+    snapshot_store: Optional[SnapshotStore] = Depends(get_snapshot_store)
+):
+    """
+    Read recorded option chain snapshots of an instrument over a time range.
+
+    Snapshots are recorded whenever /option-chain computes a chain and
+    become readable within SNAPSHOT_FLUSH_INTERVAL_SECONDS.
+
+    Args:
+        instrument_name (str): Name of the instrument
+        start (datetime): First snapshot time, ISO 8601; IST if no offset
+        end (datetime): Snapshot time to stop before; defaults to now
+        strike_price (float): Only rows of this strike
+        option_type (str): Only CE or PE rows
+        expiry_date (str): Only rows of this expiry, YYYY-MM-DD
+        columns (str): Comma separated columns to return, e.g.
+            'snapshot_at,bid/ask'; all by default
+        limit (int): Return at most this many rows; X-Truncated is set
+            when rows were left out
+        format (str): json, columnar, arrow or parquet; overrides the
+            Accept header
+
+    Returns:
+        List[Dict]: Snapshot rows ordered by snapshot time, or the same rows
+        in the negotiated columnar/binary format
+    """
+    try:
+        if snapshot_store is None:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Snapshot recording is disabled"
+            )
+        if expiry_date is not None:
+            validate_parameters(instrument_name, expiry_date, 'BOTH')
+        end = end or now_ist()
+        fmt = negotiate_format(request, response_format)
+        selected = [column.strip() for column in columns.split(',') if column.strip()] if columns else None
+
+        try:
+            rows, truncated = await asyncio.to_thread(
+                snapshot_store.query, instrument_name, start, end,
+                strike_price, option_type, expiry_date, selected, limit
+            )
+        except ValueError as e:
+            raise InvalidParameterError(str(e))
+
+        if fmt in (JSON, COLUMNAR) and 'snapshot_at' in rows:
+            rows['snapshot_at'] = rows['snapshot_at'].map(pd.Timestamp.isoformat)
+        return render_frame(rows, fmt, {"X-Truncated": "true"} if truncated else None)
+
+    except HTTPException:
+        raise
+
+    except InvalidParameterError as e:
+        logger.error(f"Invalid snapshot history parameters: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+
+    except SnapshotStoreError as e:
+        logger.error(f"Snapshot history read failed: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to read recorded snapshots"
+        )
+
+async def option_chain_events(
+    data: pd.DataFrame,
+    lot_size: int,
+    fmt: str,
+    margin_client: SpanMarginClient,
+    cache: AsyncTTLCache,
+    cache_key: tuple,
+    estimator: Optional[MarginEstimator] = None,
+    snapshot_store: Optional[SnapshotStore] = None,
+    item: Optional[Tuple[str, str, str]] = None
+) -> AsyncIterator[bytes]:
+    """
+    Events of a streamed option chain: the quoted rows first, then margin
+    updates as they resolve, then a summary. The fully priced chain is
+    stored in the response cache, and queued on `snapshot_store` under
+    `item` (instrument_name, expiry_date, side) if given, once every margin
+    is in.
+    """
+    started = time.perf_counter()
+    yield encode_event(fmt, "rows", frame_to_records(data[RESPONSE_COLUMNS]))
+
+    try:
+        async for update in iter_margin_updates(data, lot_size, margin_client, estimator):
+            yield encode_event(fmt, "margins", frame_to_records(update))
+    except Exception as e:
+        # Headers are long gone, so report the failure in-band
+        logger.error(f"Streaming margin calculation failed: {str(e)}", exc_info=True)
+        yield encode_event(fmt, "error", {"detail": "Margin calculation failed"})
+        return
+
+    cache.set(cache_key, (data, None))
+    if snapshot_store is not None and item is not None:
+        snapshot_store.append(*item, data)
+    yield encode_event(fmt, "done", {
+        "rows": len(data),
+        "margins_available": int(data['margin_available'].sum()),
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)
+    })
+
+@router.get("/option-chain/stream",
+    responses={
+        200: {"description": "Stream of rows, margin updates and a final summary"},
+        400: {"description": "Invalid parameters"},
+        404: {"description": "Data not found"},
+        406: {"description": "Requested format not supported"},
+        500: {"description": "Internal server error"}
+    })
+async def stream_option_chain(
+    request: Request,
+    instrument_name: str,
+    expiry_date: str,
+    side: str,
+    strike_count: int = Query(DEFAULT_STRIKE_COUNT, ge=1, le=MAX_STRIKE_COUNT),
+    moneyness_range: Optional[float] = Query(None, gt=0),
+    response_format: Optional[str] = Query(None, alias="format"),
+    fyers_service: FyersService = Depends(get_fyers_service),
+    margin_client: SpanMarginClient = Depends(get_margin_client),
+    cache: AsyncTTLCache = Depends(get_option_chain_cache),
+    quote_cache: AsyncTTLCache = Depends(get_chain_quote_cache),
+    estimator: Optional[MarginEstimator] = Depends(get_margin_estimator),
+    snapshot_store: Optional[SnapshotStore] = Depends(get_snapshot_store)
+):
+    """
+    Stream option chain data as soon as quotes are available.
+    
+    Takes the same parameters as /option-chain, minus pagination. The
+    response is NDJSON (one {"event", "data"} object per line) or, with
+    format=sse or Accept: text/event-stream, Server-Sent Events. Events:
+    
+    - rows: all rows, with margin 0.0 and margin_available false
+    - margins: rows priced by one span_margin response, keyed by
+      strike_price and option_type
+    - done: summary once every margin request has finished
+    - error: margin calculation failed midway
+    """
+    request_id = datetime.now().strftime("%Y%m%d%H%M%S%f")
+    logger.info(f"Request {request_id} - Processing streamed option chain request for {instrument_name}, {expiry_date}, {side}")
+
+    try:
+        validate_parameters(instrument_name, expiry_date, side)
+        fmt = negotiate_format(request, response_format, STREAM_MEDIA_TYPES)
+
+        # Quotes are fetched before the response starts, so failures still
+        # get a proper status code
+        data, lot_size = await quote_cache.get_or_compute(
+            (instrument_name, expiry_date, side, strike_count),
+            lambda: get_option_chain_data(instrument_name, expiry_date, side, fyers_service, strike_count)
+        )
+        if data.empty:
+            raise DataFetchError("No data found for the specified parameters")
+
+        spot, atm_strike = find_atm_strike(data)
+        data, _ = select_strike_window(data, spot, atm_strike, moneyness_range)
+        if data.empty:
+            raise DataFetchError("No strikes found within the requested moneyness range")
+        apply_margin_and_premium(data, {}, lot_size)
+
+    except HTTPException:
+        raise
+
+    except InvalidParameterError as e:
+        logger.error(f"Request {request_id} - Invalid parameters: {str(e)}")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    except DataFetchError as e:
+        logger.error(f"Request {request_id} - Data fetch error: {str(e)}")
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+
+    except Exception as e:
+        logger.error(f"Request {request_id} - Unexpected error: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="An unexpected error occurred while processing your request"
+        )
+
+    cache_key = response_cache_key(instrument_name, expiry_date, side, strike_count, moneyness_range)
+    return StreamingResponse(
+        option_chain_events(
+            data, lot_size, fmt, margin_client, cache, cache_key, estimator,
+            snapshot_store, (instrument_name, expiry_date, side)
+        ),
+        media_type=STREAM_MEDIA_TYPES[fmt],
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def fetch_live_chain(state: Any, key: Tuple[str, str, str]) -> pd.DataFrame:
+    """
+    Compute one tick of a live chain for the subscription manager, sharing
+    the response cache with /option-chain.
+    
+    Args:
+        state: Application state holding the shared clients and caches
+        key: (instrument_name, expiry_date, side)
+    """
+    data, _ = await state.option_chain_cache.get_or_compute(
+        response_cache_key(*key),
+        lambda: compute_option_chain(
+            *key, state.fyers_service, state.margin_client, state.chain_quote_cache,
+            estimator=getattr(state, "margin_estimator", None),
+            snapshot_store=getattr(state, "snapshot_store", None)
+        )
+    )
+    return data[RESPONSE_COLUMNS]
+
+async def prefetch_chain(state: Any, key: Tuple[str, str, str], ttl_seconds: float) -> None:
+    """
+    Recompute a watchlist chain for the prefetch scheduler.
+
+    A fresh chain is fetched and priced, then stored under the keys an
+    unpaginated /option-chain request (and the live and stream routes) look
+    up, for `ttl_seconds`. Other windows and pages of the chain reuse the
+    stored quotes and only pay for their margins.
+
+    Args:
+        state: Application state holding the shared clients and caches
+        key: (instrument_name, expiry_date, side)
+        ttl_seconds: How long the stored chain may be served
+    """
+    instrument_name, expiry_date, side = key
+    quotes = await get_option_chain_data(instrument_name, expiry_date, side, state.fyers_service)
+    state.chain_quote_cache.set((*key, DEFAULT_STRIKE_COUNT), quotes, ttl_seconds)
+    priced = await compute_option_chain(
+        instrument_name, expiry_date, side, state.fyers_service, state.margin_client, state.chain_quote_cache,
+        estimator=getattr(state, "margin_estimator", None),
+        snapshot_store=getattr(state, "snapshot_store", None)
+    )
+    state.option_chain_cache.set(response_cache_key(*key), priced, ttl_seconds)
+
+@router.websocket("/option-chain/ws")
+async def option_chain_ws(websocket: WebSocket):
+    """
+    Live option chain updates over a WebSocket.
+    
+    Clients send {"action": "subscribe" | "unsubscribe", "instrument_name",
+    "expiry_date", "side"}. For each subscription the server sends a
+    'snapshot' message with all rows, then a 'diff' message with 'upserts'
+    (new or changed rows) and 'removed' (strike_price/option_type keys)
+    whenever bid/ask, margin or premium change. Every chain is polled by one
+    shared loop, however many clients subscribe to it.
+    """
+    manager = websocket.app.state.chain_subscriptions
+    queue: asyncio.Queue = asyncio.Queue(maxsize=settings.LIVE_QUEUE_SIZE)
+    subscriptions = set()
+    await websocket.accept()
+
+    async def send_messages():
+        # The only task that writes to the socket, so messages never interleave
+        while True:
+            message = await queue.get()
+            try:
+                await websocket.send_text(orjson.dumps(message, option=ORJSON_OPTIONS).decode())
+            except (WebSocketDisconnect, RuntimeError):
+                # The client went away; the receive loop sees it too
+                return
+
+    sender = asyncio.create_task(send_messages())
+    try:
+        while True:
+            try:
+                message = await websocket.receive_json()
+                action = message.get("action")
+                key = (message["instrument_name"], message["expiry_date"], message["side"])
+                validate_parameters(*key)
+                if action not in ("subscribe", "unsubscribe"):
+                    raise InvalidParameterError("Action must be 'subscribe' or 'unsubscribe'")
+                if action == "subscribe" and key not in subscriptions \
+                        and len(subscriptions) >= settings.LIVE_MAX_SUBSCRIPTIONS_PER_CONNECTION:
+                    raise InvalidParameterError(
+                        f"At most {settings.LIVE_MAX_SUBSCRIPTIONS_PER_CONNECTION} subscriptions are allowed per connection"
+                    )
+            except (ValueError, KeyError, TypeError, AttributeError, InvalidParameterError) as e:
+                await queue.put({"type": "error", "detail": f"Invalid message: {str(e)}"})
+                continue
+
+            fields = dict(zip(('instrument_name', 'expiry_date', 'side'), key))
+            if action == "subscribe":
+                await queue.put({"type": "subscribed", **fields})
+                if key not in subscriptions:
+                    subscriptions.add(key)
+                    manager.subscribe(key, queue)
+            else:
+                if key in subscriptions:
+                    subscriptions.discard(key)
+                    manager.unsubscribe(key, queue)
+                await queue.put({"type": "unsubscribed", **fields})
+
+    except WebSocketDisconnect:
+        pass
+
+    finally:
+        for key in subscriptions:
+            manager.unsubscribe(key, queue)
+        sender.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await sender
+
+@router.post("/option-chain/bulk",
+    response_model=Dict[str, Any],
+    responses={
+        200: {"description": "Scan finished; per-item failures are reported inline"},
+        400: {"description": "Invalid request body"},
+        406: {"description": "Requested format not supported"},
+        503: {"description": "Symbol master unavailable"},
+        500: {"description": "Internal server error"}
+    })
+async def bulk_option_chain(
+    request: Request,
+    body: BulkOptionChainRequest,
+    response_format: Optional[str] = Query(None, alias="format"),
+    fyers_service: FyersService = Depends(get_fyers_service),
+    margin_client: SpanMarginClient = Depends(get_margin_client),
+    cache: AsyncTTLCache = Depends(get_option_chain_cache),
+    estimator: Optional[MarginEstimator] = Depends(get_margin_estimator),
+    snapshot_store: Optional[SnapshotStore] = Depends(get_snapshot_store)
+):
+    """
+    Scan option chains for many instruments, expiries and sides at once.
+    
+    Args:
+        body: List of (instrument_name, expiry_date, side) queries and
+            whether to combine all rows into one result set
+        format: json, columnar, arrow or parquet; overrides the Accept header
+        
+    Returns:
+        Dict: Either {'results': [...]} with one entry per query, or
+        {'data': [...], 'errors': [...]} when combine is set; both include
+        'stats' describing the upstream work done. Arrow and Parquet
+        responses always hold the combined rows, with 'errors' and 'stats'
+        in the schema metadata.
+    """
+    request_id = datetime.now().strftime("%Y%m%d%H%M%S%f")
+    logger.info(f"Request {request_id} - Processing bulk option chain request for {len(body.requests)} items")
+
+    if len(body.requests) > settings.BULK_MAX_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {settings.BULK_MAX_ITEMS} items are allowed per bulk request"
+        )
+    fmt = negotiate_format(request, response_format)
+
+    try:
+        results: Dict[int, Dict[str, Any]] = {}
+        to_compute: List[int] = []
+        items = [(query.instrument_name, query.expiry_date, query.side) for query in body.requests]
+
+        for position, item in enumerate(items):
+            try:
+                validate_parameters(*item)
+            except InvalidParameterError as e:
+                results[position] = dict(zip(('instrument_name', 'expiry_date', 'side'), item),
+                                         status_code=status.HTTP_400_BAD_REQUEST, error=str(e))
+                continue
+
+            # Shares entries with unpaginated /option-chain requests
+            cached = cache.get(response_cache_key(*item, body.strike_count))
+            if cached is not None:
+                results[position] = dict(zip(('instrument_name', 'expiry_date', 'side'), item),
+                                         status_code=status.HTTP_200_OK, data=cached[0])
+            else:
+                to_compute.append(position)
+
+        computed, stats = await get_bulk_option_chain_data(
+            [items[position] for position in to_compute], fyers_service, margin_client,
+            strike_count=body.strike_count, estimator=estimator, snapshot_store=snapshot_store
+        )
+        for position, result in zip(to_compute, computed):
+            if "data" in result:
+                cache.set(response_cache_key(*items[position], body.strike_count), (result["data"], None))
+            results[position] = result
+
+        stats["items"] = len(items)
+        stats["response_cache_hits"] = len(items) - len(to_compute) - sum(
+            1 for result in results.values() if result["status_code"] == status.HTTP_400_BAD_REQUEST
+        )
+        stats["errors"] = sum(1 for result in results.values() if "error" in result)
+
+        ordered = [results[position] for position in range(len(items))]
+        logger.info(f"Request {request_id} - Successfully processed bulk option chain request")
+
+        if body.combine or fmt in (ARROW, PARQUET):
+            frames = [
+                result["data"][RESPONSE_COLUMNS].assign(expiry_date=result["expiry_date"], side=result["side"])
+                for result in ordered if "data" in result
+            ]
+            combined = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=RESPONSE_COLUMNS)
+            errors = [
+                {key: result[key] for key in ('instrument_name', 'expiry_date', 'side', 'status_code', 'error')}
+                for result in ordered if "error" in result
+            ]
+            return render_frame(combined, fmt, metadata={"errors": errors, "stats": stats})
+
+        to_rows = frame_to_columns if fmt == COLUMNAR else frame_to_records
+        for result in ordered:
+            if "data" in result:
+                result["data"] = to_rows(result["data"][RESPONSE_COLUMNS])
+        return render_json({"results": ordered, "stats": stats})
+
+    except HTTPException:
+        raise
+
+    except Exception as e:
+        logger.error(f"Request {request_id} - Unexpected error: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="An unexpected error occurred while processing your request"
+        )
@@ -0,0 +1,145 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from typing import Optional, Dict, Any, List
+import logging
+from datetime import datetime
+from pydantic import BaseModel, Field
+from app.core.config import settings
+from app.routers.option_chain import (
+    MAX_STRIKE_COUNT,
+    InvalidParameterError,
+    get_fyers_service,
+    get_margin_client,
+    get_margin_estimator,
+    get_snapshot_store,
+    validate_parameters
+)
+from app.services.fyers import FyersService
+from app.services.margin import SpanMarginClient
+from app.services.margin_estimator import MarginEstimator
+from app.services.snapshot_store import SnapshotStore
+from app.utils.calculations import DEFAULT_STRIKE_COUNT, MARGIN_MODES, iter_bulk_option_chain_data
+from app.utils.response_formats import negotiate_format, render_frame
+from app.utils.screener import RANK_BY, TopKScreener, make_prefilter
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+class ScreenerRequest(BaseModel):
+    """Body of a premium-to-margin yield screen"""
+    instruments: List[str] = Field(..., min_length=1)
+    expiry_dates: List[str] = Field(..., min_length=1)
+    side: str = 'BOTH'
+    top_k: int = Field(settings.SCREENER_DEFAULT_TOP_K, ge=1, le=settings.SCREENER_MAX_TOP_K)
+    rank_by: str = Field('yield', pattern=f"^({'|'.join(RANK_BY)})$")
+    min_premium: Optional[float] = Field(None, ge=0)
+    max_margin: Optional[float] = Field(None, gt=0)
+    moneyness_range: Optional[float] = Field(None, gt=0)
+    strike_count: int = Field(DEFAULT_STRIKE_COUNT, ge=1, le=MAX_STRIKE_COUNT)
+    margin_mode: str = Field('exact', pattern=f"^({'|'.join(MARGIN_MODES)})$")
+
+@router.post("/screener",
+    response_model=Dict[str, Any],
+    responses={
+        200: {"description": "Best strikes by yield; per-item failures are reported inline"},
+        400: {"description": "Invalid request body"},
+        406: {"description": "Requested format not supported"},
+        503: {"description": "Symbol master or margin estimator unavailable"},
+        500: {"description": "Internal server error"}
+    })
+async def screener(
+    request: Request,
+    body: ScreenerRequest,
+    response_format: Optional[str] = Query(None, alias="format"),
+    fyers_service: FyersService = Depends(get_fyers_service),
+    margin_client: SpanMarginClient = Depends(get_margin_client),
+    estimator: Optional[MarginEstimator] = Depends(get_margin_estimator),
+    snapshot_store: Optional[SnapshotStore] = Depends(get_snapshot_store)
+):
+    """
+    Find the strikes with the best premium per unit of margin.
+
+    Every instrument is scanned for every expiry date. Rows outside the
+    moneyness range or below the minimum premium are dropped before margins
+    are requested; rows above the maximum margin are dropped after. Each
+    chain is pushed into the top-k heap as soon as it is priced.
+
+    Margins are exact SPAN margins unless margin_mode asks otherwise:
+    'estimate' ranks on offline estimates only, and 'hybrid' estimates
+    every row and confirms each chain's best top_k rows with span_margin.
+
+    Args:
+        body: Instruments, expiry dates, side, filters and the number of
+            rows to return
+        format: json, columnar, arrow or parquet; overrides the Accept header
+
+    Returns:
+        Dict: {'data': [...], 'errors': [...], 'stats': {...}} with 'data'
+        ranked by rank_by, best first. Each row has yield (premium /
+        margin), annualized_yield and margin_estimated, true where the
+        margin is an estimate rather than a SPAN margin.
+    """
+    request_id = datetime.now().strftime("%Y%m%d%H%M%S%f")
+    items = [
+        (instrument_name, expiry_date, body.side)
+        for instrument_name in dict.fromkeys(body.instruments)
+        for expiry_date in dict.fromkeys(body.expiry_dates)
+    ]
+    logger.info(f"Request {request_id} - Processing screener request for {len(items)} items")
+
+    if len(items) > settings.BULK_MAX_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {settings.BULK_MAX_ITEMS} instrument/expiry combinations are allowed per screen"
+        )
+
+    try:
+        for item in items:
+            validate_parameters(*item)
+    except InvalidParameterError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    fmt = negotiate_format(request, response_format)
+    if body.margin_mode != 'exact' and estimator is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Margin estimator is not available"
+        )
+
+    try:
+        # Each chain is pushed into the heap as soon as it is priced and then
+        # dropped. In hybrid mode only the rows that can reach the heap are
+        # priced exactly.
+        screen = TopKScreener(body.top_k, body.rank_by, body.min_premium, body.max_margin)
+        errors = []
+        stats: Dict[str, Any] = {}
+        async for result in iter_bulk_option_chain_data(
+            items, fyers_service, margin_client, stats,
+            strike_count=body.strike_count,
+            estimator=estimator,
+            prefilter=make_prefilter(body.moneyness_range, body.min_premium),
+            margin_mode=body.margin_mode,
+            confirm_top_k=body.top_k,
+            snapshot_store=snapshot_store
+        ):
+            if "error" in result:
+                errors.append({
+                    key: result[key] for key in ('instrument_name', 'expiry_date', 'side', 'status_code', 'error')
+                })
+            else:
+                screen.push(result)
+        stats.update(screen.counts)
+
+        logger.info(f"Request {request_id} - Successfully processed screener request")
+        return render_frame(screen.frame(), fmt, metadata={"errors": errors, "stats": stats})
+
+    except HTTPException:
+        raise
+
+    except Exception as e:
+        logger.error(f"Request {request_id} - Unexpected error: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="An unexpected error occurred while processing your request"
+        )
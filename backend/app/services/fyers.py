@@ -1,17 +1,25 @@
-from fyers_apiv3 import fyersModel
-import requests
+import aiohttp
+import asyncio
 import time
 import json
 import os
+import socket
+import uuid
 import pandas as pd
 import logging
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Awaitable, Callable, List, Tuple
 from app.core.config import settings
+from app.services.rate_limit import FyersRateLimiter, check_status, fyers_rate_limiter
+from app.services.token_store import TokenStore, TokenStoreError
+from app.utils.metrics import record_upstream, stage
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Option chain fields used downstream
+CHAIN_COLUMNS = ['ask', 'bid', 'ltp', 'option_type', 'strike_price', 'symbol']
+
 class FyersServiceError(Exception):
     """Base exception for FyersService related errors"""
     pass
@@ -28,61 +36,245 @@ class OptionChainError(FyersServiceError):
     """Raised when option chain data fetch fails"""
     pass
 
+class TokenManager:
+    """
+    Keeps the Fyers access token fresh.
+
+    The token is refreshed `margin_seconds` before it expires, and concurrent
+    callers that find it due for refresh share one in-flight refresh instead
+    of each hitting the refresh endpoint.
+
+    With a `store`, the token is shared with every other worker process:
+    it is re-read from the store every `sync_seconds`, so workers pick up a
+    token another worker refreshed, and refreshing takes the store's lease,
+    so only one worker refreshes at a time while the others wait for its
+    result.
+    """
+
+    def __init__(
+        self,
+        access_token: str,
+        expires_at: float,
+        refresh_fn: Callable[[], Awaitable[Tuple[str, float]]],
+        margin_seconds: int = settings.FYERS_TOKEN_REFRESH_MARGIN_SECONDS,
+        store: Optional[TokenStore] = None,
+        sync_seconds: float = settings.FYERS_TOKEN_STORE_SYNC_SECONDS,
+        lease_seconds: float = settings.FYERS_TOKEN_REFRESH_LEASE_SECONDS
+    ):
+        self._access_token = access_token
+        self._expires_at = float(expires_at or 0)
+        self._refresh_fn = refresh_fn
+        self.margin_seconds = margin_seconds
+        self._lock = asyncio.Lock()
+        self._generation = 0
+        self._last_error: Optional[Exception] = None
+        self.store = store
+        self.sync_seconds = sync_seconds
+        self.lease_seconds = lease_seconds
+        self._next_sync = 0.0
+        self._holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    @property
+    def access_token(self) -> str:
+        return self._access_token
+
+    @property
+    def expires_at(self) -> float:
+        return self._expires_at
+
+    def needs_refresh(self) -> bool:
+        """Check whether the token is missing or about to expire"""
+        return not self._access_token or time.time() >= self._expires_at - self.margin_seconds
+
+    async def get_access_token(self) -> str:
+        """Return a valid access token, refreshing it first if needed"""
+        if self.store is not None and time.monotonic() >= self._next_sync:
+            await self.sync()
+        if self.needs_refresh():
+            return await self.refresh()
+        return self._access_token
+
+    async def sync(self) -> None:
+        """Adopt the stored token if it outlives ours"""
+        self._next_sync = time.monotonic() + self.sync_seconds
+        try:
+            stored = await asyncio.to_thread(self.store.load)
+        except TokenStoreError as e:
+            logger.warning(f"Using the in-process token: {str(e)}")
+            return
+        if stored is not None and stored.expires_at > self._expires_at:
+            self._access_token, self._expires_at = stored
+
+    async def refresh(self) -> str:
+        """
+        Refresh the access token, joining a refresh already in flight.
+
+        Raises:
+            TokenRefreshError: If the refresh this call waited on failed
+        """
+        generation = self._generation
+
+        async with self._lock:
+            if self._generation != generation:
+                # Another caller finished a refresh while we were waiting
+                if self._last_error is not None:
+                    raise TokenRefreshError(f"Token refresh failed: {str(self._last_error)}")
+                return self._access_token
+
+            if self.store is not None:
+                # Another worker may have refreshed already
+                await self.sync()
+            if not self.needs_refresh():
+                return self._access_token
+
+            try:
+                if self.store is None:
+                    self._access_token, self._expires_at = await self._refresh_fn()
+                else:
+                    self._access_token, self._expires_at = await self._refresh_shared()
+                self._last_error = None
+                return self._access_token
+            except Exception as e:
+                self._last_error = e
+                raise
+            finally:
+                self._generation += 1
+
+    async def _refresh_shared(self) -> Tuple[str, float]:
+        """Refresh under the store's lease, or wait for the worker holding it"""
+        deadline = time.monotonic() + 2 * self.lease_seconds
+        while True:
+            try:
+                leased = await asyncio.to_thread(self.store.acquire_lease, self._holder, self.lease_seconds)
+            except TokenStoreError as e:
+                logger.warning(f"Refreshing without the shared lease: {str(e)}")
+                return await self._refresh_fn()
+
+            if leased:
+                try:
+                    # The previous holder may have refreshed just before releasing the lease
+                    try:
+                        stored = await asyncio.to_thread(self.store.load)
+                    except TokenStoreError as e:
+                        logger.warning(f"Refreshing without checking the shared token: {str(e)}")
+                        stored = None
+                    if stored is not None and time.time() < stored.expires_at - self.margin_seconds:
+                        return stored
+                    access_token, expires_at = await self._refresh_fn()
+                    try:
+                        await asyncio.to_thread(self.store.save, access_token, expires_at)
+                    except TokenStoreError as e:
+                        # Other workers refresh on their own; this token is still good
+                        logger.warning(f"Failed to share the refreshed access token: {str(e)}")
+                    return access_token, expires_at
+                finally:
+                    await asyncio.to_thread(self.store.release_lease, self._holder)
+
+            # The lease lapses if its holder dies, so we get our turn eventually
+            if time.monotonic() >= deadline:
+                raise TokenRefreshError("Timed out waiting for another worker to refresh the token")
+            await asyncio.sleep(min(1.0, self.lease_seconds / 10))
+            try:
+                stored = await asyncio.to_thread(self.store.load)
+            except TokenStoreError as e:
+                logger.warning(f"Refreshing without the shared token: {str(e)}")
+                return await self._refresh_fn()
+            if stored is not None and time.time() < stored.expires_at - self.margin_seconds:
+                logger.info("Using the access token refreshed by another worker")
+                return stored
+
+
 class FyersService:
+    """
+    Application-scoped async Fyers client.
+
+    One instance is created in the FastAPI lifespan and shared by all
+    requests; it owns the token manager and a keep-alive HTTP session that
+    every Fyers REST call goes through. Endpoint URLs come from settings, so
+    the service can be pointed at a mock server. Calls count against the
+    per-endpoint budgets of `rate_limiter` and are retried by it. The access
+    token is shared with other worker processes through `token_store`.
+    Must be created from within a running event loop.
+    """
     BASE_URL = "https://api.fyers.in"
     
-    def __init__(self):
+    def __init__(
+        self,
+        rate_limiter: FyersRateLimiter = fyers_rate_limiter,
+        token_store: Optional[TokenStore] = None
+    ):
         try:
+            self.rate_limiter = rate_limiter
             self.client_id = settings.FYERS_CLIENT_ID
             self.client_id_hash = settings.FYERS_CLIENT_ID_HASH
             self.refresh_token = settings.FYERS_REFRESH_TOKEN
             self.pin = settings.FYERS_PIN
-            self.access_token = settings.FYERS_ACCESS_TOKEN
-            self.token_expires_at = settings.FYERS_TOKEN_EXPIRES_AT
 
             if not all([self.client_id, self.client_id_hash, self.refresh_token, self.pin]):
                 raise AuthenticationError("Missing required credentials in settings")
 
-            self.fyers = fyersModel.FyersModel(
-                client_id=self.client_id, 
-                token=self.access_token,
-                is_async=False, 
-                log_path=""
+            self.token_manager = TokenManager(
+                access_token=settings.FYERS_ACCESS_TOKEN,
+                expires_at=settings.FYERS_TOKEN_EXPIRES_AT,
+                refresh_fn=self.refresh_access_token,
+                store=token_store or TokenStore(settings.FYERS_TOKEN_STORE_PATH)
+            )
+            self.session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=settings.FYERS_REQUEST_TIMEOUT_SECONDS)
             )
-            
-            self.authenticate()
             
         except Exception as e:
             logger.error(f"Failed to initialize FyersService: {str(e)}", exc_info=True)
             raise FyersServiceError(f"Service initialization failed: {str(e)}")
 
-    def authenticate(self) -> None:
-        """Authenticate with Fyers API"""
+    async def close(self) -> None:
+        """Close the shared HTTP session"""
+        await self.session.close()
+
+    @property
+    def access_token(self) -> str:
+        return self.token_manager.access_token
+
+    @property
+    def token_expires_at(self) -> float:
+        return self.token_manager.expires_at
+
+    @property
+    def auth_header(self) -> str:
+        """Authorization header value for direct Fyers REST calls"""
+        return f"{self.client_id}:{self.token_manager.access_token}"
+
+    async def authenticate(self) -> str:
+        """
+        Ensure a valid access token.
+
+        Returns:
+            The current access token
+
+        Raises:
+            AuthenticationError: If the token cannot be refreshed
+        """
         try:
-            current_time = time.time()
-            logger.info(f"Checking token status - Current time: {current_time}, Expires at: {self.token_expires_at}")
-            
-            if not self.access_token or current_time >= float(self.token_expires_at):
-                logger.info("Access token missing or expired, initiating refresh...")
-                self.refresh_access_token()
-            else:
-                logger.info("Access token is valid, initializing FyersModel...")
-                self.fyers = fyersModel.FyersModel(
-                    client_id=self.client_id, 
-                    token=self.access_token, 
-                    is_async=False
-                )
+            return await self.token_manager.get_access_token()
                 
         except Exception as e:
             logger.error(f"Authentication failed: {str(e)}", exc_info=True)
             raise AuthenticationError(f"Failed to authenticate: {str(e)}")
 
-    def refresh_access_token(self) -> None:
-        """Refresh the access token"""
+    async def refresh_access_token(self) -> Tuple[str, float]:
+        """
+        Refresh the access token.
+
+        Called by the token manager; use `token_manager.refresh()` instead of
+        calling this directly so concurrent refreshes are coalesced.
+
+        Returns:
+            Tuple of (access token, expiry timestamp)
+        """
         logger.info("Initiating access token refresh...")
         
         try:
-            url = 'https://api-t1.fyers.in/api/v3/validate-refresh-token'
+            url = f"{settings.FYERS_API_URL}/validate-refresh-token"
             headers = {'Content-Type': 'application/json'}
             data = {
                 'grant_type': 'refresh_token',
@@ -91,47 +283,57 @@ class FyersService:
                 'pin': self.pin
             }
             
-            response = requests.post(url, headers=headers, json=data)
-            response.raise_for_status()  # Raises HTTPError for bad responses
-            
-            try:
-                response_data = response.json()
-            except json.JSONDecodeError as e:
-                logger.error(f"Failed to decode API response: {response.text}")
-                raise TokenRefreshError(f"Invalid JSON response: {str(e)}")
+            async def attempt() -> Dict[str, Any]:
+                status_code = "error"
+                try:
+                    async with self.session.post(url, headers=headers, json=data) as response:
+                        status_code = response.status
+                        check_status(response)
+                        response.raise_for_status()  # Raises ClientResponseError for bad responses
+
+                        try:
+                            return await response.json(content_type=None)
+                        except json.JSONDecodeError as e:
+                            logger.error(f"Failed to decode API response: {await response.text()}")
+                            raise TokenRefreshError(f"Invalid JSON response: {str(e)}")
+                finally:
+                    record_upstream("refresh", status_code)
+
+            response_data = await self.rate_limiter.call("refresh", attempt)
 
             if not response_data.get("access_token"):
                 raise TokenRefreshError("No access token in response")
 
-            self.access_token = response_data["access_token"]
+            access_token = response_data["access_token"]
             expires_in = response_data.get("expires_in", 86400)
-            self.token_expires_at = time.time() + expires_in - 60
+            token_expires_at = time.time() + expires_in - 60
 
-            self.save_tokens()
+            await asyncio.to_thread(self.save_tokens, access_token, token_expires_at)
             
             logger.info("Access token refreshed successfully")
-            self.fyers = fyersModel.FyersModel(
-                client_id=self.client_id, 
-                token=self.access_token, 
-                is_async=False
-            )
+            return access_token, token_expires_at
             
-        except requests.exceptions.RequestException as e:
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
             logger.error(f"HTTP request failed during token refresh: {str(e)}", exc_info=True)
             raise TokenRefreshError(f"Failed to refresh token: {str(e)}")
         except Exception as e:
             logger.error(f"Unexpected error during token refresh: {str(e)}", exc_info=True)
             raise TokenRefreshError(f"Token refresh failed: {str(e)}")
 
-    def save_tokens(self) -> None:
-        """Save tokens to settings and .env file"""
+    def save_tokens(self, access_token: str, token_expires_at: float) -> None:
+        """
+        Save tokens to settings and the .env file, for restarts.
+
+        Other workers get the token from the shared token store, which the
+        token manager writes.
+        """
         try:
-            settings.FYERS_ACCESS_TOKEN = self.access_token
-            settings.FYERS_TOKEN_EXPIRES_AT = str(int(self.token_expires_at))
+            settings.FYERS_ACCESS_TOKEN = access_token
+            settings.FYERS_TOKEN_EXPIRES_AT = int(token_expires_at)
 
             self.update_env_file({
-                "FYERS_ACCESS_TOKEN": self.access_token,
-                "FYERS_TOKEN_EXPIRES_AT": str(int(self.token_expires_at))
+                "FYERS_ACCESS_TOKEN": access_token,
+                "FYERS_TOKEN_EXPIRES_AT": str(int(token_expires_at))
             })
             logger.info("Tokens saved successfully")
             
@@ -152,9 +354,12 @@ class FyersService:
 
             env_vars.update(new_vars)
 
-            with open('.env', 'w') as f:
+            # Write a sibling file and rename it over .env, so readers never see a partial file
+            tmp_path = f".env.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
                 for key, value in env_vars.items():
                     f.write(f"{key}={value}\n")
+            os.replace(tmp_path, '.env')
                     
             logger.info(".env file updated successfully")
             
@@ -162,7 +367,7 @@ class FyersService:
             logger.error(f"Failed to update .env file: {str(e)}", exc_info=True)
             raise FyersServiceError(f"Failed to update .env file: {str(e)}")
     
-    def get_option_chain(self, symbol: str, strike_count: int) -> Optional[pd.DataFrame]:
+    async def get_option_chain(self, symbol: str, strike_count: int) -> Optional[pd.DataFrame]:
         """
         Get option chain data for a symbol
         
@@ -182,13 +387,36 @@ class FyersService:
             if not symbol or not isinstance(strike_count, int):
                 raise ValueError("Invalid symbol or strike_count")
 
-            data = {
+            with stage("authenticate"):
+                await self.authenticate()
+
+            params = {
                 "symbol": symbol,
                 "strikecount": strike_count,
                 "timestamp": ""
             }
+            headers = {"Authorization": self.auth_header, "version": "3"}
+
+            async def attempt() -> Dict[str, Any]:
+                status_code = "error"
+                try:
+                    async with self.session.get(
+                        f"{settings.FYERS_DATA_URL}/options-chain-v3", params=params, headers=headers
+                    ) as http_response:
+                        status_code = http_response.status
+                        check_status(http_response)
+                        # Error responses carry a JSON body with the reason as well
+                        response = await http_response.json(content_type=None)
+                        if not isinstance(response, dict):
+                            http_response.raise_for_status()
+                            raise OptionChainError("Unexpected option chain response")
+                        return response
+                finally:
+                    record_upstream("optionchain", status_code)
 
-            response = self.fyers.optionchain(data=data)
+            # Includes time spent waiting for the rate budget and retrying
+            with stage("chain_fetch"):
+                response = await self.rate_limiter.call("optionchain", attempt)
             
             if response.get("s") != "ok":
                 error_msg = response.get("message", "Unknown error")
@@ -198,12 +426,8 @@ class FyersService:
             if not data or "optionsChain" not in data:
                 raise OptionChainError("No options chain data in response")
 
-            options_chain_df = pd.DataFrame(data["optionsChain"])
-            
-            # Apply filters and transformations
-            options_chain_df = options_chain_df[options_chain_df['ask'] != 0]
-            options_chain_df = options_chain_df[['ask', 'bid', 'option_type', 'strike_price', 'symbol']]
-            options_chain_df = options_chain_df.iloc[1:]
+            with stage("chain_parse"):
+                options_chain_df = await asyncio.to_thread(self._build_chain_frame, data["optionsChain"])
             
             logger.info(f"Successfully retrieved option chain data for {symbol}")
             return options_chain_df
@@ -213,4 +437,14 @@ class FyersService:
             raise OptionChainError(f"Failed to process option chain data: {str(e)}")
         except Exception as e:
             logger.error(f"Unexpected error getting option chain for {symbol}: {str(e)}", exc_info=True)
-            raise OptionChainError(f"Failed to get option chain: {str(e)}")
\ No newline at end of file
+            raise OptionChainError(f"Failed to get option chain: {str(e)}")
+
+    @staticmethod
+    def _build_chain_frame(options_chain: List[Dict[str, Any]]) -> pd.DataFrame:
+        """
+        Build the option chain DataFrame (CPU-bound, run off the event loop).
+
+        Only the columns the pipeline uses are materialized; filtering is left
+        to the single vectorized pass in `get_highest_option_prices`.
+        """
+        return pd.DataFrame.from_records(options_chain, columns=CHAIN_COLUMNS)
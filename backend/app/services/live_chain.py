@@ -0,0 +1,180 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from app.core.config import settings
+from app.utils.response_formats import frame_to_records
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# (instrument_name, expiry_date, side)
+ChainKey = Tuple[str, str, str]
+
+ROW_KEY = ['strike_price', 'option_type']
+WATCHED_COLUMNS = ['bid/ask', 'margin', 'margin_available', 'premium']
+
+
+def diff_chain(
+    previous: Optional[pd.DataFrame],
+    current: pd.DataFrame
+) -> Tuple[pd.DataFrame, List[Dict[str, Any]]]:
+    """
+    Compare two snapshots of the same chain.
+
+    Rows are matched on strike_price and option_type.
+
+    Returns:
+        Tuple of (rows of `current` that are new or whose bid/ask, margin,
+        margin_available or premium changed; keys of rows that disappeared)
+    """
+    if previous is None:
+        return current, []
+
+    merged = current[ROW_KEY + WATCHED_COLUMNS].merge(
+        previous[ROW_KEY + WATCHED_COLUMNS],
+        on=ROW_KEY,
+        how='left',
+        suffixes=('', '_previous'),
+        indicator=True
+    )
+    changed = (merged['_merge'] == 'left_only').to_numpy()
+    for column in WATCHED_COLUMNS:
+        new = merged[column]
+        old = merged[f'{column}_previous']
+        changed = changed | ~((new == old) | (new.isna() & old.isna())).to_numpy()
+
+    current_keys = pd.MultiIndex.from_frame(current[ROW_KEY])
+    previous_keys = pd.MultiIndex.from_frame(previous[ROW_KEY])
+    removed = [dict(zip(ROW_KEY, key)) for key in previous_keys.difference(current_keys)]
+
+    return current[changed], removed
+
+
+class _Chain:
+    """Polling state of one subscribed chain"""
+
+    def __init__(self):
+        # subscriber queue -> whether it still needs a full snapshot
+        self.subscribers: Dict[asyncio.Queue, bool] = {}
+        self.snapshot: Optional[pd.DataFrame] = None
+        self.task: Optional[asyncio.Task] = None
+
+
+class ChainSubscriptionManager:
+    """
+    Fans out live option chain updates to any number of subscribers.
+
+    Each subscribed (instrument, expiry, side) chain is polled by a single
+    loop, however many clients watch it; the loop starts with the first
+    subscriber and stops with the last. New subscribers get a full snapshot,
+    then only the rows that changed on each tick.
+
+    Subscribers are bounded queues, one per connection. If a queue is full
+    the update is dropped for that subscriber and it is sent a fresh
+    snapshot instead once there is room, so slow clients never hold up the
+    loop or see a gap in the diffs.
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[ChainKey], Awaitable[pd.DataFrame]],
+        interval_seconds: float = settings.LIVE_POLL_INTERVAL_SECONDS
+    ):
+        self.fetch = fetch
+        self.interval_seconds = interval_seconds
+        self._chains: Dict[ChainKey, _Chain] = {}
+
+    def subscriber_count(self, key: ChainKey) -> int:
+        """Number of subscribers watching a chain"""
+        chain = self._chains.get(key)
+        return len(chain.subscribers) if chain else 0
+
+    def is_polling(self, key: ChainKey) -> bool:
+        """Whether a polling loop is running for a chain"""
+        chain = self._chains.get(key)
+        return chain is not None and chain.task is not None and not chain.task.done()
+
+    def subscribe(self, key: ChainKey, queue: asyncio.Queue) -> None:
+        """Start delivering updates of a chain to `queue`"""
+        chain = self._chains.get(key)
+        if chain is None:
+            chain = self._chains[key] = _Chain()
+            chain.task = asyncio.create_task(self._poll(key, chain))
+            logger.info(f"Started live polling for {key}")
+
+        chain.subscribers[queue] = True
+        if chain.snapshot is not None:
+            self._deliver(key, chain, queue, None)
+
+    def unsubscribe(self, key: ChainKey, queue: asyncio.Queue) -> None:
+        """Stop delivering updates of a chain to `queue`"""
+        chain = self._chains.get(key)
+        if chain is None:
+            return
+
+        chain.subscribers.pop(queue, None)
+        if not chain.subscribers:
+            del self._chains[key]
+            chain.task.cancel()
+            logger.info(f"Stopped live polling for {key}")
+
+    async def close(self) -> None:
+        """Stop every polling loop"""
+        tasks = [chain.task for chain in self._chains.values()]
+        self._chains.clear()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _poll(self, key: ChainKey, chain: _Chain) -> None:
+        while True:
+            try:
+                previous, chain.snapshot = chain.snapshot, await self.fetch(key)
+                diff = None
+                if previous is not None:
+                    upserts, removed = diff_chain(previous, chain.snapshot)
+                    diff = self._message(key, "diff", upserts=frame_to_records(upserts), removed=removed)
+                for queue in list(chain.subscribers):
+                    self._deliver(key, chain, queue, diff)
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                detail = getattr(e, 'detail', None) or str(e)
+                logger.error(f"Live polling failed for {key}: {detail}")
+                error = self._message(key, "error", detail=detail)
+                for queue in chain.subscribers:
+                    self._put(queue, error)
+
+            await asyncio.sleep(self.interval_seconds)
+
+    def _deliver(self, key: ChainKey, chain: _Chain, queue: asyncio.Queue, diff: Optional[Dict[str, Any]]) -> None:
+        """Send a subscriber a diff, or a snapshot if it is not in sync"""
+        if chain.subscribers.get(queue):
+            snapshot = self._message(key, "snapshot", data=frame_to_records(chain.snapshot))
+            chain.subscribers[queue] = not self._put(queue, snapshot)
+        elif diff is not None and (diff["upserts"] or diff["removed"]):
+            chain.subscribers[queue] = not self._put(queue, diff)
+
+    @staticmethod
+    def _put(queue: asyncio.Queue, message: Dict[str, Any]) -> bool:
+        try:
+            queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    @staticmethod
+    def _message(key: ChainKey, message_type: str, **fields: Any) -> Dict[str, Any]:
+        instrument_name, expiry_date, side = key
+        return {
+            "type": message_type,
+            "instrument_name": instrument_name,
+            "expiry_date": expiry_date,
+            "side": side,
+            **fields
+        }
@@ -0,0 +1,378 @@
+import asyncio
+import logging
+import math
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+import aiohttp
+
+from app.core.config import settings
+from app.services.rate_limit import FyersRateLimiter, check_status, fyers_rate_limiter
+from app.utils.cache import AsyncTTLCache
+from app.utils.market_time import parse_times_of_day, seconds_until_next
+from app.utils.metrics import UPSTREAM_RETRIES, record_upstream
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SPAN_MARGIN_URL = settings.FYERS_SPAN_MARGIN_URL
+
+# (symbol, qty) of a short option position
+Position = Tuple[str, int]
+
+# (underlying price, option price) a position is priced at
+PricePoint = Tuple[float, float]
+
+
+class MarginServiceError(Exception):
+    """Base exception for margin service related errors"""
+    pass
+
+
+class SpanMarginClient:
+    """
+    Async, batched client for the Fyers SPAN margin endpoint.
+
+    Requests share one keep-alive connection pool and run concurrently, at
+    most `max_concurrency` at a time, each bounded by `timeout` seconds.
+    Symbols are packed into chunks of `chunk_size` legs per request. Results
+    that the batch response reports per symbol are mapped straight back;
+    symbols the batch rejects or leaves out are retried one per request.
+    If the endpoint turns out to answer multi-leg requests with a successful
+    single basket total, batching is switched off for the lifetime of the
+    client; error replies only send their own chunk to per-symbol requests.
+
+    Fetched margins are cached per (symbol, qty, side, type, productType)
+    for `cache_ttl_seconds`, and never past the next IST time of day listed
+    in `invalidate_at`, since SPAN parameters change far less often than
+    quotes do. Callers that pass the current prices of their positions only
+    get a cached margin back while the underlying and the option have moved
+    less than `reprice_underlying_move` and `reprice_option_move` (relative)
+    from the prices it was computed at; beyond that it is recomputed.
+
+    Every request counts against the span_margin budget of `rate_limiter`,
+    which also retries throttled and failed requests.
+
+    Must be created and used from within a running event loop.
+    """
+
+    def __init__(
+        self,
+        auth_header: Callable[[], str],
+        chunk_size: int = settings.MARGIN_BATCH_SIZE,
+        timeout: float = settings.MARGIN_REQUEST_TIMEOUT_SECONDS,
+        max_concurrency: int = settings.MARGIN_MAX_CONCURRENCY,
+        pool_size: int = settings.MARGIN_POOL_SIZE,
+        url: str = SPAN_MARGIN_URL,
+        cache_ttl_seconds: float = settings.MARGIN_CACHE_TTL_SECONDS,
+        cache_max_entries: int = settings.MARGIN_CACHE_MAX_ENTRIES,
+        invalidate_at: str = settings.MARGIN_CACHE_INVALIDATE_AT,
+        reprice_underlying_move: float = settings.MARGIN_REPRICE_UNDERLYING_MOVE,
+        reprice_option_move: float = settings.MARGIN_REPRICE_OPTION_MOVE,
+        rate_limiter: FyersRateLimiter = fyers_rate_limiter
+    ):
+        self.auth_header = auth_header
+        self.rate_limiter = rate_limiter
+        self.chunk_size = max(1, chunk_size)
+        self.url = url
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=pool_size, keepalive_timeout=60),
+            timeout=aiohttp.ClientTimeout(total=timeout)
+        )
+        self._semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        # None until a multi-leg response tells us whether it is itemized
+        self._itemized: Optional[bool] = None
+        self.cache = AsyncTTLCache(
+            ttl_seconds=cache_ttl_seconds,
+            max_entries=cache_max_entries,
+            name="margin"
+        )
+        self.invalidate_at = parse_times_of_day(invalidate_at)
+        self.reprice_underlying_move = reprice_underlying_move
+        self.reprice_option_move = reprice_option_move
+
+    async def close(self) -> None:
+        """Close the underlying connection pool"""
+        await self.session.close()
+
+    @staticmethod
+    def cache_key(leg: Dict[str, Any]) -> tuple:
+        """Cache key for a margin leg"""
+        return (leg["symbol"], leg["qty"], leg["side"], leg["type"], leg["productType"])
+
+    @staticmethod
+    def build_leg(symbol: str, qty: int) -> Dict[str, Any]:
+        """Build one short-option leg of a span_margin payload"""
+        return {
+            "symbol": symbol,
+            "qty": qty,
+            "side": -1,
+            "type": 2,
+            "productType": "INTRADAY",
+            "limitPrice": 0.0,
+            "stopLoss": 0.0
+        }
+
+    async def get_margins(self, symbols: Sequence[str], qty: int) -> Dict[str, float]:
+        """
+        Get the SPAN margin for selling `qty` of each symbol.
+
+        Args:
+            symbols: Option symbols to price
+            qty: Quantity per symbol (normally the lot size)
+
+        Returns:
+            Dict of symbol -> margin for every symbol a margin was obtained for.
+            Symbols missing from the result failed and have been logged.
+        """
+        margins = await self.get_position_margins([(symbol, qty) for symbol in symbols])
+        return {symbol: margin for (symbol, _), margin in margins.items()}
+
+    async def get_position_margins(
+        self,
+        positions: Sequence[Position],
+        stats: Optional[Dict[str, int]] = None,
+        prices: Optional[Dict[Position, PricePoint]] = None,
+        reused: Optional[Set[Position]] = None
+    ) -> Dict[Position, float]:
+        """
+        Get the SPAN margin for a set of (symbol, qty) short positions.
+
+        Positions with different quantities (e.g. from several instruments)
+        are packed into the same batches.
+
+        Args:
+            positions: (symbol, qty) pairs to price
+            stats: Optional dict whose 'margin_cache_hits',
+                'margin_repriced' and 'margin_http_calls' counters are
+                incremented
+            prices: Optional current (underlying, option) prices per
+                position, used to decide whether a cached margin is still
+                good
+            reused: Optional set that receives the positions served from
+                the cache
+
+        Returns:
+            Dict of (symbol, qty) -> margin for every position priced.
+            Positions missing from the result failed and have been logged.
+        """
+        margins: Dict[Position, float] = {}
+        async for resolved, from_cache in self.iter_position_margins(positions, stats, prices):
+            margins.update(resolved)
+            if from_cache and reused is not None:
+                reused.update(resolved)
+        return margins
+
+    async def iter_position_margins(
+        self,
+        positions: Sequence[Position],
+        stats: Optional[Dict[str, int]] = None,
+        prices: Optional[Dict[Position, PricePoint]] = None
+    ) -> AsyncIterator[Tuple[Dict[Position, float], bool]]:
+        """
+        Yield margins for a set of (symbol, qty) short positions as they resolve.
+
+        Cached margins come first in one dict, followed by one dict per
+        completed span_margin request. Closing the iterator early cancels the
+        requests still in flight.
+
+        Args:
+            positions: (symbol, qty) pairs to price
+            stats: Optional dict whose 'margin_cache_hits',
+                'margin_repriced' and 'margin_http_calls' counters are
+                incremented
+            prices: Optional current (underlying, option) prices per
+                position, used to decide whether a cached margin is still
+                good
+
+        Yields:
+            Tuples of (dict of (symbol, qty) -> margin, whether the margins
+            came from the cache). Positions that never appear failed and
+            have been logged.
+        """
+        stats = {} if stats is None else stats
+        prices = prices or {}
+        cached: Dict[Position, float] = {}
+        to_fetch: List[Position] = []
+        repriced = 0
+
+        for position in dict.fromkeys(positions):
+            entry = self.cache.get(self.cache_key(self.build_leg(*position)))
+            if entry is None:
+                to_fetch.append(position)
+            elif not self._is_reusable(entry[1], prices.get(position)):
+                to_fetch.append(position)
+                repriced += 1
+            else:
+                cached[position] = entry[0]
+        stats['margin_cache_hits'] = stats.get('margin_cache_hits', 0) + len(cached)
+        stats['margin_repriced'] = stats.get('margin_repriced', 0) + repriced
+
+        if cached:
+            yield cached, True
+
+        if to_fetch:
+            ttl = self._cache_ttl()
+            async for fetched in self._iter_fetch(to_fetch, stats):
+                for position, margin in fetched.items():
+                    self.cache.set(
+                        self.cache_key(self.build_leg(*position)),
+                        (margin, prices.get(position)),
+                        ttl_seconds=ttl
+                    )
+                yield fetched, False
+
+    def _is_reusable(self, priced_at: Optional[PricePoint], price: Optional[PricePoint]) -> bool:
+        """Whether a margin computed at `priced_at` still holds at `price`"""
+        if priced_at is None or price is None:
+            return True
+        return (
+            self._relative_move(priced_at[0], price[0]) <= self.reprice_underlying_move
+            and self._relative_move(priced_at[1], price[1]) <= self.reprice_option_move
+        )
+
+    @staticmethod
+    def _relative_move(then: float, now: float) -> float:
+        """Relative price change, ignoring prices that are unknown"""
+        if not (math.isfinite(then) and math.isfinite(now)):
+            return 0.0
+        if then <= 0:
+            return 0.0 if now <= 0 else math.inf
+        return abs(now / then - 1)
+
+    def _cache_ttl(self) -> float:
+        """Entry TTL, cut short at the next scheduled invalidation time"""
+        until_invalidation = seconds_until_next(self.invalidate_at)
+        if until_invalidation is None:
+            return self.cache.ttl_seconds
+        return min(self.cache.ttl_seconds, until_invalidation)
+
+    async def _iter_fetch(
+        self,
+        positions: List[Position],
+        stats: Dict[str, int]
+    ) -> AsyncIterator[Dict[Position, float]]:
+        """
+        Fetch margins from the API, batching where the endpoint allows it,
+        and yield each request's results as soon as it completes
+        """
+        # task -> (positions it prices, whether it is a multi-leg batch)
+        tasks: Dict[asyncio.Task, Tuple[List[Position], bool]] = {}
+
+        def request_singly(pending: List[Position]) -> None:
+            logger.info(f"Requesting margin individually for {len(pending)} symbols")
+            for position in pending:
+                tasks[asyncio.ensure_future(self._request_single(position, stats))] = ([position], False)
+
+        if self.chunk_size > 1 and self._itemized is not False and len(positions) > 1:
+            for start in range(0, len(positions), self.chunk_size):
+                chunk = positions[start:start + self.chunk_size]
+                tasks[asyncio.ensure_future(self._request_batch(chunk, stats))] = (chunk, True)
+        else:
+            request_singly(positions)
+
+        try:
+            while tasks:
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    chunk, is_batch = tasks.pop(task)
+                    if is_batch:
+                        margins = task.result()
+                        pending = [position for position in chunk if position not in margins]
+                        if pending:
+                            UPSTREAM_RETRIES.inc(len(pending), endpoint="span_margin")
+                            request_singly(pending)
+                    else:
+                        margin = task.result()
+                        margins = {chunk[0]: margin} if margin is not None else {}
+
+                    if margins:
+                        yield margins
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _post(self, legs: List[Dict[str, Any]], stats: Dict[str, int]) -> Dict[str, Any]:
+        headers = {
+            "Authorization": self.auth_header(),
+            "Content-Type": "application/json"
+        }
+
+        async def attempt() -> Dict[str, Any]:
+            async with self._semaphore:
+                stats['margin_http_calls'] = stats.get('margin_http_calls', 0) + 1
+                status_code = "error"
+                try:
+                    async with self.session.post(self.url, headers=headers, json={"data": legs}) as response:
+                        status_code = response.status
+                        check_status(response)
+                        response.raise_for_status()
+                        margin_data = await response.json(content_type=None)
+                finally:
+                    record_upstream("span_margin", status_code)
+            if not isinstance(margin_data, dict):
+                raise MarginServiceError(f"Unexpected span_margin response: {type(margin_data).__name__}")
+            return margin_data
+
+        return await self.rate_limiter.call("span_margin", attempt)
+
+    async def _request_batch(self, chunk: List[Position], stats: Dict[str, int]) -> Dict[Position, float]:
+        """Request margins for a chunk, returning only per-position results"""
+        try:
+            margin_data = await self._post([self.build_leg(*position) for position in chunk], stats)
+            return self._parse_itemized(margin_data, chunk)
+
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, MarginServiceError) as e:
+            logger.error(f"Batch margin request failed for {len(chunk)} symbols: {str(e)}")
+            return {}
+
+    def _parse_itemized(self, margin_data: Dict[str, Any], chunk: List[Position]) -> Dict[Position, float]:
+        """Extract per-position margins from a multi-leg response"""
+        if not isinstance(margin_data, dict):
+            return {}
+        data = margin_data.get('data')
+        entries: Dict[str, Any] = {}
+
+        if isinstance(data, list):
+            entries = {item.get('symbol'): item for item in data if isinstance(item, dict)}
+        elif isinstance(data, dict):
+            entries = {symbol: data[symbol] for symbol, _ in chunk if isinstance(data.get(symbol), dict)}
+
+        if not entries:
+            # Only a successful basket-only reply settles the question; an
+            # error body just sends this chunk to per-symbol requests
+            basket_only = (
+                margin_data.get('s') == 'ok' and isinstance(data, dict) and 'total' in data
+                and not any(isinstance(value, dict) for value in data.values())
+            )
+            if basket_only:
+                if self._itemized is None:
+                    logger.info("span_margin returns basket totals only, falling back to per-symbol requests")
+                self._itemized = False
+            return {}
+
+        self._itemized = True
+        margins = {}
+        for position in chunk:
+            total = (entries.get(position[0]) or {}).get('total')
+            if total:
+                margins[position] = float(total)
+        return margins
+
+    async def _request_single(self, position: Position, stats: Dict[str, int]) -> Optional[float]:
+        """Request the margin for one position, logging and returning None on failure"""
+        symbol = position[0]
+        try:
+            margin_data = await self._post([self.build_leg(*position)], stats)
+
+            total = (margin_data.get('data') or {}).get('total')
+            if not total:
+                logger.warning(f"No margin data received for symbol {symbol}")
+                return None
+            return float(total)
+
+        except (aiohttp.ClientError, asyncio.TimeoutError, MarginServiceError) as e:
+            logger.error(f"API error for symbol {symbol}: {str(e)}")
+        except Exception as e:
+            logger.error(f"Calculation error for symbol {symbol}: {str(e)}")
+        return None
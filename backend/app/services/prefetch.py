@@ -0,0 +1,162 @@
+import asyncio
+import logging
+from datetime import datetime, time as dtime
+from typing import Awaitable, Callable, List, Optional, Sequence, Tuple
+
+from app.core.config import settings
+from app.services.live_chain import ChainKey
+from app.services.rate_limit import FyersRateLimiter, fyers_rate_limiter
+from app.utils.market_time import now_ist, parse_time_range, seconds_until_trading
+from app.utils.metrics import PREFETCH_REFRESHES
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Budgets a chain refresh draws on
+PREFETCH_ENDPOINTS = ("optionchain", "span_margin")
+
+
+def parse_watchlist(spec: str) -> List[ChainKey]:
+    """
+    Parse a comma separated watchlist of 'INSTRUMENT:YYYY-MM-DD[:SIDE]'.
+
+    Args:
+        spec: e.g. 'NIFTY:2030-01-30:PE,BANKNIFTY:2030-01-28'; side
+            defaults to BOTH, an empty string gives an empty list
+
+    Raises:
+        ValueError: If an entry is malformed
+    """
+    watchlist = []
+    for entry in filter(None, (part.strip() for part in spec.split(','))):
+        fields = [field.strip() for field in entry.split(':')]
+        if len(fields) not in (2, 3) or not fields[0]:
+            raise ValueError(f"Watchlist entry {entry!r} is not INSTRUMENT:YYYY-MM-DD[:SIDE]")
+        datetime.strptime(fields[1], '%Y-%m-%d')
+        side = fields[2].upper() if len(fields) == 3 else 'BOTH'
+        if side not in ('CE', 'PE', 'BOTH'):
+            raise ValueError(f"Watchlist entry {entry!r} has side {side!r}, not CE, PE or BOTH")
+        key = (fields[0], fields[1], side)
+        if key not in watchlist:
+            watchlist.append(key)
+    return watchlist
+
+
+class PrefetchScheduler:
+    """
+    Keeps a watchlist of option chains warm in the background.
+
+    Every `interval_seconds` during trading hours (weekdays within
+    `market_hours`, IST), the symbol master is loaded if stale and each
+    watchlist chain is recomputed through `refresh`, which stores the
+    result where /option-chain looks for it. Outside trading hours the loop
+    sleeps until the next session.
+
+    Prefetching is optional work, so it never competes with requests for
+    the Fyers budget: at most `max_concurrency` chains refresh at once, and
+    a cycle stops early, deferring its remaining chains to the front of the
+    next cycle, as soon as an endpoint a refresh draws on is throttled or
+    has less than `min_headroom` of its burst unused.
+    """
+
+    def __init__(
+        self,
+        refresh: Callable[[ChainKey], Awaitable[None]],
+        watchlist: Sequence[ChainKey],
+        load_symbols: Optional[Callable[[], Awaitable[None]]] = None,
+        interval_seconds: float = settings.PREFETCH_INTERVAL_SECONDS,
+        market_hours: Tuple[dtime, dtime] = parse_time_range(settings.PREFETCH_MARKET_HOURS),
+        max_concurrency: int = settings.PREFETCH_MAX_CONCURRENCY,
+        min_headroom: float = settings.PREFETCH_MIN_HEADROOM,
+        rate_limiter: FyersRateLimiter = fyers_rate_limiter,
+        clock: Callable[[], datetime] = now_ist
+    ):
+        self.refresh = refresh
+        self.watchlist = list(watchlist)
+        self.load_symbols = load_symbols
+        self.interval_seconds = interval_seconds
+        self.market_hours = market_hours
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_headroom = min_headroom
+        self.rate_limiter = rate_limiter
+        self.clock = clock
+        self._task: Optional[asyncio.Task] = None
+        # Position the next cycle starts from, so deferred chains go first
+        self._start = 0
+
+    def start(self) -> None:
+        """Start the background loop; a no-op with an empty watchlist"""
+        if self.watchlist and self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Prefetching {len(self.watchlist)} watchlist chains every {self.interval_seconds}s")
+
+    async def close(self) -> None:
+        """Stop the background loop"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def has_headroom(self) -> bool:
+        """Whether every budget a refresh draws on has room to spare"""
+        return all(self.rate_limiter.has_headroom(endpoint, self.min_headroom) for endpoint in PREFETCH_ENDPOINTS)
+
+    async def run_cycle(self) -> int:
+        """
+        Refresh the watchlist once.
+
+        Returns:
+            Number of chains refreshed successfully
+        """
+        if self.load_symbols is not None:
+            try:
+                await self.load_symbols()
+            except Exception as e:
+                logger.error(f"Prefetch could not load the symbol master: {str(e)}")
+                PREFETCH_REFRESHES.inc(len(self.watchlist), status="error")
+                return 0
+
+        pending = self.watchlist[self._start:] + self.watchlist[:self._start]
+        refreshed = 0
+
+        async def worker() -> None:
+            nonlocal refreshed
+            while pending:
+                if not self.has_headroom():
+                    return
+                key = pending.pop(0)
+                try:
+                    await self.refresh(key)
+                    refreshed += 1
+                    PREFETCH_REFRESHES.inc(status="ok")
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    detail = getattr(e, 'detail', None) or str(e)
+                    logger.error(f"Prefetch failed for {key}: {detail}")
+                    PREFETCH_REFRESHES.inc(status="error")
+
+        await asyncio.gather(*(worker() for _ in range(min(self.max_concurrency, len(pending)))))
+        if pending:
+            logger.info(f"Prefetch deferred {len(pending)} chains to leave Fyers budget for requests")
+            PREFETCH_REFRESHES.inc(len(pending), status="deferred")
+            self._start = self.watchlist.index(pending[0])
+        return refreshed
+
+    async def _run(self) -> None:
+        while True:
+            wait = seconds_until_trading(self.market_hours, self.clock())
+            if wait > 0:
+                logger.info(f"Prefetch paused until the next session, {wait / 3600:.1f}h from now")
+                await asyncio.sleep(wait)
+                continue
+
+            try:
+                await self.run_cycle()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Prefetch cycle failed: {str(e)}", exc_info=True)
+
+            await asyncio.sleep(self.interval_seconds)
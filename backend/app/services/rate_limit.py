@@ -0,0 +1,221 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+
+import aiohttp
+
+from app.core.config import settings
+from app.utils.metrics import UPSTREAM_RETRIES
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class RetryableStatusError(aiohttp.ClientError):
+    """
+    Raised by a request attempt on HTTP 429 or 5xx.
+
+    A subclass of aiohttp.ClientError, so callers that already handle
+    client errors handle exhausted retries the same way.
+    """
+
+    def __init__(self, status: int, retry_after: Optional[float] = None, message: str = ""):
+        super().__init__(f"HTTP {status}{': ' + message if message else ''}")
+        self.status = status
+        self.retry_after = retry_after
+
+    @property
+    def throttled(self) -> bool:
+        return self.status == 429
+
+
+def check_status(response: aiohttp.ClientResponse) -> None:
+    """Raise RetryableStatusError if a response asks to be retried"""
+    if response.status == 429 or response.status >= 500:
+        raise RetryableStatusError(response.status, parse_retry_after(response.headers.get("Retry-After")))
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds from a Retry-After header; HTTP dates are ignored"""
+    try:
+        return max(0.0, float(value)) if value else None
+    except ValueError:
+        return None
+
+
+def parse_rate_limits(spec: str) -> Dict[str, float]:
+    """
+    Parse 'endpoint=requests_per_second' pairs.
+
+    Args:
+        spec: e.g. 'optionchain=10,span_margin=10'
+
+    Raises:
+        ValueError: If an entry is malformed or not positive
+    """
+    limits = {}
+    for entry in filter(None, (part.strip() for part in spec.split(','))):
+        endpoint, _, rate = entry.partition('=')
+        limits[endpoint.strip()] = float(rate)
+        if limits[endpoint.strip()] <= 0:
+            raise ValueError(f"Rate limit for {endpoint} must be positive")
+    return limits
+
+
+class AdaptiveTokenBucket:
+    """
+    Token bucket whose rate adapts to upstream throttling.
+
+    Tokens refill at the current rate up to a one-second burst. Callers
+    reserve a token and sleep until it is theirs, so waiting callers are
+    served in order without a lock. A throttled response halves the rate
+    (never below `min_rate`) and pauses the bucket for the Retry-After
+    delay; every successful call adds back a twentieth of `max_rate`. The
+    rate thus settles just below where the upstream starts throttling.
+    """
+
+    def __init__(self, max_rate: float, min_rate: Optional[float] = None):
+        self.max_rate = max_rate
+        self.min_rate = min(min_rate or max_rate * settings.FYERS_RATE_LIMIT_MIN_FRACTION, max_rate)
+        self.rate = max_rate
+        self.capacity = max(1.0, max_rate)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def available(self) -> float:
+        """Tokens that could be taken right now without waiting"""
+        now = time.monotonic()
+        self._refill(now)
+        return self._tokens if now >= self._paused_until else 0.0
+
+    def reserve(self) -> float:
+        """Take a token, returning how long to wait before using it"""
+        now = time.monotonic()
+        self._refill(now)
+        self._tokens -= 1
+        wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        return max(wait, self._paused_until - now)
+
+    async def acquire(self) -> None:
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def throttled(self, retry_after: Optional[float] = None) -> None:
+        """Slow down after the upstream rejected a call as over its limit"""
+        self.rate = max(self.min_rate, self.rate / 2)
+        # Outstanding tokens were granted at the old rate
+        self._tokens = min(self._tokens, 0.0)
+        if retry_after:
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+
+    def succeeded(self) -> None:
+        """Recover towards the configured rate"""
+        if self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+class FyersRateLimiter:
+    """
+    Client-side budget, retries and backoff for every Fyers call.
+
+    Each endpoint gets its own adaptive token bucket, sized by
+    FYERS_RATE_LIMITS; endpoints without a budget are not limited. Calls
+    are retried on HTTP 429/5xx and connection errors, with full-jitter
+    exponential backoff that honours Retry-After.
+
+    One instance is shared by every client in the process, so the budgets
+    are per worker process.
+    """
+
+    def __init__(
+        self,
+        limits: Optional[Dict[str, float]] = None,
+        max_retries: int = settings.FYERS_RETRY_ATTEMPTS,
+        base_delay: float = settings.FYERS_RETRY_BASE_DELAY_SECONDS,
+        max_delay: float = settings.FYERS_RETRY_MAX_DELAY_SECONDS
+    ):
+        limits = parse_rate_limits(settings.FYERS_RATE_LIMITS) if limits is None else limits
+        self.buckets = {endpoint: AdaptiveTokenBucket(rate) for endpoint, rate in limits.items()}
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def backoff(self, retry: int, retry_after: Optional[float] = None) -> float:
+        """Delay before retry number `retry` (0-based)"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** retry))
+        return max(delay, retry_after or 0.0)
+
+    async def call(self, endpoint: str, attempt: Callable[[], Awaitable[T]]) -> T:
+        """
+        Run a request attempt within the endpoint's budget, retrying it.
+
+        Args:
+            endpoint: Budget the call counts against
+            attempt: Makes one request; raises RetryableStatusError for
+                responses worth retrying
+
+        Returns:
+            Result of the first successful attempt
+
+        Raises:
+            The last attempt's exception once retries are exhausted, or
+            any non-retryable exception straight away
+        """
+        bucket = self.buckets.get(endpoint)
+        last_error: Exception
+        retry_after = None
+        for retry in range(max(self.max_retries, 0) + 1):
+            if retry:
+                UPSTREAM_RETRIES.inc(endpoint=endpoint)
+                await asyncio.sleep(self.backoff(retry - 1, retry_after))
+            if bucket is not None:
+                await bucket.acquire()
+
+            try:
+                result = await attempt()
+            except RetryableStatusError as e:
+                if e.throttled and bucket is not None:
+                    bucket.throttled(e.retry_after)
+                    logger.warning(f"Fyers {endpoint} throttled, slowing to {bucket.rate:.2f} requests/s")
+                last_error, retry_after = e, e.retry_after
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                last_error, retry_after = e, None
+            else:
+                if bucket is not None:
+                    bucket.succeeded()
+                return result
+
+        raise last_error
+
+    def has_headroom(self, endpoint: str, fraction: float) -> bool:
+        """
+        Whether an endpoint has spare budget for optional work.
+
+        True if the endpoint is not limited, or is running at its full rate
+        with at least `fraction` of its burst unused.
+        """
+        bucket = self.buckets.get(endpoint)
+        if bucket is None:
+            return True
+        return bucket.rate >= bucket.max_rate and bucket.available() >= fraction * bucket.capacity
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Current and configured rate per endpoint"""
+        return {
+            endpoint: {"rate": bucket.rate, "max_rate": bucket.max_rate, "min_rate": bucket.min_rate}
+            for endpoint, bucket in self.buckets.items()
+        }
+
+
+fyers_rate_limiter = FyersRateLimiter()
@@ -0,0 +1,475 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+from urllib.parse import quote
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+try:
+    import fcntl
+except ImportError:  # Windows: workers may compact concurrently, so compaction is skipped
+    fcntl = None
+
+from app.core.config import settings
+from app.utils.market_time import IST, now_ist
+from app.utils.metrics import SNAPSHOT_ROWS
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_SCHEMA = pa.schema([
+    ('snapshot_at', pa.timestamp('us', tz='UTC')),
+    ('expiry_date', pa.string()),
+    ('side', pa.string()),
+    ('strike_price', pa.float64()),
+    ('option_type', pa.string()),
+    ('bid/ask', pa.float64()),
+    ('margin', pa.float64()),
+    ('margin_available', pa.bool_()),
+    ('margin_source', pa.string()),
+    ('premium', pa.float64()),
+])
+SNAPSHOT_COLUMNS = SNAPSHOT_SCHEMA.names
+# Columns taken from the priced chain; the rest describe the snapshot
+ROW_COLUMNS = SNAPSHOT_COLUMNS[3:]
+
+PART_PREFIX = "part-"
+COMPACTED_PREFIX = "compacted-"
+COMPACT_ROW_GROUP_ROWS = 128 * 1024
+
+# (taken at, instrument, expiry date, side, priced rows)
+BufferedSnapshot = Tuple[datetime, str, str, str, pd.DataFrame]
+
+
+class SnapshotStoreError(Exception):
+    """Raised when snapshots cannot be read from the store"""
+    pass
+
+
+def _ist(value: datetime) -> datetime:
+    # Naive times are market times
+    return value.replace(tzinfo=IST) if value.tzinfo is None else value.astimezone(IST)
+
+
+
+def _merge_by_time(streams: Iterable[Iterator[pa.RecordBatch]]) -> Iterator[pa.Table]:
+    """
+    K-way merge of record batch streams that are each ordered by snapshot_at.
+
+    Holds one batch per stream. Every round emits, in snapshot order, the
+    rows of all streams up to the earliest last timestamp among the held
+    batches: no stream can still produce a row before that one.
+    """
+    heads: List[Tuple[pa.RecordBatch, np.ndarray, Iterator[pa.RecordBatch]]] = []
+
+    def advance(stream: Iterator[pa.RecordBatch]) -> None:
+        for batch in stream:
+            if batch.num_rows:
+                heads.append((batch, batch.column('snapshot_at').to_numpy(), stream))
+                return
+
+    for stream in streams:
+        advance(iter(stream))
+    while heads:
+        horizon = min(times[-1] for _, times, _ in heads)
+        parts: List[pa.RecordBatch] = []
+        held = heads
+        heads = []
+        for batch, times, stream in held:
+            cut = int(np.searchsorted(times, horizon, side='right'))
+            parts.append(batch.slice(0, cut))
+            if cut < batch.num_rows:
+                heads.append((batch.slice(cut), times[cut:], stream))
+            else:
+                advance(stream)
+        # Stable, so rows of one timestamp keep their file order
+        yield pa.Table.from_batches(parts).sort_by('snapshot_at')
+
+
+class SnapshotStore:
+    """
+    Append-only history of computed option chains, as Parquet files.
+
+    Files are partitioned by IST date and instrument:
+
+        root/date=2026-10-16/instrument=NIFTY/part-<ms>-<pid>-<id>.parquet
+
+    `append` only queues the priced rows, so the request path never waits
+    on disk: a background task writes them every `flush_interval_seconds`,
+    or as soon as `flush_rows` rows are pending, one file per partition per
+    flush. Rows beyond `max_pending_rows` (the disk cannot keep up) are
+    dropped rather than buffered without bound.
+
+    Every `compact_interval_seconds`, the part files of past days are merged
+    into one file per partition, and those of today once there are
+    `compact_min_files` of them. Only one worker process compacts at a time.
+
+    Every data file is ordered by snapshot time. `query` picks the partition
+    directories of a time range up front and streams each day's files
+    through a k-way merge on snapshot time, reading only the requested
+    columns and the rows that pass the filters. It holds one record batch
+    per file, and a limited query stops reading once it has its rows.
+    """
+
+    def __init__(
+        self,
+        root: str = settings.SNAPSHOT_STORE_DIR,
+        flush_interval_seconds: float = settings.SNAPSHOT_FLUSH_INTERVAL_SECONDS,
+        flush_rows: int = settings.SNAPSHOT_FLUSH_ROWS,
+        max_pending_rows: int = settings.SNAPSHOT_MAX_PENDING_ROWS,
+        compact_interval_seconds: float = settings.SNAPSHOT_COMPACT_INTERVAL_SECONDS,
+        compact_min_files: int = settings.SNAPSHOT_COMPACT_MIN_FILES,
+        clock=now_ist
+    ):
+        self.root = root
+        self.flush_interval_seconds = flush_interval_seconds
+        self.flush_rows = flush_rows
+        self.max_pending_rows = max_pending_rows
+        self.compact_interval_seconds = compact_interval_seconds
+        self.compact_min_files = max(2, compact_min_files)
+        self.clock = clock
+        self._buffer: List[BufferedSnapshot] = []
+        self._pending_rows = 0
+        self._flush_needed: Optional[asyncio.Event] = None
+        self._flush_lock = asyncio.Lock()
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def pending_rows(self) -> int:
+        """Rows appended but not written yet"""
+        return self._pending_rows
+
+    def start(self) -> None:
+        """Start the background flush and compaction loops"""
+        if not self._tasks:
+            self._flush_needed = asyncio.Event()
+            self._tasks = [asyncio.create_task(self._flush_loop()), asyncio.create_task(self._compact_loop())]
+            logger.info(f"Recording option chain snapshots to {self.root}")
+
+    async def close(self) -> None:
+        """Stop the background loops and write whatever is still buffered"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.flush()
+
+    def append(
+        self,
+        instrument_name: str,
+        expiry_date: str,
+        side: str,
+        rows: pd.DataFrame,
+        taken_at: Optional[datetime] = None
+    ) -> None:
+        """
+        Queue a priced chain for writing; never blocks.
+
+        `rows` is kept by reference until the next flush and must not be
+        modified in the meantime (cached chains never are).
+        """
+        if rows.empty:
+            return
+        if self._pending_rows + len(rows) > self.max_pending_rows:
+            SNAPSHOT_ROWS.inc(len(rows), status="dropped")
+            logger.warning(f"Snapshot buffer full, dropped {len(rows)} rows of {instrument_name}")
+            return
+
+        self._buffer.append((taken_at or self.clock(), instrument_name, expiry_date, side, rows))
+        self._pending_rows += len(rows)
+        if self._pending_rows >= self.flush_rows and self._flush_needed is not None:
+            self._flush_needed.set()
+
+    async def flush(self) -> int:
+        """
+        Write the buffered snapshots.
+
+        Returns:
+            Number of rows written
+        """
+        async with self._flush_lock:
+            batch, self._buffer = self._buffer, []
+            self._pending_rows = 0
+            if not batch:
+                return 0
+            try:
+                written = await asyncio.to_thread(self._write, batch)
+            except Exception as e:
+                lost = sum(len(rows) for *_, rows in batch)
+                logger.error(f"Failed to write {lost} snapshot rows: {str(e)}", exc_info=True)
+                SNAPSHOT_ROWS.inc(lost, status="error")
+                return 0
+            SNAPSHOT_ROWS.inc(written, status="written")
+            return written
+
+    def _partition_dir(self, day: str, instrument_name: str) -> str:
+        return os.path.join(self.root, f"date={day}", f"instrument={quote(instrument_name, safe='')}")
+
+    def _write(self, batch: Sequence[BufferedSnapshot]) -> int:
+        partitions: Dict[Tuple[str, str], List[pd.DataFrame]] = {}
+        for taken_at, instrument_name, expiry_date, side, rows in batch:
+            taken_at = _ist(taken_at)
+            frame = rows.reindex(columns=ROW_COLUMNS)
+            frame.insert(0, 'side', side)
+            frame.insert(0, 'expiry_date', expiry_date)
+            frame.insert(0, 'snapshot_at', pd.Timestamp(taken_at))
+            partitions.setdefault((taken_at.strftime('%Y-%m-%d'), instrument_name), []).append(frame)
+
+        written = 0
+        for (day, instrument_name), frames in partitions.items():
+            # Every data file is ordered by snapshot time, which queries and
+            # compaction merge on
+            table = pa.Table.from_pandas(
+                pd.concat(frames, ignore_index=True), schema=SNAPSHOT_SCHEMA, preserve_index=False
+            ).sort_by('snapshot_at')
+            name = f"{PART_PREFIX}{int(time.time() * 1000):013d}-{os.getpid()}-{uuid.uuid4().hex[:8]}.parquet"
+            self._write_file(self._partition_dir(day, instrument_name), name, lambda path: pq.write_table(table, path))
+            written += table.num_rows
+        return written
+
+    @staticmethod
+    def _write_file(directory: str, name: str, write) -> str:
+        # Written under a hidden name and renamed, so readers never see a partial file
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = os.path.join(directory, f".{name}.{os.getpid()}.tmp")
+        path = os.path.join(directory, name)
+        try:
+            write(tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return path
+
+    @staticmethod
+    def _data_files(directory: str) -> List[str]:
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            return []
+        # Compacted files hold the oldest rows and sort first
+        return sorted(
+            os.path.join(directory, name) for name in names
+            if name.endswith('.parquet') and name.startswith((COMPACTED_PREFIX, PART_PREFIX))
+        )
+
+    def _days(self, first: Optional[str] = None, last: Optional[str] = None) -> List[str]:
+        try:
+            names = os.listdir(self.root)
+        except FileNotFoundError:
+            return []
+        days = sorted(name[len("date="):] for name in names if name.startswith("date="))
+        return [day for day in days if (first is None or day >= first) and (last is None or day <= last)]
+
+    def compact(self) -> int:
+        """
+        Merge small part files; blocks on file I/O.
+
+        The inputs are merged in snapshot order a row group at a time, so
+        the merged file stays ordered and a partition is never held in
+        memory whole. The merged file is renamed into place before its
+        inputs are removed: a reader listing the directory in between sees
+        those rows twice, never zero times.
+
+        Returns:
+            Number of partitions compacted
+        """
+        lock_file = self._lock_compaction()
+        if lock_file is None:
+            return 0
+        try:
+            today = _ist(self.clock()).strftime('%Y-%m-%d')
+            compacted = 0
+            for day in self._days():
+                day_dir = os.path.join(self.root, f"date={day}")
+                for name in sorted(os.listdir(day_dir)):
+                    directory = os.path.join(day_dir, name)
+                    files = self._data_files(directory)
+                    if day == today:
+                        # Still being written: only merge the new parts, keeping earlier merges
+                        files = [path for path in files if os.path.basename(path).startswith(PART_PREFIX)]
+                        if len(files) < self.compact_min_files:
+                            continue
+                    elif len(files) < 2:
+                        continue
+                    self._compact_partition(directory, files)
+                    compacted += 1
+            return compacted
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
+
+    def _compact_partition(self, directory: str, files: Sequence[str]) -> None:
+        def write(path: str) -> None:
+            with pq.ParquetWriter(path, SNAPSHOT_SCHEMA, compression='zstd') as writer:
+                pending: List[pa.RecordBatch] = []
+                pending_rows = 0
+                streams = [pq.ParquetFile(source).iter_batches(batch_size=COMPACT_ROW_GROUP_ROWS) for source in files]
+                for chunk in _merge_by_time(streams):
+                    pending.extend(chunk.to_batches())
+                    pending_rows += chunk.num_rows
+                    if pending_rows >= COMPACT_ROW_GROUP_ROWS:
+                        writer.write_table(pa.Table.from_batches(pending, SNAPSHOT_SCHEMA))
+                        pending, pending_rows = [], 0
+                if pending:
+                    writer.write_table(pa.Table.from_batches(pending, SNAPSHOT_SCHEMA))
+
+        # Named after the first input, so merges of one day keep their order
+        first = os.path.basename(files[0])
+        stem = first[len(COMPACTED_PREFIX if first.startswith(COMPACTED_PREFIX) else PART_PREFIX):]
+        name = f"{COMPACTED_PREFIX}{stem.split('-')[0]}-{uuid.uuid4().hex[:8]}.parquet"
+        self._write_file(directory, name, write)
+        for source in files:
+            os.remove(source)
+        logger.info(f"Compacted {len(files)} snapshot files in {directory}")
+
+    def _lock_compaction(self):
+        if fcntl is None:
+            return None
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            lock_file = open(os.path.join(self.root, ".compact.lock"), 'w')
+        except OSError as e:
+            logger.warning(f"Cannot lock the snapshot store for compaction: {str(e)}")
+            return None
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            # Another worker is compacting
+            lock_file.close()
+            return None
+        return lock_file
+
+    def query(
+        self,
+        instrument_name: str,
+        start: datetime,
+        end: datetime,
+        strike_price: Optional[float] = None,
+        option_type: Optional[str] = None,
+        expiry_date: Optional[str] = None,
+        columns: Optional[Sequence[str]] = None,
+        limit: Optional[int] = None
+    ) -> Tuple[pd.DataFrame, bool]:
+        """
+        Read the snapshots of an instrument taken in [start, end); blocks on
+        file I/O.
+
+        Args:
+            instrument_name: Instrument to read
+            start: First snapshot time; naive times are taken as IST
+            end: Snapshot time to stop before
+            strike_price: Only rows of this strike
+            option_type: Only CE or PE rows
+            expiry_date: Only rows of this expiry, YYYY-MM-DD
+            columns: Columns to read, of SNAPSHOT_COLUMNS; all by default
+            limit: Return at most this many rows, the earliest first
+
+        Returns:
+            Tuple of (rows ordered by snapshot time, with snapshot_at in IST;
+            whether rows were left out because of `limit`)
+
+        Raises:
+            ValueError: If a column is unknown
+            SnapshotStoreError: If the files cannot be read
+        """
+        columns = list(columns or SNAPSHOT_COLUMNS)
+        unknown = [column for column in columns if column not in SNAPSHOT_COLUMNS]
+        if unknown:
+            raise ValueError(f"Unknown columns {', '.join(unknown)}; use any of {', '.join(SNAPSHOT_COLUMNS)}")
+
+        start, end = _ist(start), _ist(end)
+        timestamp = SNAPSHOT_SCHEMA.field('snapshot_at').type
+        condition = (ds.field('snapshot_at') >= pa.scalar(start, timestamp)) & (ds.field('snapshot_at') < pa.scalar(end, timestamp))
+        if strike_price is not None:
+            condition &= ds.field('strike_price') == float(strike_price)
+        if option_type is not None:
+            condition &= ds.field('option_type') == option_type
+        if expiry_date is not None:
+            condition &= ds.field('expiry_date') == expiry_date
+
+        # Files may be compacted away between listing and reading; list again then
+        for attempt in range(2):
+            try:
+                return self._scan(instrument_name, start, end, condition, columns, limit)
+            except FileNotFoundError as e:
+                if attempt:
+                    raise SnapshotStoreError(f"Snapshot files changed while reading: {str(e)}")
+            except (OSError, pa.ArrowException) as e:
+                raise SnapshotStoreError(f"Failed to read snapshots: {str(e)}")
+
+    def _scan(
+        self,
+        instrument_name: str,
+        start: datetime,
+        end: datetime,
+        condition: ds.Expression,
+        columns: List[str],
+        limit: Optional[int]
+    ) -> Tuple[pd.DataFrame, bool]:
+        # Partition pruning: only the directories of this instrument and range
+        # are listed. Days partition snapshot time and every file is ordered
+        # by it, so merging the files of each day in turn streams the rows in
+        # snapshot order; the scan stops as soon as `limit` rows are found.
+        read_columns = columns if 'snapshot_at' in columns else columns + ['snapshot_at']
+        tables: List[pa.Table] = []
+        rows = 0
+        truncated = False
+        for chunk in self._ordered_chunks(instrument_name, start, end, condition, read_columns):
+            if limit is not None and rows + chunk.num_rows > limit:
+                chunk = chunk.slice(0, limit - rows)
+                truncated = True
+            tables.append(chunk)
+            rows += chunk.num_rows
+            if truncated:
+                break
+
+        schema = pa.schema([SNAPSHOT_SCHEMA.field(column) for column in read_columns])
+        frame = pa.concat_tables(tables).select(read_columns).to_pandas() if tables else schema.empty_table().to_pandas()
+        frame['snapshot_at'] = frame['snapshot_at'].dt.tz_convert(IST)
+        return frame[columns], truncated
+
+    def _ordered_chunks(
+        self,
+        instrument_name: str,
+        start: datetime,
+        end: datetime,
+        condition: ds.Expression,
+        columns: List[str]
+    ) -> Iterator[pa.Table]:
+        for day in self._days(start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')):
+            streams = [
+                # One file per stream, read in order; row groups outside the
+                # filter are skipped on their statistics
+                ds.dataset(path, schema=SNAPSHOT_SCHEMA, format='parquet').to_batches(
+                    columns=columns, filter=condition, use_threads=False
+                )
+                for path in self._data_files(self._partition_dir(day, instrument_name))
+            ]
+            yield from _merge_by_time(streams)
+
+    async def _flush_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_needed.wait(), self.flush_interval_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_needed.clear()
+            await self.flush()
+
+    async def _compact_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.compact_interval_seconds)
+            try:
+                await asyncio.to_thread(self.compact)
+            except Exception as e:
+                logger.error(f"Snapshot compaction failed: {str(e)}", exc_info=True)
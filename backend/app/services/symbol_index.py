@@ -0,0 +1,184 @@
+import hashlib
+import mmap
+import os
+import struct
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple, Union
+
+import numpy as np
+
+SymbolKey = Tuple[str, str, str]
+SymbolEntry = Tuple[str, int]
+
+# magic, format version, entry count, build time, size of the string blob
+_HEADER = struct.Struct("<8sIIdQ")
+_MAGIC = b"FOSYMIDX"
+_VERSION = 1
+_SEPARATOR = "\x1f"
+
+
+class SymbolIndexError(ValueError):
+    """Raised when an index file is missing, truncated or of another format"""
+    pass
+
+
+def _key_hash(key: SymbolKey) -> int:
+    digest = hashlib.blake2b(_SEPARATOR.join(key).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+def compile_index(records: Dict[str, Dict], built_at: float) -> bytes:
+    """
+    Compile symbol master records into the on-disk index format.
+
+    Only option contracts are kept, the first contract per
+    (underSym, expiry, optType) key. The layout is columnar, every section
+    8-byte aligned after the header:
+
+        hashes   uint64[n]   key hashes, sorted
+        lots     int32[n]    lot size per entry
+        offsets  uint32[n+1] entry boundaries in the blob
+        blob     utf-8       'underSym\\x1fexpiry\\x1foptType\\x1fsymbol' per entry
+
+    Args:
+        records: Symbol -> record, as in the downloaded master
+        built_at: Timestamp the master was downloaded at
+
+    Returns:
+        The index file contents
+
+    Raises:
+        ValueError: If the records hold no option contracts
+    """
+    entries: Dict[SymbolKey, SymbolEntry] = {}
+    expiry_cache: Dict[str, str] = {}
+
+    for symbol, record in records.items():
+        opt_type = record.get('optType')
+        if not opt_type or opt_type == 'XX':
+            continue
+
+        try:
+            raw_expiry = str(record['expiryDate'])
+            expiry = expiry_cache.get(raw_expiry)
+            if expiry is None:
+                expiry = datetime.fromtimestamp(int(raw_expiry), timezone.utc).strftime('%Y-%m-%d')
+                expiry_cache[raw_expiry] = expiry
+
+            key = (record['underSym'], expiry, opt_type)
+            # Keep the first contract per key, like the previous scan did
+            if key not in entries:
+                entries[key] = (symbol, int(record['minLotSize']))
+
+        except (KeyError, TypeError, ValueError):
+            continue
+
+    if not entries:
+        raise ValueError("Symbol master contained no option contracts")
+
+    keys = list(entries)
+    hashes = np.fromiter((_key_hash(key) for key in keys), dtype='<u8', count=len(keys))
+    order = np.argsort(hashes, kind='stable')
+
+    strings = [_SEPARATOR.join((*keys[i], entries[keys[i]][0])).encode() for i in order]
+    offsets = np.zeros(len(strings) + 1, dtype='<u4')
+    np.cumsum([len(s) for s in strings], out=offsets[1:])
+    lots = np.fromiter((entries[keys[i]][1] for i in order), dtype='<i4', count=len(keys))
+
+    sections = [hashes[order].tobytes(), lots.tobytes(), offsets.tobytes(), b"".join(strings)]
+    out = bytearray(_HEADER.pack(_MAGIC, _VERSION, len(keys), built_at, len(sections[-1])))
+    for section in sections:
+        out.extend(b"\0" * (_align(len(out)) - len(out)))
+        out.extend(section)
+    return bytes(out)
+
+
+def write_index(path: str, data: bytes) -> None:
+    """
+    Atomically replace the index file at `path`.
+
+    Readers that mapped the previous file keep their (unlinked) copy until
+    they reopen; nobody ever sees a partial file.
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class SymbolIndex:
+    """
+    Read-only (underSym, expiry, optType) -> (symbol, lot size) lookup.
+
+    Backed by a buffer in the `compile_index` format; `open` maps an index
+    file, so worker processes share one copy in the page cache instead of
+    each holding a parsed master. Lookups binary-search the sorted key
+    hashes and confirm the key against the stored string.
+    """
+
+    def __init__(self, buffer: Union[bytes, mmap.mmap]):
+        if len(buffer) < _HEADER.size:
+            raise SymbolIndexError("Symbol index is truncated")
+        magic, version, count, built_at, blob_size = _HEADER.unpack_from(buffer)
+        if magic != _MAGIC or version != _VERSION:
+            raise SymbolIndexError("Not a symbol index of this version")
+
+        # Check the sections fit before viewing them, so a truncated file is
+        # reported as such rather than as whatever numpy makes of it
+        hashes_at = _align(_HEADER.size)
+        lots_at = _align(hashes_at + 8 * count)
+        offsets_at = _align(lots_at + 4 * count)
+        blob_at = _align(offsets_at + 4 * (count + 1))
+        if blob_at + blob_size > len(buffer):
+            raise SymbolIndexError("Symbol index is truncated")
+
+        self._hashes = np.frombuffer(buffer, dtype='<u8', count=count, offset=hashes_at)
+        self._lots = np.frombuffer(buffer, dtype='<i4', count=count, offset=lots_at)
+        self._offsets = np.frombuffer(buffer, dtype='<u4', count=count + 1, offset=offsets_at)
+        if count and int(self._offsets[-1]) > blob_size:
+            raise SymbolIndexError("Symbol index is corrupt")
+
+        offset = blob_at
+        self._blob = memoryview(buffer)[offset:offset + blob_size]
+        self._buffer = buffer
+        self.built_at = built_at
+
+    @classmethod
+    def open(cls, path: str) -> "SymbolIndex":
+        """
+        Map an index file read-only.
+
+        Raises:
+            OSError: If the file cannot be read
+            SymbolIndexError: If it is not a valid index
+        """
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                raise SymbolIndexError("Symbol index is empty")
+            # The mapping stays valid after the file is closed or replaced
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def get(self, key: SymbolKey) -> Optional[SymbolEntry]:
+        """The first contract listed for `key`, or None"""
+        key_hash = np.uint64(_key_hash(key))
+        i = int(np.searchsorted(self._hashes, key_hash))
+        while i < len(self._hashes) and self._hashes[i] == key_hash:
+            *stored_key, symbol = bytes(self._blob[self._offsets[i]:self._offsets[i + 1]]).decode().split(_SEPARATOR)
+            if tuple(stored_key) == key:
+                return symbol, int(self._lots[i])
+            i += 1
+        return None
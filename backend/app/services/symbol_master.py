@@ -0,0 +1,218 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+import aiohttp
+
+try:
+    import fcntl
+except ImportError:  # Windows: workers may build the index concurrently; the swap is still atomic
+    fcntl = None
+
+from app.core.config import settings
+from app.services.rate_limit import FyersRateLimiter, check_status, fyers_rate_limiter
+from app.services.symbol_index import SymbolEntry, SymbolIndex, SymbolIndexError, compile_index, write_index
+from app.utils.market_time import IST
+from app.utils.metrics import record_upstream, stage
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+INDEX_FILENAME = "NSE_FO_sym_master.idx"
+
+
+class SymbolMasterError(Exception):
+    """Base exception for symbol master related errors"""
+    pass
+
+
+class SymbolMasterFetchError(SymbolMasterError):
+    """Raised when the symbol master cannot be downloaded or parsed"""
+    pass
+
+
+class SymbolMaster:
+    """
+    Cached, indexed view of the NSE F&O symbol master.
+
+    The master is downloaded at most once per trading day (or per TTL,
+    whichever comes first) and compiled into a compact index file keyed by
+    (underSym, expiry, optType) (see app/services/symbol_index.py). Every
+    worker process maps that file read-only, so they share one copy and
+    only the first worker to need a fresh master downloads it; the others
+    wait on a file lock and map the result. Rebuilds write a new file and
+    rename it over the old one. Parsing and disk I/O run in a worker thread
+    so they never block the event loop. Downloads count against the
+    symbol_master budget of `rate_limiter`, which also retries them.
+    """
+
+    def __init__(
+        self,
+        url: str = settings.SYMBOL_MASTER_URL,
+        cache_dir: str = settings.SYMBOL_MASTER_CACHE_DIR,
+        ttl_seconds: int = settings.SYMBOL_MASTER_TTL_SECONDS,
+        rate_limiter: FyersRateLimiter = fyers_rate_limiter
+    ):
+        self.url = url
+        self.rate_limiter = rate_limiter
+        self.index_path = os.path.join(cache_dir, INDEX_FILENAME)
+        self.ttl_seconds = ttl_seconds
+        self._index: Optional[SymbolIndex] = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def _loaded_at(self) -> Optional[float]:
+        return self._index.built_at if self._index is not None else None
+
+    def is_stale(self, loaded_at: Optional[float] = None) -> bool:
+        """Check whether data loaded at `loaded_at` needs refreshing"""
+        loaded_at = self._loaded_at if loaded_at is None else loaded_at
+        if loaded_at is None:
+            return True
+
+        now = time.time()
+        if now - loaded_at >= self.ttl_seconds:
+            return True
+
+        # The master is republished every trading day
+        loaded_day = datetime.fromtimestamp(loaded_at, IST).date()
+        return loaded_day != datetime.fromtimestamp(now, IST).date()
+
+    async def ensure_loaded(self) -> None:
+        """
+        Make sure a fresh index is available, mapping the index file or
+        downloading the master as needed.
+
+        Raises:
+            SymbolMasterFetchError: If the master cannot be obtained
+        """
+        if not self.is_stale():
+            return
+
+        async with self._lock:
+            # Another request may have refreshed while we were waiting
+            if not self.is_stale():
+                return
+
+            if await asyncio.to_thread(self._open_index):
+                return
+
+            lock_file = await asyncio.to_thread(self._lock_build)
+            try:
+                # Another worker may have built it while we waited for the lock
+                if not await asyncio.to_thread(self._open_index):
+                    await self.refresh()
+            finally:
+                await asyncio.to_thread(self._unlock_build, lock_file)
+
+    async def refresh(self) -> None:
+        """
+        Download the symbol master and swap in a freshly compiled index.
+
+        Raises:
+            SymbolMasterFetchError: If download or parsing fails
+        """
+        try:
+            logger.info(f"Downloading symbol master from {self.url}")
+            with stage("symbol_master_download"):
+                async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30)) as session:
+                    async def attempt() -> bytes:
+                        status_code = "error"
+                        try:
+                            async with session.get(self.url) as response:
+                                status_code = response.status
+                                check_status(response)
+                                response.raise_for_status()
+                                return await response.read()
+                        finally:
+                            record_upstream("symbol_master", status_code)
+
+                    raw = await self.rate_limiter.call("symbol_master", attempt)
+
+            with stage("symbol_master_index"):
+                await asyncio.to_thread(self._compile_and_swap, raw)
+
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(f"Failed to download symbol master: {str(e)}", exc_info=True)
+            raise SymbolMasterFetchError(f"Failed to fetch symbol data: {str(e)}")
+        except ValueError as e:
+            logger.error(f"Failed to parse symbol master: {str(e)}", exc_info=True)
+            raise SymbolMasterFetchError(f"Failed to parse symbol data: {str(e)}")
+
+    async def lookup(self, instrument_name: str, expiry_date: str, side: str) -> Optional[SymbolEntry]:
+        """
+        Look up the option symbol and lot size for a contract.
+
+        Args:
+            instrument_name: Underlying symbol (e.g. 'HDFCBANK')
+            expiry_date: Expiry date in 'YYYY-MM-DD' format
+            side: Option type ('CE' or 'PE')
+
+        Returns:
+            Tuple of (symbol_name, lot_size), or None if no contract matches
+        """
+        await self.ensure_loaded()
+        return self._index.get((instrument_name, expiry_date, side))
+
+    def load_records(self, records: Dict[str, Dict], loaded_at: Optional[float] = None) -> None:
+        """Index already parsed master records in memory, without touching the index file"""
+        self._set_index(SymbolIndex(compile_index(records, time.time() if loaded_at is None else loaded_at)))
+
+    def _compile_and_swap(self, raw: bytes) -> None:
+        """Compile a freshly downloaded master, write the index file and map it"""
+        data = compile_index(json.loads(raw), time.time())
+        try:
+            write_index(self.index_path, data)
+            self._set_index(SymbolIndex.open(self.index_path))
+        except OSError as e:
+            # The in-memory index is still usable without the file
+            logger.warning(f"Failed to write symbol index {self.index_path}: {str(e)}")
+            self._set_index(SymbolIndex(data))
+
+    def _open_index(self) -> bool:
+        """Map the index file if it is fresh"""
+        try:
+            index = SymbolIndex.open(self.index_path)
+        except FileNotFoundError:
+            return False
+        except (OSError, SymbolIndexError) as e:
+            logger.warning(f"Ignoring unreadable symbol index: {str(e)}")
+            return False
+
+        if self.is_stale(index.built_at):
+            return False
+        self._set_index(index)
+        logger.info(f"Mapped symbol index {self.index_path}")
+        return True
+
+    def _set_index(self, index: SymbolIndex) -> None:
+        # The previous mapping is released once in-flight lookups drop it
+        self._index = index
+        logger.info(f"Indexed {len(index)} option contracts from symbol master")
+
+    def _lock_build(self) -> Optional[Any]:
+        """Block until this process is the only one building the index"""
+        if fcntl is None:
+            return None
+        try:
+            os.makedirs(os.path.dirname(self.index_path) or '.', exist_ok=True)
+            lock_file = open(f"{self.index_path}.lock", 'w')
+        except OSError as e:
+            logger.warning(f"Building the symbol index without a lock: {str(e)}")
+            return None
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return lock_file
+
+    @staticmethod
+    def _unlock_build(lock_file: Optional[Any]) -> None:
+        if lock_file is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
+
+
+symbol_master = SymbolMaster()
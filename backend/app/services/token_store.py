@@ -0,0 +1,126 @@
+import logging
+import os
+import sqlite3
+import time
+from contextlib import closing
+from typing import NamedTuple, Optional
+
+from app.core.config import settings
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tokens (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    access_token TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS refresh_lease (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    holder TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+
+class TokenStoreError(Exception):
+    """Raised when the shared token store cannot be read or written"""
+    pass
+
+
+class StoredToken(NamedTuple):
+    access_token: str
+    expires_at: float
+
+
+class TokenStore:
+    """
+    Access token shared by every worker process, in a SQLite file.
+
+    SQLite takes care of locking between processes and of atomic writes, so
+    a worker never sees a half-written token. Besides the token, the store
+    holds a refresh lease: the worker holding it is the only one refreshing,
+    and the lease lapses after `lease_seconds` in case that worker dies.
+
+    Methods block on file I/O; call them from a worker thread. Every call
+    opens its own connection, so one store can be used from any thread.
+    """
+
+    def __init__(self, path: str = settings.FYERS_TOKEN_STORE_PATH, busy_timeout: float = 5.0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        try:
+            if not self._initialized:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            # Autocommit; transactions are opened explicitly where needed
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            if not self._initialized:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(_SCHEMA)
+                self._initialized = True
+            return conn
+        except (OSError, sqlite3.Error) as e:
+            raise TokenStoreError(f"Cannot open token store {self.path}: {str(e)}")
+
+    def load(self) -> Optional[StoredToken]:
+        """The stored token, or None if no worker has stored one yet"""
+        try:
+            with closing(self._connect()) as conn:
+                row = conn.execute("SELECT access_token, expires_at FROM tokens WHERE id = 1").fetchone()
+            return StoredToken(*row) if row else None
+        except sqlite3.Error as e:
+            raise TokenStoreError(f"Failed to read token store: {str(e)}")
+
+    def save(self, access_token: str, expires_at: float) -> None:
+        """Replace the stored token"""
+        try:
+            with closing(self._connect()) as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO tokens (id, access_token, expires_at, updated_at) VALUES (1, ?, ?, ?)",
+                    (access_token, expires_at, time.time())
+                )
+        except sqlite3.Error as e:
+            raise TokenStoreError(f"Failed to write token store: {str(e)}")
+
+    def acquire_lease(self, holder: str, lease_seconds: float) -> bool:
+        """
+        Take the refresh lease unless another holder has an unexpired one.
+
+        Returns:
+            True if `holder` now holds the lease
+        """
+        now = time.time()
+        try:
+            with closing(self._connect()) as conn:
+                # BEGIN IMMEDIATE takes the write lock, so check-and-set is atomic across processes
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    row = conn.execute("SELECT holder, expires_at FROM refresh_lease WHERE id = 1").fetchone()
+                    if row and row[0] != holder and row[1] > now:
+                        conn.execute("ROLLBACK")
+                        return False
+                    conn.execute(
+                        "INSERT OR REPLACE INTO refresh_lease (id, holder, expires_at) VALUES (1, ?, ?)",
+                        (holder, now + lease_seconds)
+                    )
+                    conn.execute("COMMIT")
+                    return True
+                except BaseException:
+                    conn.execute("ROLLBACK")
+                    raise
+        except sqlite3.Error as e:
+            raise TokenStoreError(f"Failed to acquire refresh lease: {str(e)}")
+
+    def release_lease(self, holder: str) -> None:
+        """Give up the refresh lease if `holder` still holds it"""
+        try:
+            with closing(self._connect()) as conn:
+                conn.execute("DELETE FROM refresh_lease WHERE id = 1 AND holder = ?", (holder,))
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to release refresh lease: {str(e)}")
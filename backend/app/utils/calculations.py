@@ -1,16 +1,27 @@
+import asyncio
+import time
+import numpy as np
 import pandas as pd
-import requests
 import logging
-from typing import Tuple, Optional
+from typing import Any, AsyncIterator, Callable, Collection, Dict, List, Sequence, Set, Tuple, Optional
 from fastapi import HTTPException, status
 from app.core.config import settings
 from app.services.fyers import FyersService, FyersServiceError
+from app.services.margin import Position, PricePoint, SpanMarginClient
+from app.services.margin_estimator import MarginEstimator
+from app.services.snapshot_store import SnapshotStore
+from app.services.symbol_master import symbol_master, SymbolMasterFetchError
+from app.utils.metrics import stage, timed_stage
 from app.utils.symbol_utils import get_symbol_name
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+DEFAULT_STRIKE_COUNT = 40
+
+MARGIN_MODES = ('exact', 'estimate', 'hybrid')
+
 class CalculationError(Exception):
     """Base exception for calculation related errors"""
     pass
@@ -31,24 +42,32 @@ def validate_input_parameters(instrument_name: str, expiry_date: str, side: str)
     if not expiry_date or not isinstance(expiry_date, str):
         raise ValueError("Invalid expiry date")
         
-    if side not in ['CE', 'PE']:
-        raise ValueError("Side must be either 'CE' or 'PE'")
+    if side not in ['CE', 'PE', 'BOTH']:
+        raise ValueError("Side must be one of 'CE', 'PE' or 'BOTH'")
 
 def get_highest_option_prices(
     options_chain_df: pd.DataFrame, 
     instrument_name: str, 
-    side: str
+    side: str,
+    lot_size: Optional[int] = None
 ) -> pd.DataFrame:
     """
     Get highest option prices for either PE bid or CE ask based on side parameter.
     
+    Filtering, side selection, premium and column projection happen in one
+    vectorized pass over the chain's columns, and only the result frame is
+    allocated.
+    
     Args:
         options_chain_df: DataFrame containing option chain data
         instrument_name: Name of the instrument
-        side: 'PE' for put options or 'CE' for call options
+        side: 'PE' for put options, 'CE' for call options, or 'BOTH' for
+            CE asks and PE bids from the same chain
+        lot_size: If given, a premium column (price x lot size) is added
         
     Returns:
-        DataFrame with filtered and processed option prices
+        DataFrame with instrument_name, strike_price, option_type, bid/ask,
+        symbol, underlying_ltp and (optionally) premium columns
         
     Raises:
         DataProcessingError: If processing fails
@@ -59,25 +78,43 @@ def get_highest_option_prices(
         if options_chain_df.empty:
             raise DataProcessingError("Empty options chain data")
             
-        required_columns = {'option_type', 'ask', 'bid'}
+        required_columns = {'option_type', 'ask', 'bid', 'strike_price', 'symbol'}
         if not all(col in options_chain_df.columns for col in required_columns):
             raise DataProcessingError("Missing required columns in options chain data")
 
-        # Filter by option type
-        filtered_df = options_chain_df[options_chain_df['option_type'] == side].copy()
+        option_type = options_chain_df['option_type'].to_numpy()
+        ask = options_chain_df['ask'].to_numpy()
+        bid = options_chain_df['bid'].to_numpy()
+
+        # The underlying's own row carries the spot price
+        underlying_ltp = np.nan
+        if 'ltp' in options_chain_df.columns:
+            underlying_rows = ~np.isin(option_type, ['CE', 'PE'])
+            if underlying_rows.any():
+                underlying_ltp = float(options_chain_df['ltp'].to_numpy()[underlying_rows][0])
+
+        # Keep quoted option rows of the requested side; this also drops the
+        # underlying's row, which has no option type
+        option_types = ['CE', 'PE'] if side == 'BOTH' else [side]
+        mask = (ask != 0) & np.isin(option_type, option_types)
         
-        if filtered_df.empty:
+        if not mask.any():
             raise DataProcessingError(f"No data found for option type {side}")
 
-        # Set bid/ask values
-        filtered_df['bid/ask'] = filtered_df.apply(
-            lambda row: row['ask'] if side == 'CE' else row['bid'], 
-            axis=1
-        )
+        # CE ask, PE bid
+        option_type = option_type[mask]
+        price = np.where(option_type == 'CE', ask[mask], bid[mask])
 
-        # Clean up and add instrument name
-        filtered_df = filtered_df.drop(columns=['ask', 'bid'])
-        filtered_df['instrument_name'] = instrument_name
+        filtered_df = pd.DataFrame({
+            'instrument_name': instrument_name,
+            'strike_price': options_chain_df['strike_price'].to_numpy()[mask],
+            'option_type': option_type,
+            'bid/ask': price,
+            'symbol': options_chain_df['symbol'].to_numpy()[mask],
+            'underlying_ltp': underlying_ltp
+        })
+        if lot_size is not None:
+            filtered_df['premium'] = price * lot_size
 
         logger.info(f"Successfully processed option prices for {instrument_name}")
         return filtered_df
@@ -86,10 +123,12 @@ def get_highest_option_prices(
         logger.error(f"Error processing option prices: {str(e)}", exc_info=True)
         raise DataProcessingError(f"Failed to process option prices: {str(e)}")
 
-def get_option_chain_data(
+async def get_option_chain_data(
     instrument_name: str, 
     expiry_date: str, 
-    side: str
+    side: str,
+    fyers_service: FyersService,
+    strike_count: int = DEFAULT_STRIKE_COUNT
 ) -> Tuple[pd.DataFrame, int]:
     """
     Fetch and process option chain data.
@@ -97,7 +136,9 @@ def get_option_chain_data(
     Args:
         instrument_name: Name of the instrument
         expiry_date: Expiry date string
-        side: Option type ('CE' or 'PE')
+        side: Option type ('CE', 'PE' or 'BOTH')
+        fyers_service: Shared application-scoped Fyers client
+        strike_count: Number of strikes to fetch on each side of ATM
         
     Returns:
         Tuple of (processed DataFrame, lot size)
@@ -112,22 +153,26 @@ def get_option_chain_data(
         validate_input_parameters(instrument_name, expiry_date, side)
         
         # Get symbol and lot size
-        symbol, lot_size = get_symbol_name(instrument_name, expiry_date, side)
-        strike_count = 40
+        with stage("symbol_lookup"):
+            symbol, lot_size = await get_symbol_name(instrument_name, expiry_date, side)
 
-        # Initialize FyersService and fetch data
-        fyers_service = FyersService()
-        options_chain_data = fyers_service.get_option_chain(symbol, strike_count)
+        # Fetch data through the shared Fyers client
+        options_chain_data = await fyers_service.get_option_chain(symbol, strike_count)
         
         if options_chain_data is None or options_chain_data.empty:
             raise DataProcessingError("No option chain data received")
 
-        # Process the data
-        result_df = get_highest_option_prices(options_chain_data, instrument_name, side)
+        # Process the data off the event loop
+        with stage("chain_processing"):
+            result_df = await asyncio.to_thread(
+                get_highest_option_prices, options_chain_data, instrument_name, side, lot_size
+            )
         
         logger.info(f"Successfully retrieved option chain data for {instrument_name}")
         return result_df, lot_size
         
+    except HTTPException:
+        raise
     except FyersServiceError as e:
         logger.error(f"Fyers service error: {str(e)}", exc_info=True)
         raise HTTPException(
@@ -153,16 +198,209 @@ def get_option_chain_data(
             detail="An unexpected error occurred"
         )
 
-def calculate_margin_and_premium(df: pd.DataFrame, lot_size: int) -> pd.DataFrame:
+def find_atm_strike(df: pd.DataFrame) -> Tuple[float, float]:
+    """
+    Find the underlying price and the at-the-money strike of a chain.
+    
+    Args:
+        df: Processed option chain with strike_price and underlying_ltp
+        
+    Returns:
+        Tuple of (underlying price, ATM strike). When the chain carries no
+        underlying price, the median strike stands in for it.
+    """
+    strikes = df['strike_price'].to_numpy(dtype=float)
+    spot = float(df['underlying_ltp'].iloc[0]) if 'underlying_ltp' in df.columns else np.nan
+    if not np.isfinite(spot) or spot <= 0:
+        spot = float(np.median(strikes))
+    return spot, float(strikes[np.argmin(np.abs(strikes - spot))])
+
+def select_strike_window(
+    df: pd.DataFrame,
+    spot: float,
+    atm_strike: float,
+    moneyness_range: Optional[float] = None,
+    page_size: Optional[int] = None,
+    after: Optional[Tuple[float, float, int]] = None
+) -> Tuple[pd.DataFrame, Optional[Tuple[float, float, int]]]:
+    """
+    Select the strikes to return (and price) for one request.
+    
+    Args:
+        df: Processed option chain
+        spot: Underlying price
+        atm_strike: Strike the page ordering is anchored to
+        moneyness_range: If given, drop strikes with |strike / spot - 1| above it
+        page_size: If given, return rows nearest the ATM strike first, at
+            most this many
+        after: Sort key of the last row of the previous page
+        
+    Returns:
+        Tuple of (new DataFrame with the selected rows, sort key of the last
+        row if more rows follow, else None). Sort keys are
+        (distance from ATM, strike, 0 for CE / 1 for PE).
+    """
+    strikes = df['strike_price'].to_numpy(dtype=float)
+    mask = np.ones(len(df), dtype=bool)
+    if moneyness_range is not None:
+        mask &= np.abs(strikes / spot - 1) <= moneyness_range
+
+    if page_size is None:
+        return df[mask].reset_index(drop=True), None
+
+    distance = np.abs(strikes - atm_strike)
+    is_put = (df['option_type'].to_numpy() == 'PE').astype(int)
+    if after is not None:
+        after_distance, after_strike, after_is_put = after
+        mask &= (distance > after_distance) | (
+            (distance == after_distance) & (
+                (strikes > after_strike) | ((strikes == after_strike) & (is_put > after_is_put))
+            )
+        )
+
+    candidates = np.flatnonzero(mask)
+    ordered = candidates[np.lexsort((is_put[candidates], strikes[candidates], distance[candidates]))]
+    page = ordered[:page_size]
+
+    next_key = None
+    if len(ordered) > page_size:
+        last = page[-1]
+        next_key = (float(distance[last]), float(strikes[last]), int(is_put[last]))
+
+    return df.iloc[page].reset_index(drop=True), next_key
+
+def position_prices(df: pd.DataFrame, lot_size: int) -> Dict[Position, PricePoint]:
+    """
+    Current (underlying, option) prices of the positions of option rows.
+    
+    The margin client compares them with the prices a cached margin was
+    computed at to decide whether the margin needs recomputing.
+    """
+    option_prices = df['bid/ask'].to_numpy(dtype=float)
+    if 'underlying_ltp' in df.columns:
+        underlying_prices = df['underlying_ltp'].to_numpy(dtype=float)
+    else:
+        underlying_prices = np.full(len(df), np.nan)
+    return {
+        (symbol, lot_size): (underlying, option)
+        for symbol, underlying, option in zip(df['symbol'], underlying_prices, option_prices)
+    }
+
+def apply_margin_and_premium(
+    df: pd.DataFrame,
+    margins: Dict[str, float],
+    lot_size: int,
+    reused: Optional[Collection[str]] = None,
+    estimates: Optional[np.ndarray] = None
+) -> pd.DataFrame:
+    """
+    Attach fetched margins and computed premiums to option rows, in place.
+    
+    Args:
+        df: DataFrame containing option data, as built for this request
+        margins: Dict of symbol -> margin for the symbols that were priced
+        lot_size: Size of each lot
+        reused: Symbols whose margin was served from the margin cache
+        estimates: Optional estimated margin per row, used for rows
+            without an exact margin
+        
+    Returns:
+        df with margin, margin_available, margin_source and premium columns.
+        Rows whose margin could not be fetched or estimated keep a margin
+        of 0.0. margin_source is 'recomputed' or 'reused' for exactly priced
+        rows, 'estimated' for estimated ones and 'unavailable' for the rest.
+    """
+    margin_series = df['symbol'].map(margins)
+    available = margin_series.notna().to_numpy()
+    was_reused = df['symbol'].isin(reused or ()).to_numpy()
+    margin = margin_series.fillna(0.0).to_numpy(dtype=float)
+    source = np.where(available, np.where(was_reused, 'reused', 'recomputed'), 'unavailable')
+
+    if estimates is not None:
+        estimated = ~available & np.isfinite(estimates)
+        margin = np.where(estimated, estimates, margin)
+        source = np.where(estimated, 'estimated', source)
+        available = available | estimated
+
+    df['margin_available'] = available
+    df['margin'] = margin
+    df['margin_source'] = source
+
+    # Calculate premium unless the chain transform already did
+    if 'premium' not in df.columns:
+        if 'bid/ask' in df.columns:
+            df['premium'] = df['bid/ask'].to_numpy() * lot_size
+        else:
+            df['premium'] = df.get('last_traded_price', 0) * lot_size
+
+    return df
+
+def estimate_margins(df: pd.DataFrame, lot_size: int, estimator: MarginEstimator) -> np.ndarray:
+    """Estimated margin of selling one lot of each option row"""
+    spot, _ = find_atm_strike(df)
+    return estimator.estimate(
+        df['instrument_name'].iloc[0],
+        spot,
+        df['strike_price'].to_numpy(dtype=float),
+        df['option_type'].to_numpy(),
+        lot_size
+    )
+
+def observe_margins(df: pd.DataFrame, lot_size: int, estimator: MarginEstimator) -> None:
+    """Feed the margins just fetched from span_margin to the estimator"""
+    fresh = (df['margin_source'] == 'recomputed').to_numpy()
+    if not fresh.any():
+        return
+
+    spot, _ = find_atm_strike(df)
+    estimator.observe(
+        df['instrument_name'].iloc[0],
+        spot,
+        df['strike_price'].to_numpy(dtype=float)[fresh],
+        df['option_type'].to_numpy()[fresh],
+        lot_size,
+        df['margin'].to_numpy()[fresh]
+    )
+
+def top_k_by_yield(premium: np.ndarray, margin: np.ndarray, k: int) -> np.ndarray:
+    """Positions of the k rows with the highest premium / margin, best first"""
+    yields = np.divide(premium, margin, out=np.zeros(len(premium)), where=margin > 0)
+    if k < len(yields):
+        candidates = np.argpartition(-yields, k - 1)[:k]
+    else:
+        candidates = np.arange(len(yields))
+    return candidates[np.argsort(-yields[candidates], kind='stable')]
+
+@timed_stage("margins")
+async def calculate_margin_and_premium(
+    df: pd.DataFrame,
+    lot_size: int,
+    margin_client: SpanMarginClient,
+    margin_mode: str = 'exact',
+    estimator: Optional[MarginEstimator] = None,
+    confirm_top_k: int = settings.MARGIN_HYBRID_TOP_K,
+    stats: Optional[Dict[str, int]] = None
+) -> pd.DataFrame:
     """
     Calculate margin and premium for option positions.
     
     Args:
         df: DataFrame containing option data
         lot_size: Size of each lot
+        margin_client: Async SPAN margin client
+        margin_mode: 'exact' prices every row with span_margin, 'estimate'
+            uses the offline estimator only, and 'hybrid' estimates every
+            row and confirms the confirm_top_k rows with the best
+            premium/margin yield with span_margin
+        estimator: Offline margin estimator; required unless margin_mode
+            is 'exact', and fed with every exact margin fetched
+        confirm_top_k: Rows confirmed in hybrid mode
+        stats: Optional dict of margin counters, as in
+            SpanMarginClient.get_position_margins
         
     Returns:
-        DataFrame with added margin and premium columns
+        DataFrame with added margin, margin_available, margin_source and
+        premium columns
         
     Raises:
         MarginCalculationError: If margin calculation fails
@@ -176,52 +414,37 @@ def calculate_margin_and_premium(df: pd.DataFrame, lot_size: int) -> pd.DataFram
         if not isinstance(lot_size, int) or lot_size <= 0:
             raise ValueError("Invalid lot size")
 
-        result_df = df.copy()
-        result_df['margin'] = 0.0
-        result_df['premium'] = 0.0
-        
-        url = "https://api.fyers.in/api/v2/span_margin"
-        headers = {
-            "Authorization": f"{settings.FYERS_CLIENT_ID}:{settings.FYERS_ACCESS_TOKEN}",
-            "Content-Type": "application/json"
-        }
-        
-        for idx, row in result_df.iterrows():
-            try:
-                payload = {
-                    "data": [{
-                        "symbol": row['symbol'],
-                        "qty": lot_size,
-                        "side": -1,
-                        "type": 2,
-                        "productType": "INTRADAY",
-                        "limitPrice": 0.0,
-                        "stopLoss": 0.0
-                    }]
-                }
-                
-                response = requests.post(url, headers=headers, json=payload)
-                response.raise_for_status()
-                margin_data = response.json()
-                
-                if not margin_data.get('data', {}).get('total'):
-                    logger.warning(f"No margin data received for symbol {row['symbol']}")
-                    continue
-                    
-                result_df.at[idx, 'margin'] = margin_data['data']['total']
-                
-                # Calculate premium
-                if 'bid/ask' in row:
-                    result_df.at[idx, 'premium'] = row['bid/ask'] * lot_size
-                else:
-                    result_df.at[idx, 'premium'] = row.get('last_traded_price', 0) * lot_size
-                    
-            except requests.RequestException as e:
-                logger.error(f"API error for symbol {row['symbol']}: {str(e)}")
-                continue
-            except Exception as e:
-                logger.error(f"Calculation error for symbol {row['symbol']}: {str(e)}")
-                continue
+        if margin_mode not in MARGIN_MODES:
+            raise ValueError(f"Margin mode must be one of {', '.join(MARGIN_MODES)}")
+
+        estimates = None
+        to_price = df
+        if margin_mode != 'exact':
+            if estimator is None:
+                raise ValueError("Margin estimator is not available")
+            estimates = estimate_margins(df, lot_size, estimator)
+            confirm = np.array([], dtype=int)
+            if margin_mode == 'hybrid' and confirm_top_k > 0:
+                premium = df['bid/ask'].to_numpy(dtype=float) * lot_size
+                confirm = top_k_by_yield(premium, estimates, confirm_top_k)
+            to_price = df.iloc[confirm]
+
+        margins: Dict[str, float] = {}
+        reused: Set[Position] = set()
+        if not to_price.empty:
+            position_margins = await margin_client.get_position_margins(
+                [(symbol, lot_size) for symbol in to_price['symbol']],
+                stats,
+                prices=position_prices(to_price, lot_size),
+                reused=reused
+            )
+            margins = {symbol: margin for (symbol, _), margin in position_margins.items()}
+
+        result_df = await asyncio.to_thread(
+            apply_margin_and_premium, df, margins, lot_size, {symbol for symbol, _ in reused}, estimates
+        )
+        if estimator is not None:
+            observe_margins(result_df, lot_size, estimator)
 
         logger.info("Successfully calculated margin and premium")
         return result_df
@@ -231,4 +454,276 @@ def calculate_margin_and_premium(df: pd.DataFrame, lot_size: int) -> pd.DataFram
         raise MarginCalculationError(f"Invalid input: {str(e)}")
     except Exception as e:
         logger.error(f"Margin calculation error: {str(e)}", exc_info=True)
-        raise MarginCalculationError(f"Failed to calculate margin: {str(e)}")
\ No newline at end of file
+        raise MarginCalculationError(f"Failed to calculate margin: {str(e)}")
+
+async def iter_margin_updates(
+    df: pd.DataFrame,
+    lot_size: int,
+    margin_client: SpanMarginClient,
+    estimator: Optional[MarginEstimator] = None
+) -> AsyncIterator[pd.DataFrame]:
+    """
+    Price option rows incrementally, as span_margin responses arrive.
+    
+    Args:
+        df: DataFrame with the rows to price, as built for this request
+        lot_size: Size of each lot
+        margin_client: Async SPAN margin client
+        estimator: Optional offline margin estimator to feed the exact
+            margins to
+        
+    Yields:
+        The rows priced by each completed request, with strike_price,
+        option_type, margin, margin_available and margin_source columns.
+        Once the iterator is exhausted, df carries the margins of all of them.
+    """
+    if not isinstance(lot_size, int) or lot_size <= 0:
+        raise MarginCalculationError("Invalid input: Invalid lot size")
+
+    margins: Dict[str, float] = {}
+    reused: Set[str] = set()
+    symbols = df['symbol']
+    async for resolved, from_cache in margin_client.iter_position_margins(
+        [(symbol, lot_size) for symbol in symbols],
+        prices=position_prices(df, lot_size)
+    ):
+        resolved_margins = {symbol: margin for (symbol, _), margin in resolved.items()}
+        margins.update(resolved_margins)
+        if from_cache:
+            reused.update(resolved_margins)
+        rows = df.loc[symbols.isin(resolved_margins).to_numpy(), ['strike_price', 'option_type', 'symbol']]
+        yield pd.DataFrame({
+            'strike_price': rows['strike_price'].to_numpy(),
+            'option_type': rows['option_type'].to_numpy(),
+            'margin': rows['symbol'].map(resolved_margins).to_numpy(dtype=float),
+            'margin_available': True,
+            'margin_source': 'reused' if from_cache else 'recomputed'
+        })
+
+    apply_margin_and_premium(df, margins, lot_size, reused)
+    if estimator is not None:
+        observe_margins(df, lot_size, estimator)
+
+async def get_bulk_option_chain_data(
+    items: Sequence[Tuple[str, str, str]],
+    fyers_service: FyersService,
+    margin_client: SpanMarginClient,
+    max_concurrency: int = settings.BULK_MAX_CONCURRENCY,
+    strike_count: int = DEFAULT_STRIKE_COUNT,
+    estimator: Optional[MarginEstimator] = None,
+    prefilter: Optional[Callable[[pd.DataFrame, int], pd.DataFrame]] = None,
+    snapshot_store: Optional[SnapshotStore] = None
+) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Run the option chain pipeline for many (instrument, expiry, side) items.
+    
+    Symbols are resolved against a single symbol master load, chains are
+    fetched concurrently (at most `max_concurrency` at a time), and the
+    margins for every instrument are requested together so they share
+    batches and the margin cache.
+    
+    Args:
+        items: (instrument_name, expiry_date, side) tuples
+        fyers_service: Shared application-scoped Fyers client
+        margin_client: Async SPAN margin client
+        max_concurrency: Maximum number of chains fetched at once
+        strike_count: Number of strikes to fetch on each side of ATM
+        estimator: Optional offline margin estimator to feed the exact
+            margins to
+        prefilter: Optional function of (chain, lot_size) returning the
+            rows worth pricing, applied before any margin is requested
+        snapshot_store: Optional store every priced chain is queued on
+        
+    Returns:
+        Tuple of (results, stats). Each result holds the item's fields plus
+        either 'data' (DataFrame with margin and premium columns) or 'error'
+        and 'status_code'. Stats counts the upstream work performed.
+        
+    Raises:
+        HTTPException: If the symbol master cannot be loaded
+    """
+    started = time.perf_counter()
+    stats: Dict[str, Any] = {
+        "items": len(items),
+        "chain_fetches": 0,
+        "margin_positions": 0,
+        "margin_cache_hits": 0,
+        "margin_repriced": 0,
+        "margin_http_calls": 0
+    }
+
+    try:
+        await symbol_master.ensure_loaded()
+    except SymbolMasterFetchError as e:
+        logger.error(f"Bulk scan failed to load symbol master: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e)
+        )
+
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def fetch_chain(item: Tuple[str, str, str]):
+        async with semaphore:
+            stats["chain_fetches"] += 1
+            try:
+                data, lot_size = await get_option_chain_data(*item, fyers_service, strike_count)
+                if prefilter is not None:
+                    data = prefilter(data, lot_size)
+                return data, lot_size, None
+            except HTTPException as e:
+                return None, None, e
+
+    chains = await asyncio.gather(*(fetch_chain(item) for item in items))
+
+    # One margin pass across every instrument in the scan
+    prices: Dict[Position, PricePoint] = {}
+    for data, lot_size, error in chains:
+        if error is None:
+            prices.update(position_prices(data, lot_size))
+    positions = list(prices)
+    stats["margin_positions"] = len(positions)
+    reused: Set[Position] = set()
+    with stage("margins"):
+        margins = await margin_client.get_position_margins(positions, stats, prices, reused)
+
+    def assemble() -> List[Dict[str, Any]]:
+        results = []
+        for (instrument_name, expiry_date, side), (data, lot_size, error) in zip(items, chains):
+            result: Dict[str, Any] = {
+                "instrument_name": instrument_name,
+                "expiry_date": expiry_date,
+                "side": side
+            }
+            if error is not None:
+                result.update(status_code=error.status_code, error=error.detail)
+            else:
+                item_margins = {
+                    symbol: margins[(symbol, lot_size)]
+                    for symbol in data['symbol'] if (symbol, lot_size) in margins
+                }
+                item_reused = {symbol for symbol in data['symbol'] if (symbol, lot_size) in reused}
+                result.update(
+                    status_code=status.HTTP_200_OK,
+                    data=apply_margin_and_premium(data, item_margins, lot_size, item_reused)
+                )
+            results.append(result)
+        return results
+
+    results = await asyncio.to_thread(assemble)
+    if estimator is not None:
+        # The estimator is shared with requests on the event loop, so it is
+        # only ever updated from the loop
+        for data, lot_size, error in chains:
+            if error is None:
+                observe_margins(data, lot_size, estimator)
+    if snapshot_store is not None:
+        for result in results:
+            if "data" in result:
+                snapshot_store.append(result["instrument_name"], result["expiry_date"], result["side"], result["data"])
+    stats["errors"] = sum(1 for result in results if "error" in result)
+    stats["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+    logger.info(f"Bulk scan of {len(items)} items finished: {stats}")
+    return results, stats
+
+async def iter_bulk_option_chain_data(
+    items: Sequence[Tuple[str, str, str]],
+    fyers_service: FyersService,
+    margin_client: SpanMarginClient,
+    stats: Dict[str, Any],
+    max_concurrency: int = settings.BULK_MAX_CONCURRENCY,
+    strike_count: int = DEFAULT_STRIKE_COUNT,
+    estimator: Optional[MarginEstimator] = None,
+    prefilter: Optional[Callable[[pd.DataFrame, int], pd.DataFrame]] = None,
+    margin_mode: str = 'exact',
+    confirm_top_k: int = settings.MARGIN_HYBRID_TOP_K,
+    snapshot_store: Optional[SnapshotStore] = None
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Run the option chain pipeline for many items, yielding each as it is priced.
+    
+    Unlike `get_bulk_option_chain_data`, every chain is priced on its own
+    as soon as it is fetched, so callers that reduce the results (e.g. the
+    screener) only ever hold the chains still in flight.
+    
+    Args:
+        items: (instrument_name, expiry_date, side) tuples
+        fyers_service: Shared application-scoped Fyers client
+        margin_client: Async SPAN margin client
+        stats: Dict that receives the same counters as the stats of
+            `get_bulk_option_chain_data`
+        max_concurrency: Maximum number of chains fetched and priced at once
+        strike_count: Number of strikes to fetch on each side of ATM
+        estimator: Optional offline margin estimator; required unless
+            margin_mode is 'exact'
+        prefilter: Optional function of (chain, lot_size) returning the
+            rows worth pricing, applied before any margin is requested
+        margin_mode: Margin mode of `calculate_margin_and_premium`
+        confirm_top_k: Rows of each chain confirmed in hybrid mode
+        snapshot_store: Optional store every priced chain is queued on
+        
+    Yields:
+        One result per item, in completion order, shaped like the results
+        of `get_bulk_option_chain_data`
+        
+    Raises:
+        HTTPException: If the symbol master cannot be loaded
+    """
+    started = time.perf_counter()
+    stats.update(items=len(items), chain_fetches=0, margin_positions=0,
+                 margin_cache_hits=0, margin_repriced=0, margin_http_calls=0, errors=0)
+
+    try:
+        await symbol_master.ensure_loaded()
+    except SymbolMasterFetchError as e:
+        logger.error(f"Bulk scan failed to load symbol master: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e)
+        )
+
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def process(item: Tuple[str, str, str]) -> Dict[str, Any]:
+        instrument_name, expiry_date, side = item
+        result: Dict[str, Any] = {"instrument_name": instrument_name, "expiry_date": expiry_date, "side": side}
+        async with semaphore:
+            stats["chain_fetches"] += 1
+            try:
+                data, lot_size = await get_option_chain_data(*item, fyers_service, strike_count)
+                if prefilter is not None:
+                    data = prefilter(data, lot_size)
+                if not data.empty:
+                    stats["margin_positions"] += len(data)
+                    data = await calculate_margin_and_premium(
+                        data, lot_size, margin_client, margin_mode, estimator, confirm_top_k, stats
+                    )
+                    if snapshot_store is not None:
+                        snapshot_store.append(instrument_name, expiry_date, side, data)
+            except HTTPException as e:
+                result.update(status_code=e.status_code, error=e.detail)
+                return result
+            except MarginCalculationError as e:
+                result.update(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, error=str(e))
+                return result
+        result.update(status_code=status.HTTP_200_OK, data=data)
+        return result
+
+    # Finished tasks are dropped as soon as their result is handed out, so
+    # a chain is released once the caller is done with it
+    pending = {asyncio.ensure_future(process(item)) for item in items}
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            while done:
+                result = done.pop().result()
+                if "error" in result:
+                    stats["errors"] += 1
+                yield result
+                del result
+    finally:
+        for task in pending:
+            task.cancel()
+        stats["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        logger.info(f"Bulk scan of {len(items)} items finished: {stats}")
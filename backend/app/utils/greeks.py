@@ -0,0 +1,246 @@
+from datetime import datetime
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from app.core.config import settings
+from app.utils.market_time import years_to_expiry
+from app.utils.metrics import timed_stage
+
+GREEK_COLUMNS = ['iv', 'delta', 'gamma', 'theta', 'vega']
+
+# Volatility bracket searched by the solver
+MIN_VOLATILITY = 1e-4
+MAX_VOLATILITY = 5.0
+# NSE option tick; a quote within one tick of its bound carries no volatility
+TICK_SIZE = 0.05
+
+
+def norm_cdf(x: np.ndarray) -> np.ndarray:
+    """
+    Standard normal CDF to double precision, without scipy.
+
+    Hart's rational approximation as given by West (2005), "Better
+    approximations to cumulative normal functions"; accurate to about 1e-15.
+    """
+    x = np.asarray(x, dtype=float)
+    z = np.abs(x)
+    e = np.exp(-0.5 * z * z)
+
+    numerator = ((((((3.52624965998911e-02 * z + 0.700383064443688) * z + 6.37396220353165) * z
+                    + 33.912866078383) * z + 112.079291497871) * z + 221.213596169931) * z + 220.206867912376)
+    denominator = (((((((8.83883476483184e-02 * z + 1.75566716318264) * z + 16.064177579207) * z
+                      + 86.7807322029461) * z + 296.564248779674) * z + 637.333633378831) * z
+                    + 793.826512519948) * z + 440.413735824752)
+    near = e * numerator / denominator
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fraction = z + 1 / (z + 2 / (z + 3 / (z + 4 / (z + 0.65))))
+        far = e / fraction / 2.506628274631
+
+    tail = np.where(z < 7.07106781186547, near, np.where(z > 37, 0.0, far))
+    return np.where(x > 0, 1 - tail, tail)
+
+
+def norm_pdf(x: np.ndarray) -> np.ndarray:
+    """Standard normal density"""
+    return np.exp(-0.5 * np.square(x)) / np.sqrt(2 * np.pi)
+
+
+def _d1_d2(forward, strike, years, sigma):
+    root_t = sigma * np.sqrt(years)
+    d1 = (np.log(forward / strike) + 0.5 * root_t * root_t) / root_t
+    return d1, d1 - root_t
+
+
+def black76_price(
+    forward: np.ndarray,
+    strike: np.ndarray,
+    years: np.ndarray,
+    sigma: np.ndarray,
+    rate: float,
+    is_call: np.ndarray
+) -> np.ndarray:
+    """
+    Black-76 price of European options on a forward.
+
+    Args:
+        forward: Forward price of the underlying
+        strike: Strike prices
+        years: Time to expiry in years
+        sigma: Volatility
+        rate: Continuously compounded risk-free rate
+        is_call: True for calls, False for puts
+
+    Returns:
+        Option prices
+    """
+    d1, d2 = _d1_d2(forward, strike, years, sigma)
+    discount = np.exp(-rate * years)
+    call = discount * (forward * norm_cdf(d1) - strike * norm_cdf(d2))
+    put = discount * (strike * norm_cdf(-d2) - forward * norm_cdf(-d1))
+    return np.where(is_call, call, put)
+
+
+def implied_volatility(
+    price: np.ndarray,
+    forward: np.ndarray,
+    strike: np.ndarray,
+    years: np.ndarray,
+    rate: float,
+    is_call: np.ndarray,
+    tol: float = 1e-6,
+    max_iter: int = 100,
+    tick: float = TICK_SIZE
+) -> np.ndarray:
+    """
+    Black-76 implied volatility of a whole chain in one batched solve.
+
+    Every option takes a Newton step per iteration. Steps that leave the
+    bracket known to hold the root, or that come with a vanishing vega, are
+    replaced by bisection, so deep in- and out-of-the-money strikes converge
+    as reliably as ATM ones. An option has converged once the Newton step
+    (price error / vega) or the bracket is smaller than `tol`, so the
+    tolerance is in volatility whatever the option's vega. Converged
+    options drop out of the active set; the loop ends when none are left.
+
+    A quote within one tick of its intrinsic value (or of zero, out of the
+    money) only says the volatility is somewhere near zero, so it gets NaN
+    rather than whatever the solver stopped at.
+
+    Args:
+        price: Observed option prices
+        forward: Forward price of the underlying
+        strike: Strike prices
+        years: Time to expiry in years
+        rate: Continuously compounded risk-free rate
+        is_call: True for calls, False for puts
+        tol: Volatility tolerance of a converged option
+        max_iter: Iteration cap
+        tick: Minimum price increment of the quotes
+
+    Returns:
+        Implied volatility per option; NaN where the price is outside the
+        no-arbitrage bounds, within a tick of intrinsic value, or the solve
+        did not converge
+    """
+    price, forward, strike, years, is_call = np.broadcast_arrays(
+        np.asarray(price, dtype=float), np.asarray(forward, dtype=float),
+        np.asarray(strike, dtype=float), np.asarray(years, dtype=float), np.asarray(is_call, dtype=bool)
+    )
+    discount = np.exp(-rate * years)
+    intrinsic = discount * np.maximum(np.where(is_call, forward - strike, strike - forward), 0.0)
+    upper = discount * np.where(is_call, forward, strike)
+
+    sigma = np.full(price.shape, np.nan)
+    active = np.flatnonzero(
+        np.isfinite(price) & (price - intrinsic > tick) & (price < upper)
+        & (forward > 0) & (strike > 0) & (years > 0)
+    )
+    if not active.size:
+        return sigma
+
+    p, f, k, t, call, df = (a[active] for a in (price, forward, strike, years, is_call, discount))
+    low = np.full(active.size, MIN_VOLATILITY)
+    high = np.full(active.size, MAX_VOLATILITY)
+    # Brenner-Subrahmanyam ATM approximation as the starting point
+    guess = np.clip(np.sqrt(2 * np.pi / t) * p / (df * f), 0.05, 2.0)
+
+    for _ in range(max_iter):
+        d1, _ = _d1_d2(f, k, t, guess)
+        diff = black76_price(f, k, t, guess, rate, call) - p
+        vega = df * f * norm_pdf(d1) * np.sqrt(t)
+
+        done = (np.abs(diff) < tol * vega) | (high - low < tol)
+        sigma[active[done]] = guess[done]
+        keep = ~done
+        if not keep.any():
+            break
+        active, p, f, k, t, call, df = (a[keep] for a in (active, p, f, k, t, call, df))
+        low, high, guess, diff, vega = low[keep], high[keep], guess[keep], diff[keep], vega[keep]
+
+        # Price increases with volatility, so the sign of diff narrows the bracket
+        high = np.where(diff > 0, guess, high)
+        low = np.where(diff < 0, guess, low)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            newton = guess - diff / vega
+        guess = np.where((newton > low) & (newton < high) & (vega > 1e-12), newton, 0.5 * (low + high))
+
+    return sigma
+
+
+def greeks(
+    spot: np.ndarray,
+    strike: np.ndarray,
+    years: np.ndarray,
+    sigma: np.ndarray,
+    rate: float,
+    is_call: np.ndarray
+) -> Dict[str, np.ndarray]:
+    """
+    Greeks with respect to the spot price of the underlying.
+
+    Args:
+        spot: Underlying price
+        strike: Strike prices
+        years: Time to expiry in years
+        sigma: Volatility
+        rate: Continuously compounded risk-free rate
+        is_call: True for calls, False for puts
+
+    Returns:
+        Dict of 'delta', 'gamma', 'theta' (per calendar day) and 'vega' (per
+        volatility point)
+    """
+    forward = spot * np.exp(rate * years)
+    d1, d2 = _d1_d2(forward, strike, years, sigma)
+    density = norm_pdf(d1)
+    root_years = np.sqrt(years)
+    carry = rate * strike * np.exp(-rate * years)
+
+    decay = -spot * density * sigma / (2 * root_years)
+    theta = np.where(is_call, decay - carry * norm_cdf(d2), decay + carry * norm_cdf(-d2))
+    return {
+        'delta': np.where(is_call, norm_cdf(d1), norm_cdf(d1) - 1),
+        'gamma': density / (spot * sigma * root_years),
+        'theta': theta / 365,
+        'vega': spot * density * root_years / 100
+    }
+
+
+@timed_stage("greeks")
+def chain_greeks(
+    df: pd.DataFrame,
+    expiry_date: str,
+    rate: float = settings.RISK_FREE_RATE,
+    now: Optional[datetime] = None
+) -> pd.DataFrame:
+    """
+    Implied volatility and Greeks of every row of a chain.
+
+    Prices are the chain's bid/ask quotes and the underlying is the row's
+    underlying_ltp, taken as spot with the forward implied by `rate`.
+
+    Args:
+        df: Chain with strike_price, option_type, bid/ask and underlying_ltp
+        expiry_date: Expiry date in YYYY-MM-DD format
+        rate: Continuously compounded risk-free rate
+        now: Current time, for the time to expiry
+
+    Returns:
+        Frame aligned with `df` holding GREEK_COLUMNS; NaN where no
+        volatility is implied
+    """
+    # Quotes on expiry day still have a few hours left, not a full day
+    years = years_to_expiry(expiry_date, now, min_days=1 / 24)
+    spot = df['underlying_ltp'].to_numpy(dtype=float)
+    strike = df['strike_price'].to_numpy(dtype=float)
+    is_call = (df['option_type'] == 'CE').to_numpy()
+
+    iv = implied_volatility(
+        df['bid/ask'].to_numpy(dtype=float), spot * np.exp(rate * years), strike, years, rate, is_call
+    )
+    with np.errstate(divide='ignore', invalid='ignore'):
+        values = greeks(spot, strike, years, iv, rate, is_call)
+    return pd.DataFrame({'iv': iv, **values}, index=df.index)
@@ -0,0 +1,100 @@
+from datetime import datetime, time as dtime, timedelta, timezone
+from typing import List, Optional, Tuple
+
+IST = timezone(timedelta(hours=5, minutes=30))
+
+# Options expire at the close on expiry day
+EXPIRY_TIME = dtime(15, 30)
+
+
+def now_ist() -> datetime:
+    """Current time in India Standard Time"""
+    return datetime.now(IST)
+
+
+def parse_times_of_day(spec: str) -> List[dtime]:
+    """
+    Parse a comma separated list of 'HH:MM' times.
+
+    Args:
+        spec: e.g. '09:15,15:30'; an empty string gives an empty list
+
+    Returns:
+        Sorted list of times
+
+    Raises:
+        ValueError: If any entry is not a valid 'HH:MM' time
+    """
+    times = []
+    for part in spec.split(','):
+        part = part.strip()
+        if part:
+            times.append(datetime.strptime(part, '%H:%M').time())
+    return sorted(times)
+
+
+def seconds_until_next(times: List[dtime], now: Optional[datetime] = None) -> Optional[float]:
+    """
+    Seconds from `now` until the next occurrence of any of `times` (IST).
+
+    Returns:
+        Seconds until the next boundary, or None if `times` is empty
+    """
+    if not times:
+        return None
+
+    now = now or now_ist()
+    for day_offset in (0, 1):
+        day = (now + timedelta(days=day_offset)).date()
+        for time_of_day in times:
+            boundary = datetime.combine(day, time_of_day, tzinfo=IST)
+            if boundary > now:
+                return (boundary - now).total_seconds()
+    return None
+
+
+def parse_time_range(spec: str) -> Tuple[dtime, dtime]:
+    """
+    Parse an 'HH:MM-HH:MM' range of times of day.
+
+    Raises:
+        ValueError: If the range is malformed or ends before it starts
+    """
+    start, separator, end = spec.partition('-')
+    if not separator:
+        raise ValueError(f"Expected 'HH:MM-HH:MM', got {spec!r}")
+    start_time = datetime.strptime(start.strip(), '%H:%M').time()
+    end_time = datetime.strptime(end.strip(), '%H:%M').time()
+    if end_time <= start_time:
+        raise ValueError(f"Time range {spec!r} ends before it starts")
+    return start_time, end_time
+
+
+def is_trading_time(hours: Tuple[dtime, dtime], now: Optional[datetime] = None) -> bool:
+    """Whether `now` (IST) falls within `hours` on a weekday; exchange holidays are not known"""
+    now = now or now_ist()
+    return now.weekday() < 5 and hours[0] <= now.time() < hours[1]
+
+
+def seconds_until_trading(hours: Tuple[dtime, dtime], now: Optional[datetime] = None) -> float:
+    """Seconds from `now` until `hours` next begin on a weekday, or 0 while they last"""
+    now = now or now_ist()
+    if is_trading_time(hours, now):
+        return 0.0
+    # Today if the hours are still ahead, otherwise tomorrow; then skip the weekend
+    day = now.date() if now.time() < hours[0] else now.date() + timedelta(days=1)
+    while day.weekday() >= 5:
+        day += timedelta(days=1)
+    return (datetime.combine(day, hours[0], tzinfo=IST) - now).total_seconds()
+
+
+def years_to_expiry(expiry_date: str, now: Optional[datetime] = None, min_days: float = 1.0) -> float:
+    """
+    Time left until the close on `expiry_date` ('YYYY-MM-DD'), in years.
+
+    At least `min_days` is returned, so contracts on their expiry day do not
+    get unbounded annualized figures.
+    """
+    now = now or now_ist()
+    expiry = datetime.combine(datetime.strptime(expiry_date, '%Y-%m-%d').date(), EXPIRY_TIME, tzinfo=IST)
+    return max((expiry - now).total_seconds(), min_days * 86400.0) / (365 * 86400.0)
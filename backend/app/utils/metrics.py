@@ -0,0 +1,285 @@
+import asyncio
+import functools
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+# Upper bounds of the duration histograms, in seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LabelValues = Tuple[str, ...]
+
+# Stage durations of the request being handled, in seconds
+_request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_timings", default=None)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    """Monotonic counter with labels"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: Any) -> float:
+        return self._values.get(tuple(str(labels[name]) for name in self.labelnames), 0.0)
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        for key, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Histogram:
+    """Cumulative histogram with labels, in Prometheus bucket layout"""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (+Inf last), sum, count]
+        self._series: Dict[LabelValues, List[Any]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, **labels: Any) -> int:
+        series = self._series.get(tuple(str(labels[name]) for name in self.labelnames))
+        return series[2] if series else 0
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        for key, (counts, total, count) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, float('inf')), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else _format_value(bound)
+                labels = _format_labels(self.labelnames, key, f'le="{le}"')
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {count}"
+
+
+class MetricsRegistry:
+    """Process-wide set of metrics rendered together by /metrics"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._metrics.setdefault(name, Counter(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._metrics.setdefault(name, Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.histogram(
+    "optionchain_stage_duration_seconds", "Time spent in each stage of the option chain pipeline", ("stage",)
+)
+UPSTREAM_REQUESTS = registry.counter(
+    "fyers_upstream_requests_total", "Requests made to Fyers APIs by endpoint and HTTP status", ("endpoint", "status")
+)
+UPSTREAM_RETRIES = registry.counter(
+    "fyers_upstream_retries_total", "Fyers requests repeated after a failed or unusable response", ("endpoint",)
+)
+PREFETCH_REFRESHES = registry.counter(
+    "prefetch_refreshes_total", "Watchlist chains refreshed in the background, by outcome", ("status",)
+)
+SNAPSHOT_ROWS = registry.counter(
+    "snapshot_rows_total", "Option chain rows recorded to the snapshot store, by outcome", ("status",)
+)
+HTTP_REQUEST_SECONDS = registry.histogram(
+    "http_request_duration_seconds", "Time to the first response byte by endpoint", ("method", "handler", "status")
+)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """
+    Time a pipeline stage.
+
+    The duration goes to the stage histogram and, within a request, to the
+    request's Server-Timing breakdown. Repeated stages add up.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + elapsed
+
+
+def timed_stage(name: str) -> Callable[[Callable], Callable]:
+    """Decorator form of `stage` for sync and async functions"""
+    def decorator(fn: Callable) -> Callable:
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def timed_async(*args, **kwargs):
+                with stage(name):
+                    return await fn(*args, **kwargs)
+            return timed_async
+
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+        return timed
+
+    return decorator
+
+
+def record_upstream(endpoint: str, status: Any) -> None:
+    """Count one Fyers request; `status` is the HTTP status or 'error' if none came back"""
+    UPSTREAM_REQUESTS.inc(endpoint=endpoint, status=status)
+
+
+def server_timing(timings: Dict[str, float], total: float) -> str:
+    """Server-Timing header value, durations in milliseconds"""
+    entries = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in timings.items()]
+    entries.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(entries)
+
+
+def cache_metrics(caches: Iterable[Any]) -> str:
+    """Render AsyncTTLCache counters, read at scrape time"""
+    series = {
+        "cache_hits_total": ("counter", "Cache lookups that found a fresh entry", "hits"),
+        "cache_misses_total": ("counter", "Cache lookups that did not", "misses"),
+        "cache_coalesced_total": ("counter", "Lookups that joined an in-flight computation", "coalesced"),
+        "cache_evictions_total": ("counter", "Entries evicted for size", "evictions"),
+        "cache_entries": ("gauge", "Entries currently cached", "entries"),
+        "cache_bytes": ("gauge", "Estimated size of the cached entries", "bytes")
+    }
+    stats = sorted(((cache.name, cache.stats()) for cache in caches), key=lambda item: item[0])
+    lines = []
+    for name, (kind, documentation, field) in series.items():
+        lines.append(f"# HELP {name} {documentation}")
+        lines.append(f"# TYPE {name} {kind}")
+        for cache_name, values in stats:
+            lines.append(f'{name}{{cache="{cache_name}"}} {_format_value(values[field])}')
+    return "\n".join(lines) + "\n"
+
+
+def rate_limit_metrics(stats: Dict[str, Dict[str, float]]) -> str:
+    """Render the rate limiter's per-endpoint rates, read at scrape time"""
+    series = {
+        "fyers_rate_limit_current_rps": ("Request rate currently allowed, lowered while throttled", "rate"),
+        "fyers_rate_limit_max_rps": ("Configured request budget", "max_rate")
+    }
+    lines = []
+    for name, (documentation, field) in series.items():
+        lines.append(f"# HELP {name} {documentation}")
+        lines.append(f"# TYPE {name} gauge")
+        for endpoint, values in sorted(stats.items()):
+            lines.append(f'{name}{{endpoint="{endpoint}"}} {_format_value(values[field])}')
+    return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording request durations and stage breakdowns.
+
+    Each HTTP request gets its own stage timings, which `stage` fills in
+    wherever the request's work runs (worker threads included). With
+    `timing_header` on, they are returned in a Server-Timing header.
+    Streamed responses only include the stages done before the first byte.
+    """
+
+    def __init__(self, app: Callable, timing_header: bool = False):
+        self.app = app
+        self.timing_header = timing_header
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings: Dict[str, float] = {}
+        token = _request_timings.set(timings)
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_with_timing(message: Dict[str, Any]) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                elapsed = time.perf_counter() - start
+                route = scope.get("route")
+                HTTP_REQUEST_SECONDS.observe(
+                    elapsed,
+                    method=scope["method"],
+                    handler=getattr(route, "name", "unmatched"),
+                    status=status_code
+                )
+                if self.timing_header:
+                    header = (b"server-timing", server_timing(timings, elapsed).encode())
+                    message = {**message, "headers": [*message.get("headers", []), header]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_timings.reset(token)
@@ -0,0 +1,176 @@
+import io
+import json
+from typing import Any, Dict, List, Optional
+
+import orjson
+import pandas as pd
+from fastapi import HTTPException, Request, Response, status
+
+from app.utils.metrics import stage
+
+JSON = "json"
+COLUMNAR = "columnar"
+ARROW = "arrow"
+PARQUET = "parquet"
+NDJSON = "ndjson"
+SSE = "sse"
+
+MEDIA_TYPES = {
+    JSON: "application/json",
+    COLUMNAR: "application/vnd.optionchain.columnar+json",
+    ARROW: "application/vnd.apache.arrow.stream",
+    PARQUET: "application/vnd.apache.parquet"
+}
+STREAM_MEDIA_TYPES = {
+    NDJSON: "application/x-ndjson",
+    SSE: "text/event-stream"
+}
+
+ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+def negotiate_format(
+    request: Request,
+    requested: Optional[str] = None,
+    media_types: Dict[str, str] = MEDIA_TYPES
+) -> str:
+    """
+    Pick the response format for a request.
+
+    An explicit `format` query parameter wins; otherwise the Accept header
+    is matched in order of preference. Requests without an Accept header, or
+    accepting anything, get the first entry of `media_types`.
+
+    Args:
+        request: Incoming request
+        requested: Value of the `format` query parameter, if any
+        media_types: Supported format -> media type, default first
+
+    Raises:
+        HTTPException: 406 if no supported format is acceptable
+    """
+    if requested:
+        if requested not in media_types:
+            raise HTTPException(
+                status_code=status.HTTP_406_NOT_ACCEPTABLE,
+                detail=f"Unsupported format '{requested}', use one of {', '.join(media_types)}"
+            )
+        return requested
+
+    default = next(iter(media_types))
+    accept = request.headers.get("accept")
+    if not accept:
+        return default
+
+    formats_by_media_type = {media_type: fmt for fmt, media_type in media_types.items()}
+    formats_by_media_type.setdefault("*/*", default)
+    formats_by_media_type.setdefault(f"{media_types[default].split('/')[0]}/*", default)
+
+    preferences = []
+    for position, part in enumerate(accept.split(',')):
+        media_type, *params = [token.strip() for token in part.split(';')]
+        quality = 1.0
+        for param in params:
+            if param.startswith('q='):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            preferences.append((-quality, position, media_type.lower()))
+
+    for _, _, media_type in sorted(preferences):
+        fmt = formats_by_media_type.get(media_type)
+        if fmt is not None:
+            return fmt
+
+    raise HTTPException(
+        status_code=status.HTTP_406_NOT_ACCEPTABLE,
+        detail=f"None of the requested media types are supported: {', '.join(media_types.values())}"
+    )
+
+
+def frame_to_columns(df: pd.DataFrame) -> Dict[str, List[Any]]:
+    """One list per column, the body of the columnar JSON layout"""
+    return {column: df[column].tolist() for column in df.columns}
+
+
+def frame_to_records(df: pd.DataFrame) -> List[Dict[str, Any]]:
+    """One dict per row, the body of the default JSON layout"""
+    return df.to_dict(orient='records')
+
+
+def encode_frame(df: pd.DataFrame, fmt: str, metadata: Optional[Dict[str, Any]] = None) -> bytes:
+    """
+    Encode a frame in one of the supported formats.
+
+    Args:
+        df: Rows to encode
+        fmt: One of JSON, COLUMNAR, ARROW or PARQUET
+        metadata: Extra JSON-serializable fields. Binary formats carry them
+            as schema metadata, JSON formats as top-level keys next to the
+            rows (in which case the rows are under 'data').
+
+    Returns:
+        Encoded body
+    """
+    if fmt in (JSON, COLUMNAR):
+        rows = frame_to_columns(df) if fmt == COLUMNAR else frame_to_records(df)
+        body = rows if metadata is None else {"data": rows, **metadata}
+        return orjson.dumps(body, option=ORJSON_OPTIONS)
+
+    # Imported lazily: only binary responses need pyarrow
+    import pyarrow as pa
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    if metadata:
+        table = table.replace_schema_metadata({
+            **(table.schema.metadata or {}),
+            **{key.encode(): json.dumps(value, default=str).encode() for key, value in metadata.items()}
+        })
+
+    sink = io.BytesIO()
+    if fmt == ARROW:
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+    else:
+        import pyarrow.parquet as pq
+        pq.write_table(table, sink)
+    return sink.getvalue()
+
+
+def render_frame(
+    df: pd.DataFrame,
+    fmt: str,
+    headers: Optional[Dict[str, str]] = None,
+    metadata: Optional[Dict[str, Any]] = None
+) -> Response:
+    """Encode a frame and wrap it in a response with the matching media type"""
+    with stage("encoding"):
+        content = encode_frame(df, fmt, metadata)
+    return Response(
+        content=content,
+        media_type=MEDIA_TYPES[fmt],
+        headers={"Vary": "Accept", **(headers or {})}
+    )
+
+
+def render_json(body: Any, headers: Optional[Dict[str, str]] = None) -> Response:
+    """Serialize an arbitrary JSON body with orjson"""
+    return Response(
+        content=orjson.dumps(body, option=ORJSON_OPTIONS),
+        media_type=MEDIA_TYPES[JSON],
+        headers={"Vary": "Accept", **(headers or {})}
+    )
+
+
+def encode_event(fmt: str, event: str, data: Any) -> bytes:
+    """
+    Encode one event of a streamed response.
+
+    NDJSON events are single lines of {"event": ..., "data": ...}; SSE
+    events use the event name as the SSE event type.
+    """
+    if fmt == SSE:
+        return b"event: " + event.encode() + b"\ndata: " + orjson.dumps(data, option=ORJSON_OPTIONS) + b"\n\n"
+    return orjson.dumps({"event": event, "data": data}, option=ORJSON_OPTIONS) + b"\n"
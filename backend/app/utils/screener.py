@@ -0,0 +1,170 @@
+import heapq
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app.utils.calculations import find_atm_strike
+from app.utils.market_time import years_to_expiry
+
+RANK_BY = ('yield', 'annualized_yield')
+
+SCREENER_COLUMNS = [
+    'instrument_name', 'expiry_date', 'strike_price', 'option_type', 'bid/ask', 'premium',
+    'margin', 'margin_source', 'margin_estimated', 'moneyness', 'yield', 'annualized_yield'
+]
+
+
+def make_prefilter(
+    moneyness_range: Optional[float] = None,
+    min_premium: Optional[float] = None
+) -> Callable[[pd.DataFrame, int], pd.DataFrame]:
+    """
+    Build a chain filter on moneyness and premium.
+
+    Both are known before margins are, so filtering on them first avoids
+    pricing rows that can never be selected.
+    """
+    def prefilter(df: pd.DataFrame, lot_size: int) -> pd.DataFrame:
+        if df.empty:
+            return df
+
+        mask = np.ones(len(df), dtype=bool)
+        if moneyness_range is not None:
+            spot, _ = find_atm_strike(df)
+            mask &= np.abs(df['strike_price'].to_numpy(dtype=float) / spot - 1) <= moneyness_range
+        if min_premium is not None:
+            mask &= df['bid/ask'].to_numpy(dtype=float) * lot_size >= min_premium
+        return df[mask].reset_index(drop=True)
+
+    return prefilter
+
+
+class TopKScreener:
+    """
+    Bounded min-heap of the best rows by premium/margin yield.
+
+    Priced chains are pushed one at a time and only the selected rows are
+    copied out of them, so a caller that drops each chain after pushing it
+    holds at most `top_k` rows however many chains are scanned. Yields are
+    computed per chain in one vectorized pass, and each chain offers at most
+    its own best `top_k` rows to the heap.
+    """
+
+    def __init__(
+        self,
+        top_k: int,
+        rank_by: str = 'yield',
+        min_premium: Optional[float] = None,
+        max_margin: Optional[float] = None,
+        now: Optional[datetime] = None
+    ):
+        self.top_k = top_k
+        self.rank_by = rank_by
+        self.min_premium = min_premium
+        self.max_margin = max_margin
+        self.now = now
+        self.counts = {"rows_scanned": 0, "rows_matched": 0}
+        self._heap: List[Tuple[float, int, Dict[str, Any]]] = []
+        self._sequence = 0
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def push(self, result: Dict[str, Any]) -> None:
+        """
+        Offer the rows of one priced chain to the heap.
+
+        Args:
+            result: A result of `get_bulk_option_chain_data` or
+                `iter_bulk_option_chain_data`; failed items are skipped
+        """
+        df = result.get("data")
+        if df is None or df.empty:
+            return
+        self.counts["rows_scanned"] += len(df)
+
+        premium = df['premium'].to_numpy(dtype=float)
+        margin = df['margin'].to_numpy(dtype=float)
+        mask = df['margin_available'].to_numpy(dtype=bool) & (margin > 0)
+        if self.min_premium is not None:
+            mask &= premium >= self.min_premium
+        if self.max_margin is not None:
+            mask &= margin <= self.max_margin
+
+        rows = np.flatnonzero(mask)
+        self.counts["rows_matched"] += len(rows)
+        if not len(rows):
+            return
+
+        top_k = self.top_k
+        heap = self._heap
+        yields = premium[rows] / margin[rows]
+        annualized = yields / years_to_expiry(result["expiry_date"], self.now)
+        scores = yields if self.rank_by == 'yield' else annualized
+        best = np.argpartition(-scores, top_k - 1)[:top_k] if len(rows) > top_k else np.arange(len(rows))
+
+        spot, _ = find_atm_strike(df)
+        strikes = df['strike_price'].to_numpy()
+        for candidate in best:
+            score = float(scores[candidate])
+            self._sequence += 1
+            if len(heap) >= top_k and score <= heap[0][0]:
+                continue
+
+            row = rows[candidate]
+            entry = (score, -self._sequence, {
+                'instrument_name': df['instrument_name'].iat[row],
+                'expiry_date': result["expiry_date"],
+                'strike_price': strikes[row],
+                'option_type': df['option_type'].iat[row],
+                'bid/ask': df['bid/ask'].iat[row],
+                'premium': premium[row],
+                'margin': margin[row],
+                'margin_source': df['margin_source'].iat[row],
+                'margin_estimated': df['margin_source'].iat[row] == 'estimated',
+                'moneyness': float(strikes[row] / spot - 1),
+                'yield': float(yields[candidate]),
+                'annualized_yield': float(annualized[candidate])
+            })
+            if len(heap) < top_k:
+                heapq.heappush(heap, entry)
+            else:
+                heapq.heapreplace(heap, entry)
+
+    def frame(self) -> pd.DataFrame:
+        """Selected rows in SCREENER_COLUMNS, best first"""
+        selected = [row for _, _, row in sorted(self._heap, key=lambda entry: (-entry[0], -entry[1]))]
+        return pd.DataFrame(selected, columns=SCREENER_COLUMNS)
+
+
+def screen_results(
+    results: Iterable[Dict[str, Any]],
+    top_k: int,
+    rank_by: str = 'yield',
+    min_premium: Optional[float] = None,
+    max_margin: Optional[float] = None,
+    now: Optional[datetime] = None
+) -> Tuple[pd.DataFrame, Dict[str, int]]:
+    """
+    Select the top-k rows by premium/margin yield across priced chains.
+
+    Args:
+        results: Results of `get_bulk_option_chain_data`; failed items are
+            skipped
+        top_k: Number of rows to keep
+        rank_by: 'yield' (premium / margin) or 'annualized_yield' (yield
+            scaled by the time left to expiry)
+        min_premium: Drop rows whose premium is lower
+        max_margin: Drop rows whose margin is higher
+        now: Current time, for annualization
+
+    Returns:
+        Tuple of (selected rows in SCREENER_COLUMNS, best first; counts of
+        rows scanned and rows that passed the filters)
+    """
+    screener = TopKScreener(top_k, rank_by, min_premium, max_margin, now)
+    for result in results:
+        screener.push(result)
+    return screener.frame(), screener.counts
@@ -1,9 +1,8 @@
-import pandas as pd
 import logging
-import requests
 from datetime import datetime
 from typing import Tuple, Optional
 from fastapi import HTTPException, status
+from app.services.symbol_master import symbol_master, SymbolMasterFetchError
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -42,70 +41,10 @@ def validate_input_parameters(instrument_name: str, expiry_date: str, side: str)
     except ValueError:
         raise ValueError("Invalid expiry date format. Use YYYY-MM-DD")
     
-    if side not in ['CE', 'PE']:
-        raise ValueError("Side must be either 'CE' or 'PE'")
+    if side not in ['CE', 'PE', 'BOTH']:
+        raise ValueError("Side must be one of 'CE', 'PE' or 'BOTH'")
 
-def fetch_symbol_data() -> pd.DataFrame:
-    """
-    Fetch symbol data from Fyers API.
-    
-    Returns:
-        DataFrame containing symbol data
-        
-    Raises:
-        DataFetchError: If data fetch fails
-    """
-    try:
-        url = 'https://public.fyers.in/sym_details/NSE_FO_sym_master.json'
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        
-        script = pd.read_json(url)
-        if script.empty:
-            raise DataFetchError("Empty data received from Fyers API")
-            
-        return script.T
-        
-    except requests.RequestException as e:
-        logger.error(f"Failed to fetch symbol data: {str(e)}", exc_info=True)
-        raise DataFetchError(f"Failed to fetch symbol data: {str(e)}")
-    except ValueError as e:
-        logger.error(f"Failed to parse symbol data: {str(e)}", exc_info=True)
-        raise DataFetchError(f"Failed to parse symbol data: {str(e)}")
-
-def process_symbol_data(df: pd.DataFrame) -> pd.DataFrame:
-    """
-    Process and clean symbol data.
-    
-    Args:
-        df: Raw symbol data DataFrame
-        
-    Returns:
-        Processed DataFrame
-        
-    Raises:
-        DataFetchError: If processing fails
-    """
-    try:
-        required_columns = {'optType', 'underSym', 'expiryDate', 'minLotSize'}
-        if not all(col in df.columns for col in required_columns):
-            raise DataFetchError("Missing required columns in symbol data")
-
-        # Select and filter columns
-        processed_df = df[list(required_columns)].copy()
-        processed_df = processed_df[processed_df['optType'] != 'XX']
-        
-        # Convert and format dates
-        processed_df['expiryDate'] = pd.to_datetime(processed_df['expiryDate'], unit='s')
-        processed_df['expiryDate'] = processed_df['expiryDate'].dt.strftime('%Y-%m-%d')
-        
-        return processed_df
-        
-    except Exception as e:
-        logger.error(f"Failed to process symbol data: {str(e)}", exc_info=True)
-        raise DataFetchError(f"Failed to process symbol data: {str(e)}")
-
-def get_symbol_name(
+async def get_symbol_name(
     instrument_name: str, 
     expiry_date: str, 
     side: str
@@ -116,7 +55,8 @@ def get_symbol_name(
     Args:
         instrument_name: Name of the instrument (e.g. 'HDFCBANK')
         expiry_date: Expiry date in 'YYYY-MM-DD' format
-        side: Option type ('CE' or 'PE')
+        side: Option type ('CE' or 'PE'); 'BOTH' resolves whichever of the
+            two exists, since one chain fetch returns calls and puts alike
         
     Returns:
         Tuple of (symbol_name, lot_size)
@@ -130,27 +70,25 @@ def get_symbol_name(
         # Validate input parameters
         validate_input_parameters(instrument_name, expiry_date, side)
         
-        # Fetch and process data
-        raw_data = fetch_symbol_data()
-        processed_df = process_symbol_data(raw_data)
-        
-        # Apply filters
-        filtered_df = processed_df[
-            (processed_df['underSym'] == instrument_name) & 
-            (processed_df['expiryDate'] == expiry_date) & 
-            (processed_df['optType'] == side)
-        ]
-        
-        if filtered_df.empty:
+        # Resolve against the cached symbol master index
+        entry = None
+        try:
+            for option_type in (['CE', 'PE'] if side == 'BOTH' else [side]):
+                entry = await symbol_master.lookup(instrument_name, expiry_date, option_type)
+                if entry is not None:
+                    break
+        except SymbolMasterFetchError as e:
+            raise DataFetchError(str(e))
+
+        if entry is None:
             raise SymbolNotFoundError(
                 f"No symbol found for {instrument_name} expiring {expiry_date} ({side})"
             )
             
         # Get the symbol name and lot size
-        symbol_name = filtered_df.index[0]
-        lot_size = filtered_df.loc[symbol_name, 'minLotSize']
+        symbol_name, lot_size = entry
         
-        if not isinstance(lot_size, (int, float)) or lot_size <= 0:
+        if lot_size <= 0:
             raise ValueError(f"Invalid lot size: {lot_size}")
             
         logger.info(f"Successfully resolved symbol: {symbol_name} (lot size: {lot_size})")
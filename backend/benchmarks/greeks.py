@@ -0,0 +1,63 @@
+"""
+Per-chain solve time of the vectorized implied volatility and Greeks.
+
+Run from the backend directory:
+
+    python -m benchmarks.greeks [--repeat N]
+
+Synthetic chains of 80 to 800 strikes (calls and puts) are priced with
+known volatilities, then solved back. Reported times are the median of
+`repeat` runs of `chain_greeks`, the full per-request cost.
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from app.utils.greeks import black76_price, chain_greeks
+from app.utils.market_time import years_to_expiry
+
+SPOT = 24000.0
+RATE = 0.065
+EXPIRY = '2030-01-31'
+NOW = pd.Timestamp('2030-01-24 10:00', tz='Asia/Kolkata').to_pydatetime()
+STRIKE_COUNTS = (80, 200, 400, 800)
+
+
+def synthetic_chain(strikes: int, seed: int = 0) -> pd.DataFrame:
+    """Chain of `strikes` rows around SPOT, priced with a volatility smile"""
+    rng = np.random.default_rng(seed)
+    strike = SPOT + 50 * (np.arange(strikes) - strikes // 2)
+    option_type = np.where(np.arange(strikes) % 2 == 0, 'CE', 'PE')
+    sigma = 0.12 + 0.6 * np.square(strike / SPOT - 1) + rng.uniform(0, 0.01, strikes)
+    years = years_to_expiry(EXPIRY, NOW)
+    price = black76_price(SPOT * np.exp(RATE * years), strike, years, sigma, RATE, option_type == 'CE')
+    return pd.DataFrame({
+        'strike_price': strike,
+        'option_type': option_type,
+        'bid/ask': np.round(price, 2),
+        'underlying_ltp': SPOT
+    })
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    print(f"{'strikes':>8} {'median ms':>10} {'p95 ms':>8} {'us/strike':>10} {'solved':>7}")
+    for strikes in STRIKE_COUNTS:
+        chain = synthetic_chain(strikes)
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            result = chain_greeks(chain, EXPIRY, RATE, NOW)
+            timings.append(time.perf_counter() - start)
+        median, p95 = np.percentile(timings, [50, 95]) * 1000
+        solved = int(result['iv'].notna().sum())
+        print(f"{strikes:>8} {median:>10.2f} {p95:>8.2f} {median * 1000 / strikes:>10.2f} {solved:>7}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+"""
+Local stand-in for the Fyers REST APIs, replaying recorded responses.
+
+Serves the four endpoints the backend calls:
+
+    GET  /sym_details/NSE_FO_sym_master.json   symbol master
+    POST /api/v3/validate-refresh-token       token refresh
+    GET  /data/options-chain-v3               option chain
+    POST /api/v2/span_margin                  SPAN margin
+
+Responses come from a fixtures directory laid out as
+
+    NSE_FO_sym_master.json      the symbol master, as downloaded
+    optionchain/<underSym>.json one options-chain-v3 response per underlying
+    span_margin.json            symbol -> margin of selling one lot
+
+Chains are trimmed to the requested strikecount around the underlying
+price, and multi-leg span_margin requests get a basket total like the live
+endpoint does. Every endpoint can be given a latency and error profile.
+
+Run standalone with
+
+    python -m benchmarks.mock_fyers --port 8765 --latency-ms 40 --error-rate 0.01
+
+and point the backend at it through FYERS_API_URL, FYERS_DATA_URL,
+FYERS_SPAN_MARGIN_URL and SYMBOL_MASTER_URL (see `MockFyersServer.env`).
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from aiohttp import web
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+SYMBOL_MASTER = "symbol_master"
+REFRESH = "refresh"
+OPTION_CHAIN = "optionchain"
+SPAN_MARGIN = "span_margin"
+ENDPOINTS = (SYMBOL_MASTER, REFRESH, OPTION_CHAIN, SPAN_MARGIN)
+
+
+@dataclass
+class EndpointProfile:
+    """
+    Latency and failure behaviour of one mocked endpoint.
+
+    Attributes:
+        latency_ms: Mean added latency
+        jitter_ms: Standard deviation of the latency (never below zero)
+        error_rate: Fraction of requests answered with HTTP 500
+        throttle_rate: Fraction of requests answered with HTTP 429
+    """
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    error_rate: float = 0.0
+    throttle_rate: float = 0.0
+
+
+class MockFyersServer:
+    """
+    In-process aiohttp server replaying Fyers fixtures.
+
+    Args:
+        fixtures_dir: Directory of recorded responses
+        profiles: Endpoint name -> profile; missing endpoints answer
+            immediately and never fail
+        seed: Seed of the latency and failure draws, for repeatable runs
+    """
+
+    def __init__(
+        self,
+        fixtures_dir: str = FIXTURES_DIR,
+        profiles: Optional[Dict[str, EndpointProfile]] = None,
+        seed: int = 0
+    ):
+        self.profiles = {endpoint: EndpointProfile() for endpoint in ENDPOINTS}
+        self.profiles.update(profiles or {})
+        self.calls: Counter = Counter()
+        self.failures: Counter = Counter()
+        self._random = random.Random(seed)
+        self._runner: Optional[web.AppRunner] = None
+        self.base_url: Optional[str] = None
+
+        with open(os.path.join(fixtures_dir, "NSE_FO_sym_master.json"), "rb") as f:
+            self._symbol_master = f.read()
+        self._underlyings = {
+            symbol: record["underSym"] for symbol, record in json.loads(self._symbol_master).items()
+        }
+        self._chains: Dict[str, Dict[str, Any]] = {}
+        chains_dir = os.path.join(fixtures_dir, "optionchain")
+        for filename in os.listdir(chains_dir):
+            with open(os.path.join(chains_dir, filename)) as f:
+                self._chains[os.path.splitext(filename)[0]] = json.load(f)
+        with open(os.path.join(fixtures_dir, "span_margin.json")) as f:
+            self._margins: Dict[str, float] = json.load(f)
+
+    @property
+    def env(self) -> Dict[str, str]:
+        """Backend settings that route every Fyers call to this server"""
+        return {
+            "FYERS_API_URL": f"{self.base_url}/api/v3",
+            "FYERS_DATA_URL": f"{self.base_url}/data",
+            "FYERS_SPAN_MARGIN_URL": f"{self.base_url}/api/v2/span_margin",
+            "SYMBOL_MASTER_URL": f"{self.base_url}/sym_details/NSE_FO_sym_master.json"
+        }
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Start serving; port 0 picks a free port. Returns the base URL."""
+        app = web.Application()
+        app.router.add_get("/sym_details/NSE_FO_sym_master.json", self._symbol_master_handler)
+        app.router.add_post("/api/v3/validate-refresh-token", self._refresh_handler)
+        app.router.add_get("/data/options-chain-v3", self._option_chain_handler)
+        app.router.add_post("/api/v2/span_margin", self._span_margin_handler)
+
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        self.base_url = f"http://{host}:{self._runner.addresses[0][1]}"
+        return self.base_url
+
+    async def close(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _simulate(self, endpoint: str) -> Optional[web.Response]:
+        """Apply an endpoint's latency, and return an error response if it fails"""
+        self.calls[endpoint] += 1
+        profile = self.profiles[endpoint]
+        latency = max(0.0, self._random.gauss(profile.latency_ms, profile.jitter_ms)) if profile.jitter_ms \
+            else profile.latency_ms
+        if latency:
+            await asyncio.sleep(latency / 1000)
+
+        draw = self._random.random()
+        if draw < profile.throttle_rate:
+            self.failures[endpoint] += 1
+            return web.json_response(
+                {"s": "error", "code": 429, "message": "request limit reached"}, status=429
+            )
+        if draw < profile.throttle_rate + profile.error_rate:
+            self.failures[endpoint] += 1
+            return web.json_response({"s": "error", "code": 500, "message": "internal error"}, status=500)
+        return None
+
+    async def _symbol_master_handler(self, request: web.Request) -> web.Response:
+        failure = await self._simulate(SYMBOL_MASTER)
+        if failure is not None:
+            return failure
+        return web.Response(body=self._symbol_master, content_type="application/json")
+
+    async def _refresh_handler(self, request: web.Request) -> web.Response:
+        failure = await self._simulate(REFRESH)
+        if failure is not None:
+            return failure
+        return web.json_response(
+            {"s": "ok", "code": 200, "message": "", "access_token": "mock-access-token", "expires_in": 86400}
+        )
+
+    async def _option_chain_handler(self, request: web.Request) -> web.Response:
+        failure = await self._simulate(OPTION_CHAIN)
+        if failure is not None:
+            return failure
+
+        symbol = request.query.get("symbol", "")
+        recorded = self._chains.get(self._underlyings.get(symbol, ""))
+        if recorded is None:
+            return web.json_response({"s": "error", "code": -300, "message": f"Invalid symbol {symbol}"}, status=400)
+
+        try:
+            strike_count = int(request.query.get("strikecount", 10))
+        except ValueError:
+            strike_count = 10
+        return web.json_response(self._trim_chain(recorded, strike_count))
+
+    async def _span_margin_handler(self, request: web.Request) -> web.Response:
+        failure = await self._simulate(SPAN_MARGIN)
+        if failure is not None:
+            return failure
+
+        legs = (await request.json()).get("data") or []
+        missing = [leg.get("symbol") for leg in legs if leg.get("symbol") not in self._margins]
+        if not legs or missing:
+            return web.json_response({"s": "error", "code": -300, "message": f"Invalid symbols {missing}"})
+
+        total = sum(self._margins[leg["symbol"]] for leg in legs)
+        return web.json_response({"s": "ok", "code": 200, "message": "", "data": {"total": total}})
+
+    @staticmethod
+    def _trim_chain(recorded: Dict[str, Any], strike_count: int) -> Dict[str, Any]:
+        """Keep the underlying row and the `strike_count` strikes each side of ATM"""
+        rows = recorded["data"]["optionsChain"]
+        spot = next((row["ltp"] for row in rows if row["strike_price"] == -1), None)
+        strikes = sorted({row["strike_price"] for row in rows if row["strike_price"] != -1})
+        if spot is not None and strikes:
+            atm = min(range(len(strikes)), key=lambda i: abs(strikes[i] - spot))
+            kept = set(strikes[max(0, atm - strike_count):atm + strike_count + 1])
+            rows = [row for row in rows if row["strike_price"] == -1 or row["strike_price"] in kept]
+        return {**recorded, "data": {**recorded["data"], "optionsChain": rows}}
+
+
+async def _serve(args: argparse.Namespace) -> None:
+    profile = EndpointProfile(args.latency_ms, args.jitter_ms, args.error_rate, args.throttle_rate)
+    server = MockFyersServer(args.fixtures, {endpoint: profile for endpoint in ENDPOINTS}, args.seed)
+    await server.start(args.host, args.port)
+    for name, value in server.env.items():
+        print(f"{name}={value}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve recorded Fyers responses")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--fixtures", default=FIXTURES_DIR)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    try:
+        asyncio.run(_serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+"""
+End-to-end benchmark of /api/v1/option-chain against the mock Fyers server.
+
+Run from the backend directory:
+
+    python -m benchmarks.option_chain [--requests N] [--check] [--output results.json]
+
+The app runs in-process with every Fyers call routed to
+`benchmarks.mock_fyers`, which adds per-endpoint latencies (scaled by
+--latency-scale) and optional failures (--error-rate). Each scenario
+reports p50/p95/p99 latency of the whole request and of each stage,
+throughput and error count. Stage durations are read from the app's own
+Server-Timing header (see app/utils/metrics.py):
+
+    symbol_lookup     resolving the option symbol and lot size
+    authenticate      making sure the access token is valid
+    chain_fetch       the options-chain-v3 call
+    chain_parse       building the chain frame
+    chain_processing  selecting CE asks / PE bids per strike
+    margins           pricing the window with span_margin
+    encoding          rendering the response body
+
+Requests served from the response cache only report encoding.
+
+The mock server does not throttle, so by default the app runs without
+client-side budgets and the numbers reflect the app itself. Pass
+--rate-limits (same format as FYERS_RATE_LIMITS) to see what the budgets
+cost: exact margins of a 160-leg chain at 8 span_margin requests/s take
+20 s however fast the app is.
+
+With --check the run fails if a scenario exceeds the limits in
+thresholds.json, which are meant to be tracked between releases.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Any, Dict, List
+
+import numpy as np
+
+from benchmarks.mock_fyers import (
+    OPTION_CHAIN,
+    REFRESH,
+    SPAN_MARGIN,
+    SYMBOL_MASTER,
+    EndpointProfile,
+    MockFyersServer
+)
+
+THRESHOLDS_PATH = os.path.join(os.path.dirname(__file__), "thresholds.json")
+STAGES = (
+    'symbol_lookup', 'authenticate', 'chain_fetch', 'chain_parse', 'chain_processing', 'margins', 'encoding'
+)
+
+# Typical latencies of the live endpoints from an Indian data centre
+LATENCY_PROFILES = {
+    SYMBOL_MASTER: EndpointProfile(latency_ms=150, jitter_ms=30),
+    REFRESH: EndpointProfile(latency_ms=80, jitter_ms=20),
+    OPTION_CHAIN: EndpointProfile(latency_ms=40, jitter_ms=10),
+    SPAN_MARGIN: EndpointProfile(latency_ms=60, jitter_ms=15)
+}
+
+SCENARIOS = {
+    # Every request misses every cache: the full pipeline, one at a time
+    "cold": {"concurrency": 1, "clear_caches": True},
+    # Many clients asking for chains the caches already hold; chains still
+    # expire every OPTION_CHAIN_CACHE_TTL_SECONDS, margins stay cached
+    "warm": {"concurrency": 16, "clear_caches": False}
+}
+
+REQUESTS = [
+    {"instrument_name": "NIFTY", "expiry_date": "2030-01-31", "side": "BOTH", "strike_count": 40},
+    {"instrument_name": "BANKNIFTY", "expiry_date": "2030-01-31", "side": "PE", "strike_count": 25},
+    {"instrument_name": "FINNIFTY", "expiry_date": "2030-01-31", "side": "CE", "strike_count": 10}
+]
+
+
+def parse_server_timing(header: str) -> Dict[str, float]:
+    """Stage -> seconds from a Server-Timing header"""
+    timings = {}
+    for entry in filter(None, (part.strip() for part in header.split(','))):
+        name, _, duration = entry.partition(';dur=')
+        if duration:
+            timings[name] = float(duration) / 1000
+    return timings
+
+
+def percentiles(durations: List[float]) -> Dict[str, float]:
+    """p50/p95/p99 in milliseconds"""
+    if not durations:
+        return {"count": 0}
+    p50, p95, p99 = np.percentile(np.asarray(durations) * 1000, [50, 95, 99])
+    return {"count": len(durations), "p50_ms": round(p50, 2), "p95_ms": round(p95, 2), "p99_ms": round(p99, 2)}
+
+
+async def run_scenario(client, state, total: int, concurrency: int, clear_caches: bool) -> Dict[str, Any]:
+    latencies: List[float] = []
+    stages: Dict[str, List[float]] = defaultdict(list)
+    errors = 0
+    queue: asyncio.Queue = asyncio.Queue()
+    for i in range(total):
+        queue.put_nowait(REQUESTS[i % len(REQUESTS)])
+
+    async def worker():
+        nonlocal errors
+        while not queue.empty():
+            params = queue.get_nowait()
+            if clear_caches:
+                state.option_chain_cache.invalidate()
+                state.chain_quote_cache.invalidate()
+                state.margin_client.cache.invalidate()
+            start = time.perf_counter()
+            response = await client.get("/api/v1/option-chain", params=params)
+            if response.status_code == 200:
+                latencies.append(time.perf_counter() - start)
+                for stage, seconds in parse_server_timing(response.headers.get("server-timing", "")).items():
+                    stages[stage].append(seconds)
+            else:
+                errors += 1
+
+    if not clear_caches:
+        for params in REQUESTS:
+            await client.get("/api/v1/option-chain", params=params)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "errors": errors,
+        "throughput_rps": round(total / elapsed, 1),
+        "total": percentiles(latencies),
+        "stages": {stage: percentiles(stages.get(stage, [])) for stage in STAGES}
+    }
+
+
+def check(results: Dict[str, Any], thresholds: Dict[str, Any]) -> List[str]:
+    """Describe every threshold a run exceeds"""
+    violations = []
+    for scenario, limits in thresholds.items():
+        result = results.get(scenario)
+        if result is None:
+            continue
+        for metric, limit in limits.items():
+            if metric == "min_throughput_rps":
+                if result["throughput_rps"] < limit:
+                    violations.append(f"{scenario}: throughput {result['throughput_rps']} rps < {limit}")
+            elif metric == "max_error_rate":
+                rate = result["errors"] / result["requests"]
+                if rate > limit:
+                    violations.append(f"{scenario}: error rate {rate:.3f} > {limit}")
+            else:
+                measured = result["total"] if metric == "total" else result["stages"][metric]
+                for percentile, bound in limit.items():
+                    value = measured.get(percentile)
+                    if value is not None and value > bound:
+                        violations.append(f"{scenario}: {metric} {percentile} {value} > {bound}")
+    return violations
+
+
+def print_results(results: Dict[str, Any]) -> None:
+    for scenario, result in results.items():
+        print(f"\n{scenario}: {result['requests']} requests, concurrency {result['concurrency']}, "
+              f"{result['throughput_rps']} rps, {result['errors']} errors")
+        print(f"  {'stage':<18}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        for name, stats in [("total", result["total"]), *result["stages"].items()]:
+            if stats["count"]:
+                print(f"  {name:<18}{stats['count']:>7}{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}")
+
+
+async def main_async(args: argparse.Namespace) -> Dict[str, Any]:
+    profiles = {
+        endpoint: EndpointProfile(
+            profile.latency_ms * args.latency_scale,
+            profile.jitter_ms * args.latency_scale,
+            error_rate=args.error_rate
+        )
+        for endpoint, profile in LATENCY_PROFILES.items()
+    }
+    server = MockFyersServer(profiles=profiles, seed=args.seed)
+    await server.start()
+
+    # Settings are read at import, so the app is imported once they point at the mock
+    os.environ.update(server.env)
+    os.environ.update({
+        "FYERS_ACCESS_TOKEN": "mock-access-token",
+        "FYERS_TOKEN_EXPIRES_AT": str(int(time.time()) + 86400),
+        "SYMBOL_MASTER_CACHE_DIR": tempfile.mkdtemp(prefix="symbol-master-"),
+        "FYERS_TOKEN_STORE_PATH": os.path.join(tempfile.mkdtemp(prefix="fyers-tokens-"), "tokens.sqlite3"),
+        "SNAPSHOT_STORE_DIR": tempfile.mkdtemp(prefix="snapshots-"),
+        "SERVER_TIMING_HEADER": "true",
+        "FYERS_RATE_LIMITS": args.rate_limits
+    })
+    for name in ("FYERS_CLIENT_ID", "FYERS_CLIENT_ID_HASH", "FYERS_REFRESH_TOKEN", "FYERS_PIN"):
+        os.environ.setdefault(name, "mock")
+    os.environ.setdefault("API_HOST", "127.0.0.1")
+    os.environ.setdefault("API_PORT", "8000")
+    os.environ.setdefault("ENVIRONMENT", "benchmark")
+
+    import httpx
+    from app.main import app
+
+    results = {}
+    try:
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+                # Load the symbol master before anything is measured
+                for params in REQUESTS:
+                    await client.get("/api/v1/option-chain", params=params)
+                for scenario, options in SCENARIOS.items():
+                    if args.scenario and scenario not in args.scenario:
+                        continue
+                    results[scenario] = await run_scenario(client, app.state, args.requests, **options)
+    finally:
+        await server.close()
+
+    results["upstream_calls"] = dict(server.calls)
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=90, help="Requests per scenario")
+    parser.add_argument('--scenario', action='append', choices=list(SCENARIOS), help="Run only these scenarios")
+    parser.add_argument('--latency-scale', type=float, default=1.0, help="Multiplier of the mocked latencies")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of failing upstream calls")
+    parser.add_argument('--rate-limits', default="", help="Client-side Fyers budgets; none by default")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Write the results as JSON")
+    parser.add_argument('--check', action='store_true', help="Fail if thresholds.json is exceeded")
+    args = parser.parse_args()
+
+    results = asyncio.run(main_async(args))
+    upstream_calls = results.pop("upstream_calls")
+    print_results(results)
+    print(f"\nupstream calls: {upstream_calls}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"results": results, "upstream_calls": upstream_calls}, f, indent=2)
+
+    if args.check:
+        with open(THRESHOLDS_PATH) as f:
+            violations = check(results, json.load(f))
+        for violation in violations:
+            print(f"REGRESSION {violation}")
+        if violations:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,18 @@
+import os
+import sys
+
+# Settings are required at import time; tests never talk to Fyers
+for name, value in {
+    "FYERS_CLIENT_ID": "TEST-100",
+    "FYERS_CLIENT_ID_HASH": "hash",
+    "FYERS_ACCESS_TOKEN": "token",
+    "FYERS_REFRESH_TOKEN": "refresh",
+    "FYERS_PIN": "0000",
+    "API_HOST": "localhost",
+    "API_PORT": "8000",
+    "ENVIRONMENT": "test",
+    "FYERS_TOKEN_EXPIRES_AT": "0",
+}.items():
+    os.environ.setdefault(name, value)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,1247 @@
+import asyncio
+import gc
+import math
+import threading
+import time
+import weakref
+from datetime import datetime
+from functools import partial
+
+import numpy as np
+import orjson
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+
+from app.core.config import settings
+from app.routers import metrics, option_chain, screener
+from app.services.fyers import CHAIN_COLUMNS, FyersService, OptionChainError, TokenManager
+from app.services.live_chain import ChainSubscriptionManager, diff_chain
+from app.services.margin import SpanMarginClient
+from app.services.margin_estimator import MarginEstimator
+from app.services.prefetch import PrefetchScheduler, parse_watchlist
+from app.services.rate_limit import AdaptiveTokenBucket, FyersRateLimiter, fyers_rate_limiter, parse_rate_limits
+from app.services.snapshot_store import SnapshotStore, _merge_by_time
+from app.services.symbol_index import SymbolIndex, SymbolIndexError, compile_index, write_index
+from app.services.symbol_master import INDEX_FILENAME, SymbolMaster, symbol_master
+from app.services.token_store import TokenStore, TokenStoreError
+from app.utils.cache import AsyncTTLCache
+from app.utils.calculations import calculate_margin_and_premium, get_highest_option_prices, get_option_chain_data, iter_bulk_option_chain_data, top_k_by_yield
+from app.utils.market_time import IST, parse_time_range, seconds_until_trading
+from app.utils.greeks import black76_price, greeks, implied_volatility, norm_cdf
+from app.utils.metrics import UPSTREAM_RETRIES, MetricsMiddleware
+from app.utils.screener import TopKScreener, screen_results
+from app.utils.symbol_utils import get_symbol_name
+from benchmarks.mock_fyers import OPTION_CHAIN, SPAN_MARGIN, EndpointProfile, MockFyersServer
+
+EXPIRY = "2024-12-26"
+STRIKES = [23900, 23950, 24000, 24050, 24100]
+
+
+class StubFyersService:
+    """Stand-in for FyersService serving a synthetic NIFTY chain.
+
+    Every fetch moves the 24000 PE bid up by one, so consecutive ticks
+    differ in exactly one PE row.
+    """
+
+    def __init__(self):
+        self.calls = 0
+
+    async def get_option_chain(self, symbol, strike_count):
+        self.calls += 1
+        rows = [{"ask": 0, "bid": 0, "ltp": 24010.0, "option_type": "", "strike_price": -1,
+                 "symbol": "NSE:NIFTY50-INDEX"}]
+        for strike in STRIKES:
+            for option_type in ("CE", "PE"):
+                bid = 10.0 + self.calls if (strike, option_type) == (24000, "PE") else 10.0
+                rows.append({"ask": bid + 1, "bid": bid, "ltp": bid, "option_type": option_type,
+                             "strike_price": strike, "symbol": f"NSE:NIFTY{strike}{option_type}"})
+        return pd.DataFrame.from_records(rows, columns=CHAIN_COLUMNS)
+
+
+class StubMarginClient:
+    """Stand-in for SpanMarginClient pricing every position at 1000"""
+
+    async def get_position_margins(self, positions, stats=None, prices=None, reused=None):
+        return {position: 1000.0 for position in positions}
+
+    async def iter_position_margins(self, positions, stats=None, prices=None):
+        yield {position: 1000.0 for position in positions}, False
+
+
+@pytest.fixture(autouse=True)
+def symbols():
+    symbol_master.load_records({
+        f"NSE:NIFTY24DEC24000{option_type}": {
+            "optType": option_type, "underSym": "NIFTY", "expiryDate": "1735207200", "minLotSize": 25
+        }
+        for option_type in ("CE", "PE")
+    })
+
+
+@pytest.fixture
+def app():
+    app = FastAPI()
+    app.include_router(option_chain.router, prefix="/api/v1")
+    app.state.fyers_service = StubFyersService()
+    app.state.margin_client = StubMarginClient()
+    app.state.option_chain_cache = AsyncTTLCache(ttl_seconds=0.01, name="option_chain")
+    app.state.chain_quote_cache = AsyncTTLCache(ttl_seconds=0.01, name="chain_quotes")
+    app.state.chain_subscriptions = ChainSubscriptionManager(
+        fetch=partial(option_chain.fetch_live_chain, app.state),
+        interval_seconds=0.05
+    )
+    return app
+
+
+def chain_frame(bids):
+    return pd.DataFrame({
+        "strike_price": [strike for strike, _ in bids],
+        "option_type": [option_type for _, option_type in bids],
+        "bid/ask": list(bids.values()),
+        "margin": 1000.0,
+        "margin_available": True,
+        "premium": [bid * 25 for bid in bids.values()],
+    })
+
+
+def test_diff_chain_reports_changed_new_and_removed_rows():
+    previous = chain_frame({(24000, "CE"): 10.0, (24000, "PE"): 12.0, (24050, "CE"): 8.0})
+    current = chain_frame({(24000, "CE"): 10.0, (24000, "PE"): 12.5, (24100, "CE"): 6.0})
+
+    upserts, removed = diff_chain(previous, current)
+
+    assert list(zip(upserts["strike_price"], upserts["option_type"])) == [(24000, "PE"), (24100, "CE")]
+    assert removed == [{"strike_price": 24050, "option_type": "CE"}]
+
+
+def test_diff_chain_without_previous_snapshot_returns_everything():
+    current = chain_frame({(24000, "CE"): 10.0})
+
+    upserts, removed = diff_chain(None, current)
+
+    assert len(upserts) == 1
+    assert removed == []
+
+
+def test_subscribers_share_one_polling_loop():
+    async def scenario():
+        fetches = []
+
+        async def fetch(key):
+            fetches.append(key)
+            return chain_frame({(24000, "PE"): 10.0 + len(fetches)})
+
+        manager = ChainSubscriptionManager(fetch=fetch, interval_seconds=0.02)
+        key = ("NIFTY", EXPIRY, "PE")
+        first, second = asyncio.Queue(), asyncio.Queue()
+        manager.subscribe(key, first)
+        manager.subscribe(key, second)
+        await asyncio.sleep(0.1)
+
+        assert manager.subscriber_count(key) == 2
+        ticks = len(fetches)
+        # One fetch per tick, not one per subscriber
+        assert 0 < ticks <= 0.1 / 0.02 + 1
+
+        for queue in (first, second):
+            messages = [queue.get_nowait() for _ in range(queue.qsize())]
+            assert messages[0]["type"] == "snapshot"
+            assert all(message["type"] == "diff" for message in messages[1:])
+            assert len(messages) == ticks
+
+        manager.unsubscribe(key, first)
+        assert manager.is_polling(key)
+        manager.unsubscribe(key, second)
+        await asyncio.sleep(0)
+        assert not manager.is_polling(key)
+        await manager.close()
+
+    asyncio.run(scenario())
+
+
+def test_slow_subscriber_is_resynced_with_a_snapshot():
+    async def scenario():
+        ticks = 0
+
+        async def fetch(key):
+            nonlocal ticks
+            ticks += 1
+            return chain_frame({(24000, "PE"): 10.0 + ticks})
+
+        manager = ChainSubscriptionManager(fetch=fetch, interval_seconds=0.01)
+        key = ("NIFTY", EXPIRY, "PE")
+        queue = asyncio.Queue(maxsize=1)
+        manager.subscribe(key, queue)
+        await asyncio.sleep(0.05)
+
+        # Updates dropped while the queue was full are replaced by a snapshot
+        assert queue.get_nowait()["type"] == "snapshot"
+        await asyncio.sleep(0.03)
+        assert queue.get_nowait()["type"] == "snapshot"
+        await manager.close()
+
+    asyncio.run(scenario())
+
+
+def test_websocket_pushes_snapshot_then_diffs(app):
+    subscription = {"action": "subscribe", "instrument_name": "NIFTY", "expiry_date": EXPIRY, "side": "BOTH"}
+
+    with TestClient(app) as client:
+        with client.websocket_connect("/api/v1/option-chain/ws") as first, \
+                client.websocket_connect("/api/v1/option-chain/ws") as second:
+            first.send_json(subscription)
+            second.send_json(subscription)
+
+            for websocket in (first, second):
+                assert websocket.receive_json()["type"] == "subscribed"
+                snapshot = websocket.receive_json()
+                assert snapshot["type"] == "snapshot"
+                assert len(snapshot["data"]) == len(STRIKES) * 2
+
+                diff = websocket.receive_json()
+                assert diff["type"] == "diff"
+                assert [(row["strike_price"], row["option_type"]) for row in diff["upserts"]] == [(24000, "PE")]
+                assert diff["removed"] == []
+
+            key = ("NIFTY", EXPIRY, "BOTH")
+            assert app.state.chain_subscriptions.subscriber_count(key) == 2
+
+            first.send_json({**subscription, "action": "unsubscribe"})
+            message = first.receive_json()
+            while message["type"] != "unsubscribed":
+                message = first.receive_json()
+            assert app.state.chain_subscriptions.subscriber_count(key) == 1
+
+        deadline = time.monotonic() + 1
+        while app.state.chain_subscriptions.is_polling(key) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert not app.state.chain_subscriptions.is_polling(key)
+
+
+def test_websocket_rejects_invalid_messages(app):
+    with TestClient(app) as client:
+        with client.websocket_connect("/api/v1/option-chain/ws") as websocket:
+            websocket.send_json({"action": "subscribe", "instrument_name": "NIFTY", "expiry_date": "26-12-2024", "side": "PE"})
+            message = websocket.receive_json()
+            assert message["type"] == "error"
+            assert "expiry date" in message["detail"]
+
+
+def test_cached_margins_are_recomputed_after_price_moves():
+    async def scenario():
+        requests = []
+
+        class RecordingMarginClient(SpanMarginClient):
+            async def _post(self, legs, stats):
+                requests.append([leg["symbol"] for leg in legs])
+                return {"s": "ok", "data": {"total": 1000.0}}
+
+        client = RecordingMarginClient(
+            auth_header=lambda: "", reprice_underlying_move=0.01, reprice_option_move=0.10
+        )
+        positions = [("NSE:NIFTY24000CE", 25), ("NSE:NIFTY24000PE", 25)]
+        prices = {positions[0]: (24000.0, 100.0), positions[1]: (24000.0, 80.0)}
+
+        reused = set()
+        await client.get_position_margins(positions, prices=prices, reused=reused)
+        assert reused == set()
+
+        # Small moves reuse both margins, a 20% option move reprices the PE
+        requests.clear()
+        stats = {}
+        moved = {positions[0]: (24100.0, 105.0), positions[1]: (24100.0, 96.0)}
+        margins = await client.get_position_margins(positions, stats, moved, reused)
+        assert set(margins) == set(positions)
+        assert reused == {positions[0]}
+        assert requests == [["NSE:NIFTY24000PE"]]
+        assert stats["margin_repriced"] == 1
+
+        # A 2% underlying move reprices everything
+        reused.clear()
+        await client.get_position_margins(
+            positions, prices={position: (24500.0, 96.0) for position in positions}, reused=reused
+        )
+        assert reused == set()
+        await client.close()
+
+    asyncio.run(scenario())
+
+
+def test_margin_estimator_fits_span_parameters_from_exact_margins():
+    estimator = MarginEstimator(span_rate=0.10, exposure_rate=0.02, otm_credit=0.5, min_rate=0.02, min_samples=10)
+    strikes = np.arange(23000, 25050, 50, dtype=float)
+    option_types = np.where(np.arange(len(strikes)) % 2 == 0, "CE", "PE")
+    spot = 24000.0
+
+    # Margins generated with span_rate 0.12 and otm_credit 0.4
+    truth = MarginEstimator(span_rate=0.12, exposure_rate=0.02, otm_credit=0.4, min_rate=0.02)
+    exact = truth.estimate("NIFTY", spot, strikes, option_types, 25)
+    assert not np.allclose(estimator.estimate("NIFTY", spot, strikes, option_types, 25), exact)
+
+    estimator.observe("NIFTY", spot, strikes, option_types, 25, exact)
+
+    params = estimator.params("NIFTY")
+    assert params["fitted"]
+    assert params["span_rate"] == pytest.approx(0.12)
+    assert params["otm_credit"] == pytest.approx(0.4)
+    np.testing.assert_allclose(estimator.estimate("NIFTY", spot, strikes, option_types, 25), exact)
+    # Other instruments keep the defaults
+    assert not estimator.params("BANKNIFTY")["fitted"]
+
+
+def test_top_k_by_yield_orders_best_first():
+    premium = np.array([100.0, 300.0, 200.0, 50.0])
+    margin = np.array([1000.0, 1000.0, 1000.0, 0.0])
+
+    assert top_k_by_yield(premium, margin, 2).tolist() == [1, 2]
+    assert top_k_by_yield(premium, margin, 10).tolist() == [1, 2, 0, 3]
+
+
+def test_screen_results_keeps_top_k_across_chains():
+    def priced(instrument_name, premiums, margins):
+        return pd.DataFrame({
+            "instrument_name": instrument_name,
+            "strike_price": [24000 + 50 * i for i in range(len(premiums))],
+            "option_type": "PE",
+            "bid/ask": [premium / 25 for premium in premiums],
+            "underlying_ltp": 24000.0,
+            "premium": premiums,
+            "margin": margins,
+            "margin_available": [margin > 0 for margin in margins],
+            "margin_source": "recomputed",
+        })
+
+    results = [
+        {"expiry_date": EXPIRY, "data": priced("NIFTY", [100.0, 400.0, 250.0], [1000.0, 1000.0, 1000.0])},
+        {"expiry_date": EXPIRY, "error": "No symbol found", "status_code": 404},
+        {"expiry_date": EXPIRY, "data": priced("BANKNIFTY", [300.0, 900.0, 50.0], [1000.0, 0.0, 1000.0])},
+    ]
+
+    selected, counts = screen_results(results, top_k=3, max_margin=1500.0)
+
+    assert list(zip(selected["instrument_name"], selected["premium"])) == [
+        ("NIFTY", 400.0), ("BANKNIFTY", 300.0), ("NIFTY", 250.0)
+    ]
+    assert selected["yield"].tolist() == [0.4, 0.3, 0.25]
+    # The row without a margin is never selected
+    assert counts == {"rows_scanned": 6, "rows_matched": 5}
+
+    selected, _ = screen_results(results, top_k=3, min_premium=260.0)
+    assert selected["premium"].tolist() == [400.0, 300.0]
+
+
+def test_implied_volatility_recovers_black76_volatilities():
+    strike = np.array([22000.0, 23500.0, 24000.0, 24500.0, 26000.0, 24000.0])
+    is_call = np.array([False, False, True, True, True, False])
+    sigma = np.array([0.25, 0.18, 0.14, 0.15, 0.3, 0.14])
+    forward, years, rate = 24100.0, 10 / 365, 0.065
+
+    price = black76_price(forward, strike, years, sigma, rate, is_call)
+    np.testing.assert_allclose(implied_volatility(price, forward, strike, years, rate, is_call), sigma, atol=1e-6)
+
+    # Quotes below intrinsic value imply no volatility
+    below_intrinsic = implied_volatility(np.array([50.0]), forward, np.array([23000.0]), years, rate, np.array([True]))
+    assert np.isnan(below_intrinsic).all()
+
+    # Deep in- and out-of-the-money quotes with little time value, where
+    # vega is tiny and a price tolerance would stop far from the root
+    deep_strike = np.array([21000.0, 22000.0, 28000.0, 26500.0, 27000.0, 20000.0])
+    deep_call = np.array([True, True, True, True, False, False])
+    deep_sigma = np.array([0.25, 0.2, 0.6, 0.2, 0.3, 0.45])
+    deep_price = black76_price(forward, deep_strike, years, deep_sigma, rate, deep_call)
+    np.testing.assert_allclose(
+        implied_volatility(deep_price, forward, deep_strike, years, rate, deep_call), deep_sigma, atol=1e-6
+    )
+
+    # Within a tick of intrinsic value or of zero, no volatility is implied
+    intrinsic = np.exp(-rate * years) * (forward - 22000.0)
+    near_bounds = implied_volatility(
+        np.array([intrinsic + 0.03, 0.05, 0.01]), forward, np.array([22000.0, 27000.0, 28000.0]), years, rate,
+        np.array([True, True, True])
+    )
+    assert np.isnan(near_bounds).all()
+
+    x = np.array([-8.0, -1.5, 0.0, 0.7, 3.0])
+    np.testing.assert_allclose(norm_cdf(x), [0.5 * math.erfc(-v / math.sqrt(2)) for v in x], rtol=0, atol=1e-14)
+
+    values = greeks(forward * np.exp(-rate * years), strike, years, sigma, rate, is_call)
+    # Put-call parity: call delta - put delta = 1 at the same strike
+    assert values["delta"][2] - values["delta"][5] == pytest.approx(1.0)
+    assert (values["gamma"] > 0).all() and (values["vega"] > 0).all()
+
+
+@pytest.fixture
+def mock_fyers(monkeypatch, tmp_path):
+    """Route every Fyers call to a mock server; yields a factory taking endpoint profiles"""
+    # Token refreshes persist to settings and ./.env
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(settings, "FYERS_ACCESS_TOKEN", "")
+    monkeypatch.setattr(settings, "FYERS_TOKEN_EXPIRES_AT", 0)
+    monkeypatch.setattr(symbol_master, "index_path", str(tmp_path / INDEX_FILENAME))
+    # Fresh budgets and retries that do not slow the tests down
+    monkeypatch.setattr(fyers_rate_limiter, "buckets", {
+        endpoint: AdaptiveTokenBucket(1000) for endpoint in parse_rate_limits(settings.FYERS_RATE_LIMITS)
+    })
+    monkeypatch.setattr(fyers_rate_limiter, "base_delay", 0.001)
+    monkeypatch.setattr(fyers_rate_limiter, "max_delay", 0.001)
+
+    async def start(profiles=None):
+        server = MockFyersServer(profiles=profiles)
+        await server.start()
+        for name, url in server.env.items():
+            monkeypatch.setattr(settings, name, url)
+        monkeypatch.setattr(symbol_master, "url", server.env["SYMBOL_MASTER_URL"])
+        await symbol_master.refresh()
+        return server
+
+    return start
+
+
+def test_pipeline_against_mock_fyers(mock_fyers):
+    async def scenario():
+        server = await mock_fyers()
+        fyers_service = FyersService()
+        margin_client = SpanMarginClient(
+            auth_header=lambda: fyers_service.auth_header, url=server.env["FYERS_SPAN_MARGIN_URL"]
+        )
+        try:
+            data, lot_size = await get_option_chain_data("NIFTY", "2030-01-31", "PE", fyers_service, strike_count=5)
+            priced = await calculate_margin_and_premium(data, lot_size, margin_client)
+        finally:
+            await margin_client.close()
+            await fyers_service.close()
+            await server.close()
+        return server, fyers_service, priced, lot_size
+
+    server, fyers_service, priced, lot_size = asyncio.run(scenario())
+
+    assert fyers_service.access_token == "mock-access-token"
+    assert lot_size == 75
+    assert len(priced) == 11 and (priced["option_type"] == "PE").all()
+    assert priced["margin_available"].all()
+    # One batch reveals basket totals, then each position is priced on its own
+    assert server.calls == {"symbol_master": 1, "refresh": 1, "optionchain": 1, "span_margin": 1 + 11}
+
+
+def test_mock_fyers_injects_failures(mock_fyers):
+    async def scenario():
+        server = await mock_fyers({
+            OPTION_CHAIN: EndpointProfile(error_rate=1.0),
+            SPAN_MARGIN: EndpointProfile(latency_ms=5, throttle_rate=1.0)
+        })
+        fyers_service = FyersService()
+        margin_client = SpanMarginClient(
+            auth_header=lambda: fyers_service.auth_header, url=server.env["FYERS_SPAN_MARGIN_URL"]
+        )
+        try:
+            with pytest.raises(OptionChainError):
+                await fyers_service.get_option_chain("NSE:NIFTY30JAN24000PE", 5)
+            margins = await margin_client.get_margins(["NSE:NIFTY30JAN24000PE"], 75)
+        finally:
+            await margin_client.close()
+            await fyers_service.close()
+            await server.close()
+        return server, margins
+
+    server, margins = asyncio.run(scenario())
+
+    assert margins == {}
+    # The first attempt and every retry failed
+    attempts = 1 + fyers_rate_limiter.max_retries
+    assert server.failures == {"optionchain": attempts, "span_margin": attempts}
+    assert fyers_rate_limiter.buckets["span_margin"].rate < fyers_rate_limiter.buckets["span_margin"].max_rate
+
+
+def test_throttled_requests_are_retried_and_slow_the_budget(mock_fyers):
+    async def scenario():
+        server = await mock_fyers({SPAN_MARGIN: EndpointProfile(throttle_rate=0.3)})
+        fyers_service = FyersService()
+        margin_client = SpanMarginClient(
+            auth_header=lambda: fyers_service.auth_header, url=server.env["FYERS_SPAN_MARGIN_URL"], chunk_size=1
+        )
+        try:
+            data, lot_size = await get_option_chain_data("NIFTY", "2030-01-31", "PE", fyers_service, strike_count=5)
+            priced = await calculate_margin_and_premium(data, lot_size, margin_client)
+        finally:
+            await margin_client.close()
+            await fyers_service.close()
+            await server.close()
+        return server, priced
+
+    retries_before = UPSTREAM_RETRIES.value(endpoint="span_margin")
+    server, priced = asyncio.run(scenario())
+
+    assert server.failures["span_margin"] > 0
+    assert priced["margin_available"].all()
+    assert UPSTREAM_RETRIES.value(endpoint="span_margin") - retries_before == server.failures["span_margin"]
+    assert server.calls["span_margin"] == 11 + server.failures["span_margin"]
+
+
+def test_token_bucket_spaces_requests_and_adapts_to_throttling():
+    bucket = AdaptiveTokenBucket(max_rate=4, min_rate=1)
+    # The burst is one second's worth; after that requests are spaced 1/rate apart
+    waits = [bucket.reserve() for _ in range(6)]
+    assert waits[:4] == [0, 0, 0, 0]
+    assert waits[4] == pytest.approx(0.25, abs=0.01) and waits[5] == pytest.approx(0.5, abs=0.01)
+
+    bucket.throttled(retry_after=2)
+    assert bucket.rate == 2
+    assert bucket.reserve() == pytest.approx(2, abs=0.01)
+    bucket.throttled()
+    bucket.throttled()
+    assert bucket.rate == 1
+
+    for _ in range(100):
+        bucket.succeeded()
+    assert bucket.rate == 4
+
+
+def test_server_timing_header_and_metrics_endpoint(app):
+    app.add_middleware(MetricsMiddleware, timing_header=True)
+    app.include_router(metrics.router)
+    app.state.margin_client.cache = AsyncTTLCache(ttl_seconds=1, name="margin")
+    params = {"instrument_name": "NIFTY", "expiry_date": EXPIRY, "side": "PE", "strike_count": 2}
+
+    with TestClient(app) as client:
+        response = client.get("/api/v1/option-chain", params=params)
+        exposition = client.get("/metrics")
+
+    assert response.status_code == 200
+    timings = dict(entry.split(";dur=") for entry in response.headers["server-timing"].split(", "))
+    assert {"symbol_lookup", "chain_processing", "margins", "encoding", "total"} <= set(timings)
+    assert all(float(duration) >= 0 for duration in timings.values())
+
+    assert exposition.headers["content-type"].startswith("text/plain; version=0.0.4")
+    lines = exposition.text.splitlines()
+    assert 'optionchain_stage_duration_seconds_count{stage="margins"} ' in "\n".join(lines)
+    assert 'http_request_duration_seconds_count{method="GET",handler="option_chain",status="200"} 1' in lines
+    assert any(line.startswith('cache_misses_total{cache="option_chain"} ') for line in lines)
+
+
+def test_workers_share_one_token_refresh(tmp_path):
+    path = str(tmp_path / "tokens.sqlite3")
+    refreshes = []
+
+    async def refresh_fn():
+        refreshes.append(1)
+        await asyncio.sleep(0.2)
+        return f"token-{len(refreshes)}", time.time() + 3600
+
+    def worker():
+        # Each worker process has its own manager and store handle on the same file
+        return TokenManager("", 0, refresh_fn, store=TokenStore(path), sync_seconds=0, lease_seconds=1)
+
+    async def scenario():
+        first, second = worker(), worker()
+        tokens = await asyncio.gather(first.get_access_token(), second.get_access_token())
+
+        # A token refreshed elsewhere is picked up without a refresh of our own
+        TokenStore(path).save("token-external", time.time() + 7200)
+        return tokens, await first.get_access_token()
+
+    tokens, synced = asyncio.run(scenario())
+
+    assert len(refreshes) == 1
+    assert tokens == ["token-1", "token-1"]
+    assert synced == "token-external"
+
+
+
+def test_token_store_failures_fall_back_to_the_fresh_token(tmp_path):
+    class FailingStore(TokenStore):
+        """Grants leases but cannot read or write the token"""
+
+        def load(self):
+            raise TokenStoreError("database disk image is malformed")
+
+        def save(self, access_token, expires_at):
+            raise TokenStoreError("database disk image is malformed")
+
+    refreshes = []
+
+    async def refresh_fn():
+        refreshes.append(1)
+        return f"token-{len(refreshes)}", time.time() + 3600
+
+    async def scenario():
+        path = str(tmp_path / "tokens.sqlite3")
+        leased = TokenManager("", 0, refresh_fn, store=FailingStore(path), sync_seconds=0, lease_seconds=1)
+        token = await leased.get_access_token()
+
+        # Waiting on another worker's lease, a broken store means refreshing here
+        assert TokenStore(path).acquire_lease("other-worker", 60)
+        waiting = TokenManager("", 0, refresh_fn, store=FailingStore(path), sync_seconds=0, lease_seconds=60)
+        return token, await asyncio.wait_for(waiting.get_access_token(), 5)
+
+    assert asyncio.run(scenario()) == ("token-1", "token-2")
+
+
+def test_symbol_index_file_is_shared_and_swapped_atomically(mock_fyers, tmp_path):
+    records = {
+        f"NSE:{name}30JAN{strike}{option_type}": {
+            "optType": option_type, "underSym": name, "expiryDate": "1896076800", "minLotSize": lot
+        }
+        for name, lot in (("NIFTY", 75), ("BANKNIFTY", 30))
+        for strike in (100, 200)
+        for option_type in ("CE", "PE", "XX")
+    }
+    path = str(tmp_path / "index.idx")
+    write_index(path, compile_index(records, time.time()))
+    old = SymbolIndex.open(path)
+    assert len(old) == 4
+    assert old.get(("NIFTY", "2030-01-31", "PE")) == ("NSE:NIFTY30JAN100PE", 75)
+    assert old.get(("NIFTY", "2030-01-31", "XX")) is None
+    assert old.get(("FINNIFTY", "2030-01-31", "CE")) is None
+
+    # A rebuild replaces the file; the old mapping keeps serving its own copy
+    write_index(path, compile_index({"NSE:FIN": {**records["NSE:NIFTY30JAN100CE"], "underSym": "FINNIFTY"}}, time.time()))
+    assert old.get(("BANKNIFTY", "2030-01-31", "CE")) == ("NSE:BANKNIFTY30JAN100CE", 30)
+    assert SymbolIndex.open(path).get(("FINNIFTY", "2030-01-31", "CE")) == ("NSE:FIN", 75)
+
+    async def scenario():
+        # The fixture built the index from the mock; a second worker maps it instead of downloading
+        server = await mock_fyers()
+        worker = SymbolMaster(url=server.env["SYMBOL_MASTER_URL"], cache_dir=str(tmp_path))
+        entry = await worker.lookup("NIFTY", "2030-01-31", "CE")
+        await server.close()
+        return server, entry
+
+    server, entry = asyncio.run(scenario())
+    assert entry == ("NSE:NIFTY30JAN21000CE", 75)
+    assert server.calls["symbol_master"] == 1
+
+
+def test_prefetched_chains_are_served_warm(app):
+    monday_morning = datetime(2024, 12, 23, 10, 0, tzinfo=IST)
+    scheduler = PrefetchScheduler(
+        refresh=partial(option_chain.prefetch_chain, app.state, ttl_seconds=60),
+        watchlist=parse_watchlist(f"NIFTY:{EXPIRY}:pe"),
+        rate_limiter=FyersRateLimiter(limits={}),
+        clock=lambda: monday_morning
+    )
+    params = {"instrument_name": "NIFTY", "expiry_date": EXPIRY, "side": "PE"}
+
+    assert asyncio.run(scheduler.run_cycle()) == 1
+    assert app.state.fyers_service.calls == 1
+    with TestClient(app) as client:
+        response = client.get("/api/v1/option-chain", params=params)
+    assert response.status_code == 200 and len(response.json()) > 0
+    # Served from the prefetched entry, not fetched again
+    assert app.state.fyers_service.calls == 1
+
+
+def test_prefetch_runs_in_trading_hours_and_yields_to_requests():
+    hours = parse_time_range("09:00-15:30")
+    assert seconds_until_trading(hours, datetime(2024, 12, 23, 10, 0, tzinfo=IST)) == 0
+    # Friday evening -> Monday 09:00
+    assert seconds_until_trading(hours, datetime(2024, 12, 20, 16, 0, tzinfo=IST)) == (2 * 24 + 17) * 3600
+    with pytest.raises(ValueError):
+        parse_watchlist("NIFTY:26-12-2024")
+
+    refreshed = []
+
+    async def refresh(key):
+        refreshed.append(key)
+
+    limiter = FyersRateLimiter(limits={"optionchain": 10, "span_margin": 10})
+    watchlist = [("NIFTY", EXPIRY, "BOTH"), ("BANKNIFTY", EXPIRY, "BOTH")]
+    scheduler = PrefetchScheduler(refresh, watchlist, rate_limiter=limiter, max_concurrency=1)
+
+    limiter.buckets["span_margin"].throttled()
+    assert asyncio.run(scheduler.run_cycle()) == 0
+    # Recovered and idle again
+    limiter.buckets["span_margin"] = AdaptiveTokenBucket(10)
+    assert asyncio.run(scheduler.run_cycle()) == 2
+    assert refreshed == watchlist
+
+
+def test_snapshots_are_buffered_partitioned_and_compacted(tmp_path):
+    friday = datetime(2024, 12, 20, 10, 0, tzinfo=IST)
+    store = SnapshotStore(str(tmp_path), flush_rows=1000, compact_min_files=2, clock=lambda: friday)
+    chain = chain_frame({(24000, "CE"): 10.0, (24000, "PE"): 12.0}).assign(margin_source="recomputed")
+
+    async def record():
+        for minute in range(3):
+            store.append("NIFTY", EXPIRY, "BOTH", chain, taken_at=friday.replace(minute=minute))
+            store.append("M&M", EXPIRY, "BOTH", chain, taken_at=friday.replace(minute=minute))
+            # Nothing reaches the disk until a flush
+            assert store.pending_rows == 4 and len(list(tmp_path.rglob("*.parquet"))) == 2 * minute
+            assert await store.flush() == 4
+        store.append("NIFTY", EXPIRY, "BOTH", chain, taken_at=friday.replace(day=19))
+        await store.flush()
+
+    asyncio.run(record())
+    nifty = tmp_path / "date=2024-12-20" / "instrument=NIFTY"
+    assert len(list(nifty.glob("part-*.parquet"))) == 3
+
+    rows, truncated = store.query(
+        "NIFTY", datetime(2024, 12, 20, 10, 1), datetime(2024, 12, 20, 10, 3),
+        strike_price=24000, option_type="PE", columns=["snapshot_at", "bid/ask"]
+    )
+    assert not truncated and list(rows.columns) == ["snapshot_at", "bid/ask"]
+    assert [t.minute for t in rows["snapshot_at"]] == [1, 2] and (rows["bid/ask"] == 12.0).all()
+
+    # Partitions with several parts are merged; the single file of the 19th is left alone
+    assert store.compact() == 2
+    assert [f.name[:10] for f in nifty.iterdir()] == ["compacted-"]
+    assert len(list((tmp_path / "date=2024-12-19" / "instrument=NIFTY").iterdir())) == 1
+    rows, truncated = store.query("M&M", datetime(2024, 12, 20), datetime(2024, 12, 21), limit=5)
+    assert truncated and len(rows) == 5 and rows["snapshot_at"].is_monotonic_increasing
+    with pytest.raises(ValueError):
+        store.query("NIFTY", friday, friday, columns=["instrument_name"])
+
+
+
+def test_snapshot_limit_keeps_the_earliest_rows_across_flushes_and_days(tmp_path):
+    friday = datetime(2024, 12, 20, 10, 0, tzinfo=IST)
+    store = SnapshotStore(str(tmp_path), clock=lambda: friday)
+    chain = chain_frame({(24000, "PE"): 12.0}).assign(margin_source="recomputed")
+
+    async def record():
+        # Flushed out of snapshot order, so the later snapshot sits in the earlier file
+        for taken_at in (friday.replace(minute=5), friday.replace(minute=1), friday.replace(day=21)):
+            store.append("NIFTY", EXPIRY, "PE", chain, taken_at=taken_at)
+            await store.flush()
+
+    asyncio.run(record())
+    start, end = datetime(2024, 12, 20), datetime(2024, 12, 22)
+
+    rows, truncated = store.query("NIFTY", start, end, limit=1)
+    assert truncated and [t.minute for t in rows["snapshot_at"]] == [1]
+    rows, truncated = store.query("NIFTY", start, end, columns=["bid/ask"], limit=2)
+    assert truncated and list(rows.columns) == ["bid/ask"] and len(rows) == 2
+    rows, truncated = store.query("NIFTY", start, end, limit=3)
+    assert not truncated and [t.day for t in rows["snapshot_at"]] == [20, 20, 21]
+    rows, truncated = store.query("NIFTY", start, end, strike_price=23000, limit=1)
+    assert not truncated and rows.empty and "snapshot_at" in rows
+
+
+
+def test_snapshot_files_are_merged_in_time_order_without_reading_ahead(tmp_path):
+    def stream(minutes, read):
+        # Two-row batches of one file, each counted as it is read
+        for i in range(0, len(minutes), 2):
+            read.append(1)
+            times = [datetime(2024, 12, 20, 10, minute) for minute in minutes[i:i + 2]]
+            yield pa.RecordBatch.from_pydict({"snapshot_at": pa.array(times, pa.timestamp("us", tz="UTC"))})
+
+    read = []
+    files = [[0, 3, 4, 9, 10, 11], [1, 2, 5, 6, 7, 8], [2, 12, 13, 14, 15, 16]]
+    merged = _merge_by_time(stream(minutes, read) for minutes in files)
+    first = next(merged)
+    # The first batch of each file, plus the next one of the file that ran out
+    assert len(read) == 4 and [t.minute for t in first["snapshot_at"].to_pylist()] == [0, 1, 2, 2]
+    rest = [t.minute for chunk in merged for t in chunk["snapshot_at"].to_pylist()]
+    assert rest == sorted(sum(files, []))[4:]
+
+    # Part files flushed out of order are compacted into one ordered file
+    friday = datetime(2024, 12, 20, 10, 0, tzinfo=IST)
+    store = SnapshotStore(str(tmp_path), compact_min_files=2, clock=lambda: friday.replace(day=23))
+    chain = chain_frame({(24000, "PE"): 12.0, (24000, "CE"): 9.0}).assign(margin_source="recomputed")
+
+    async def record():
+        for minutes in ((7, 2), (5, 1, 9)):
+            for minute in minutes:
+                store.append("NIFTY", EXPIRY, "BOTH", chain, taken_at=friday.replace(minute=minute))
+            await store.flush()
+
+    asyncio.run(record())
+    assert store.compact() == 1
+    (compacted,) = (tmp_path / "date=2024-12-20" / "instrument=NIFTY").iterdir()
+    assert pd.Series(pq.read_table(compacted)["snapshot_at"].to_pandas()).is_monotonic_increasing
+    rows, truncated = store.query("NIFTY", datetime(2024, 12, 20), datetime(2024, 12, 21), limit=3)
+    assert truncated and [t.minute for t in rows["snapshot_at"]] == [1, 1, 2]
+
+
+def test_computed_chains_are_recorded_for_history(app, tmp_path):
+    app.state.snapshot_store = SnapshotStore(str(tmp_path))
+    params = {"instrument_name": "NIFTY", "expiry_date": EXPIRY, "side": "PE"}
+
+    with TestClient(app) as client:
+        assert client.get("/api/v1/option-chain", params=params).status_code == 200
+        client.portal.call(app.state.snapshot_store.flush)
+        response = client.get("/api/v1/option-chain/history", params={
+            "instrument_name": "NIFTY", "start": "2000-01-01T00:00:00", "strike_price": 24000,
+            "columns": "snapshot_at,option_type,bid/ask"
+        })
+        bad_column = client.get("/api/v1/option-chain/history", params={
+            "instrument_name": "NIFTY", "start": "2000-01-01T00:00:00", "columns": "symbol"
+        })
+
+    assert response.status_code == 200
+    assert response.json() == [{"snapshot_at": response.json()[0]["snapshot_at"], "option_type": "PE", "bid/ask": 11.0}]
+    assert datetime.fromisoformat(response.json()[0]["snapshot_at"]).utcoffset() == IST.utcoffset(None)
+    assert bad_column.status_code == 400
+
+
+
+def test_streamed_bulk_and_screened_chains_are_recorded_for_history(app, tmp_path):
+    app.include_router(screener.router, prefix="/api/v1")
+    app.state.snapshot_store = store = SnapshotStore(str(tmp_path))
+    with TestClient(app) as client:
+        stream = client.get("/api/v1/option-chain/stream", params={
+            "instrument_name": "NIFTY", "expiry_date": EXPIRY, "side": "CE"
+        })
+        assert stream.status_code == 200 and '"done"' in stream.text
+        assert client.post("/api/v1/option-chain/bulk", json={
+            "requests": [{"instrument_name": "NIFTY", "expiry_date": EXPIRY, "side": "PE"}]
+        }).status_code == 200
+        assert client.post("/api/v1/screener", json={
+            "instruments": ["NIFTY"], "expiry_dates": [EXPIRY], "side": "BOTH"
+        }).status_code == 200
+        client.portal.call(store.flush)
+
+    rows, _ = store.query("NIFTY", datetime(2000, 1, 1), datetime(2100, 1, 1), columns=["side", "option_type"])
+    assert rows.groupby("side").size().to_dict() == {"CE": len(STRIKES), "PE": len(STRIKES), "BOTH": 2 * len(STRIKES)}
+
+
+def test_startup_survives_missing_fyers_credentials(monkeypatch):
+    from app.main import app as main_app
+
+    monkeypatch.setattr(settings, "FYERS_PIN", "")
+    monkeypatch.setattr(settings, "SNAPSHOT_STORE_DIR", "")
+    with TestClient(main_app) as client:
+        response = client.get("/api/v1/option-chain", params={
+            "instrument_name": "NIFTY", "expiry_date": EXPIRY, "side": "PE"
+        })
+    assert response.status_code == 503
+
+
+def test_margin_batches_map_items_and_fall_back_per_symbol():
+    margins = {f"NSE:NIFTY{strike}PE": float(strike) for strike in range(24000, 24600, 50)}
+    symbols = list(margins)
+
+    async def scenario(reply):
+        client = SpanMarginClient(auth_header=lambda: "id:token", chunk_size=3, rate_limiter=FyersRateLimiter(limits={}))
+        requests = []
+
+        async def post(legs, stats):
+            requests.append(len(legs))
+            if len(legs) == 1:
+                return {"s": "ok", "data": {"total": margins[legs[0]["symbol"]]}}
+            return reply([leg["symbol"] for leg in legs])
+
+        client._post = post
+        try:
+            first = await client.get_margins(symbols[:6], 75)
+            itemized = client._itemized
+            second = await client.get_margins(symbols[6:], 75)
+        finally:
+            await client.close()
+        return first, itemized, second, requests
+
+    # Itemized replies are mapped per symbol; a symbol left out is retried alone
+    first, itemized, second, requests = asyncio.run(scenario(lambda batch: {
+        "s": "ok", "data": [{"symbol": s, "total": margins[s]} for s in batch if s != symbols[1]]
+    }))
+    assert first == {s: margins[s] for s in symbols[:6]} and itemized
+    assert requests == [3, 3, 1, 3, 3]
+
+    # An error body sends only its chunk to per-symbol requests
+    first, itemized, second, requests = asyncio.run(scenario(lambda batch: {"s": "error", "message": "Invalid symbol"}))
+    assert first == {s: margins[s] for s in symbols[:6]} and itemized is None
+    assert requests.count(3) == 4
+
+    # So does a body that is not a JSON object
+    for body in ([], None):
+        first, itemized, second, requests = asyncio.run(scenario(lambda batch: body))
+        assert first == {s: margins[s] for s in symbols[:6]} and itemized is None
+        assert requests.count(3) == 4
+
+    # A successful basket total switches batching off for good
+    first, itemized, second, requests = asyncio.run(scenario(lambda batch: {"s": "ok", "data": {"total": 1.0}}))
+    assert second == {s: margins[s] for s in symbols[6:]} and itemized is False
+    assert requests == [3, 3] + [1] * 12
+
+
+def test_cache_expires_evicts_and_coalesces_past_a_cancelled_leader():
+    cache = AsyncTTLCache(ttl_seconds=0.05, max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    # "b" is the least recently used entry
+    cache.set("c", 3)
+    assert cache.get("b") is None and cache.get("a") == 1
+    time.sleep(0.06)
+    assert cache.get("a") is None and cache.get("c") is None
+
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.02)
+        if len(calls) == 1:
+            raise ValueError("upstream failed")
+        return len(calls)
+
+    async def scenario():
+        failures = await asyncio.gather(*(cache.get_or_compute("k", compute) for _ in range(3)), return_exceptions=True)
+        # Failures are shared but not cached; the leader is cancelled on the next try
+        leader = asyncio.create_task(cache.get_or_compute("k", compute))
+        await asyncio.sleep(0)
+        followers = [asyncio.create_task(cache.get_or_compute("k", compute)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        return failures, await asyncio.gather(*followers), leader
+
+    failures, values, leader = asyncio.run(scenario())
+    assert all(isinstance(e, ValueError) for e in failures)
+    # One follower took over the computation and the others shared its result
+    assert leader.cancelled() and values == [3, 3, 3] and len(calls) == 3
+    assert cache.stats()["coalesced"] >= 5
+
+
+def test_symbols_resolve_from_the_indexed_master():
+    assert asyncio.run(get_symbol_name("NIFTY", EXPIRY, "PE")) == ("NSE:NIFTY24DEC24000PE", 25)
+    # One chain fetch serves both sides, so BOTH takes whichever contract exists
+    assert asyncio.run(get_symbol_name("NIFTY", EXPIRY, "BOTH")) == ("NSE:NIFTY24DEC24000CE", 25)
+    with pytest.raises(HTTPException) as missing:
+        asyncio.run(get_symbol_name("BANKNIFTY", EXPIRY, "PE"))
+    with pytest.raises(HTTPException) as invalid:
+        asyncio.run(get_symbol_name("NIFTY", "26-12-2024", "PE"))
+    assert (missing.value.status_code, invalid.value.status_code) == (404, 400)
+
+
+
+def test_truncated_symbol_index_is_rejected_and_rebuilt(tmp_path):
+    records = {
+        f"NSE:NIFTY30JAN{strike}{option_type}": {
+            "optType": option_type, "underSym": "NIFTY", "expiryDate": "1896076800", "minLotSize": 75
+        }
+        for strike in range(100, 1100, 100) for option_type in ("CE", "PE")
+    }
+    data = compile_index(records, time.time())
+    assert len(SymbolIndex(data)) == 2
+    # Cut inside each section: hashes, lots, offsets and the key strings
+    for size in (40, 52, 64, 80, len(data) - 1):
+        with pytest.raises(SymbolIndexError):
+            SymbolIndex(data[:size])
+
+    master = SymbolMaster(cache_dir=str(tmp_path))
+    write_index(master.index_path, data[:len(data) // 2])
+    # An unreadable file is ignored so the master is downloaded again
+    assert master._open_index() is False
+
+
+def test_concurrent_callers_share_one_token_refresh():
+    refreshes = []
+
+    async def refresh():
+        refreshes.append(1)
+        await asyncio.sleep(0.01)
+        return f"token-{len(refreshes)}", time.time() + 3600
+
+    async def scenario():
+        manager = TokenManager("", 0, refresh)
+        tokens = await asyncio.gather(*(manager.get_access_token() for _ in range(10)))
+        # Fresh now, so no further refresh
+        return tokens, await manager.get_access_token()
+
+    tokens, later = asyncio.run(scenario())
+    assert set(tokens) == {"token-1"} and later == "token-1" and len(refreshes) == 1
+
+
+def test_margin_requests_fan_out_up_to_the_concurrency_limit():
+    async def scenario():
+        server = MockFyersServer(profiles={SPAN_MARGIN: EndpointProfile(latency_ms=50)})
+        await server.start()
+        client = SpanMarginClient(
+            auth_header=lambda: "id:token", chunk_size=1, max_concurrency=4,
+            url=server.env["FYERS_SPAN_MARGIN_URL"], rate_limiter=FyersRateLimiter(limits={})
+        )
+        symbols = sorted(server._margins)[:8] + ["NSE:UNKNOWN30JAN100PE"]
+        started = time.perf_counter()
+        try:
+            margins = await client.get_margins(symbols, 75)
+        finally:
+            await client.close()
+            await server.close()
+        return symbols, margins, time.perf_counter() - started
+
+    symbols, margins, elapsed = asyncio.run(scenario())
+    # The rejected symbol is left out instead of failing the rest
+    assert set(margins) == set(symbols[:8])
+    # Nine 50 ms requests, four at a time: three rounds instead of nine
+    assert 0.15 <= elapsed < 0.4
+
+
+def test_pipeline_maps_upstream_failures_to_http_errors(app):
+    class UnavailableFyersService:
+        async def get_option_chain(self, symbol, strike_count):
+            raise OptionChainError("upstream down")
+
+    class EmptyFyersService:
+        async def get_option_chain(self, symbol, strike_count):
+            return pd.DataFrame(columns=CHAIN_COLUMNS)
+
+    params = {"instrument_name": "NIFTY", "expiry_date": EXPIRY, "side": "PE"}
+    statuses = []
+    with TestClient(app) as client:
+        for service in (UnavailableFyersService(), EmptyFyersService()):
+            app.state.fyers_service = service
+            statuses.append(client.get("/api/v1/option-chain", params=params).status_code)
+        statuses.append(client.get("/api/v1/option-chain", params={**params, "side": "XX"}).status_code)
+    assert statuses == [503, 422, 400]
+
+
+def test_margins_are_cached_per_contract_and_quantity():
+    async def scenario():
+        requests = []
+
+        class RecordingMarginClient(SpanMarginClient):
+            async def _post(self, legs, stats):
+                requests.append([(leg["symbol"], leg["qty"]) for leg in legs])
+                return {"s": "ok", "data": {"total": 10.0 * legs[0]["qty"]}}
+
+        client = RecordingMarginClient(auth_header=lambda: "", chunk_size=1, rate_limiter=FyersRateLimiter(limits={}))
+        try:
+            first = await client.get_margins(["NSE:NIFTY24000PE"], 25)
+            again = await client.get_margins(["NSE:NIFTY24000PE"], 25)
+            doubled = await client.get_margins(["NSE:NIFTY24000PE"], 50)
+        finally:
+            await client.close()
+        return first, again, doubled, requests
+
+    first, again, doubled, requests = asyncio.run(scenario())
+    assert first == again == {"NSE:NIFTY24000PE": 250.0} and doubled == {"NSE:NIFTY24000PE": 500.0}
+    assert requests == [[("NSE:NIFTY24000PE", 25)], [("NSE:NIFTY24000PE", 50)]]
+
+
+def test_side_both_takes_ce_asks_and_pe_bids_from_one_chain():
+    # The underlying's row need not come first
+    chain = pd.DataFrame.from_records([
+        {"ask": 12.0, "bid": 11.0, "ltp": 11.5, "option_type": "CE", "strike_price": 24000, "symbol": "NSE:NIFTY24000CE"},
+        {"ask": 9.0, "bid": 8.0, "ltp": 8.5, "option_type": "PE", "strike_price": 24000, "symbol": "NSE:NIFTY24000PE"},
+        {"ask": 0.0, "bid": 0.0, "ltp": 0.0, "option_type": "CE", "strike_price": 24050, "symbol": "NSE:NIFTY24050CE"},
+        {"ask": 0.0, "bid": 0.0, "ltp": 24010.0, "option_type": "", "strike_price": -1, "symbol": "NSE:NIFTY50-INDEX"},
+    ], columns=CHAIN_COLUMNS)
+
+    both = get_highest_option_prices(chain, "NIFTY", "BOTH", lot_size=25)
+    assert list(zip(both["option_type"], both["bid/ask"], both["premium"])) == [("CE", 12.0, 300.0), ("PE", 8.0, 200.0)]
+    assert (both["underlying_ltp"] == 24010.0).all()
+    puts = get_highest_option_prices(chain, "NIFTY", "PE")
+    assert puts["symbol"].tolist() == ["NSE:NIFTY24000PE"] and puts["bid/ask"].tolist() == [8.0]
+
+
+def test_bulk_scan_reports_items_inline_and_shares_the_response_cache(app):
+    app.state.option_chain_cache = AsyncTTLCache(ttl_seconds=60, name="option_chain")
+    requests = [
+        {"instrument_name": "NIFTY", "expiry_date": EXPIRY, "side": "PE"},
+        {"instrument_name": "BANKNIFTY", "expiry_date": EXPIRY, "side": "PE"},
+        {"instrument_name": "NIFTY", "expiry_date": "26-12-2024", "side": "PE"},
+    ]
+    with TestClient(app) as client:
+        separate = client.post("/api/v1/option-chain/bulk", json={"requests": requests}).json()
+        combined = client.post("/api/v1/option-chain/bulk", json={"requests": requests, "combine": True}).json()
+
+    assert [result["status_code"] for result in separate["results"]] == [200, 404, 400]
+    assert {row["option_type"] for row in separate["results"][0]["data"]} == {"PE"}
+    assert separate["stats"]["items"] == 3 and separate["stats"]["errors"] == 2
+    # The second scan reuses the priced chain and tags rows with their query
+    assert app.state.fyers_service.calls == 1 and combined["stats"]["response_cache_hits"] == 1
+    assert len(combined["data"]) == len(separate["results"][0]["data"])
+    assert {(row["expiry_date"], row["side"]) for row in combined["data"]} == {(EXPIRY, "PE")}
+    assert [error["status_code"] for error in combined["errors"]] == [404, 400]
+
+
+
+def test_bulk_scan_feeds_the_estimator_from_the_event_loop(app):
+    class LoopOnlyEstimator(MarginEstimator):
+        """Records the thread of every update; they race with loop readers otherwise"""
+
+        def __init__(self):
+            super().__init__()
+            self.threads = set()
+
+        def observe(self, *args, **kwargs):
+            self.threads.add(threading.current_thread())
+            return super().observe(*args, **kwargs)
+
+    async def current_thread():
+        return threading.current_thread()
+
+    app.state.margin_estimator = estimator = LoopOnlyEstimator()
+    requests = [{"instrument_name": "NIFTY", "expiry_date": EXPIRY, "side": "BOTH"}]
+    with TestClient(app) as client:
+        event_loop_thread = client.portal.call(current_thread)
+        assert client.post("/api/v1/option-chain/bulk", json={"requests": requests}).status_code == 200
+
+    assert estimator.threads == {event_loop_thread}
+
+
+def test_vectorized_chain_transform_matches_a_row_by_row_pass():
+    rng = np.random.default_rng(7)
+    strikes = np.repeat(np.arange(23000, 25000, 50), 2)
+    chain = pd.DataFrame({
+        "ask": np.where(rng.random(len(strikes)) < 0.2, 0.0, rng.uniform(1, 500, len(strikes)).round(2)),
+        "bid": rng.uniform(1, 500, len(strikes)).round(2),
+        "ltp": 0.0,
+        "option_type": np.tile(["CE", "PE"], len(strikes) // 2),
+        "strike_price": strikes,
+        "symbol": [f"NSE:NIFTY{strike}{i % 2}" for i, strike in enumerate(strikes)],
+    })
+    underlying = pd.DataFrame([{"ask": 0.0, "bid": 0.0, "ltp": 24010.0, "option_type": "", "strike_price": -1,
+                                "symbol": "NSE:NIFTY50-INDEX"}])
+    chain = pd.concat([chain.iloc[:10], underlying, chain.iloc[10:]], ignore_index=True)
+
+    for side in ("CE", "PE", "BOTH"):
+        expected = [
+            (row.strike_price, row.option_type, row.ask if row.option_type == "CE" else row.bid, row.symbol)
+            for row in chain.itertuples()
+            if row.ask != 0 and row.option_type in (("CE", "PE") if side == "BOTH" else (side,))
+        ]
+        result = get_highest_option_prices(chain, "NIFTY", side, lot_size=25)
+        assert list(zip(result["strike_price"], result["option_type"], result["bid/ask"], result["symbol"])) == expected
+        np.testing.assert_allclose(result["premium"], result["bid/ask"] * 25)
+
+
+def test_cursor_pages_cover_the_chain_nearest_atm_first(app):
+    chain = {"instrument_name": "NIFTY", "expiry_date": EXPIRY, "side": "BOTH"}
+    params = {**chain, "page_size": 3}
+    pages = []
+    with TestClient(app) as client:
+        full = client.get("/api/v1/option-chain", params=chain).json()
+        cursor = None
+        while True:
+            response = client.get("/api/v1/option-chain", params={**params, **({"cursor": cursor} if cursor else {})})
+            assert response.status_code == 200
+            pages.append(response.json())
+            cursor = response.headers.get("X-Next-Cursor")
+            if cursor is None:
+                break
+        invalid = client.get("/api/v1/option-chain", params={**params, "cursor": "not-a-cursor"})
+        narrow = client.get("/api/v1/option-chain", params={**chain, "moneyness_range": 0.001})
+
+    assert [len(page) for page in pages] == [3, 3, 3, 1]
+    keys = [(row["strike_price"], row["option_type"]) for page in pages for row in page]
+    assert len(set(keys)) == len(keys) == len(full)
+    assert set(keys) == {(row["strike_price"], row["option_type"]) for row in full}
+    # Spot is 24010, so pages are ordered around the 24000 strike
+    distances = [abs(strike - 24000) for strike, _ in keys]
+    assert distances == sorted(distances)
+    assert invalid.status_code == 400
+    assert {row["strike_price"] for row in narrow.json()} == {24000}
+
+
+def test_option_chain_formats_are_negotiated_and_decode_to_the_same_rows(app):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    app.state.option_chain_cache = AsyncTTLCache(ttl_seconds=60, name="option_chain")
+    params = {"instrument_name": "NIFTY", "expiry_date": EXPIRY, "side": "PE"}
+    with TestClient(app) as client:
+        records = client.get("/api/v1/option-chain", params=params)
+        columnar = client.get("/api/v1/option-chain", params={**params, "format": "columnar"})
+        arrow = client.get("/api/v1/option-chain", params=params, headers={
+            "Accept": "application/json;q=0.5, application/vnd.apache.arrow.stream"
+        })
+        parquet = client.get("/api/v1/option-chain", params=params, headers={"Accept": "application/vnd.apache.parquet"})
+        unsupported = client.get("/api/v1/option-chain", params=params, headers={"Accept": "text/csv"})
+        unknown = client.get("/api/v1/option-chain", params={**params, "format": "csv"})
+
+    expected = pd.DataFrame(records.json())
+    assert records.headers["content-type"] == "application/json"
+    assert columnar.headers["content-type"] == "application/vnd.optionchain.columnar+json"
+    pd.testing.assert_frame_equal(pd.DataFrame(columnar.json()), expected)
+    assert arrow.headers["content-type"] == "application/vnd.apache.arrow.stream"
+    pd.testing.assert_frame_equal(pa.ipc.open_stream(arrow.content).read_pandas(), expected)
+    pd.testing.assert_frame_equal(pq.read_table(pa.BufferReader(parquet.content)).to_pandas(), expected)
+    assert (unsupported.status_code, unknown.status_code) == (406, 406)
+
+
+def test_stream_sends_rows_then_margin_updates_then_done(app):
+    class StreamingMarginClient(StubMarginClient):
+        async def iter_position_margins(self, positions, prices=None):
+            # One span_margin response per position
+            for position in positions:
+                await asyncio.sleep(0)
+                yield {position: 1000.0}, False
+
+    app.state.margin_client = StreamingMarginClient()
+    params = {"instrument_name": "NIFTY", "expiry_date": EXPIRY, "side": "BOTH"}
+    with TestClient(app) as client:
+        ndjson = client.get("/api/v1/option-chain/stream", params=params)
+        sse = client.get("/api/v1/option-chain/stream", params=params, headers={"Accept": "text/event-stream"})
+
+    assert ndjson.headers["content-type"].startswith("application/x-ndjson")
+    events = [orjson.loads(line) for line in ndjson.text.splitlines()]
+    names = [event["event"] for event in events]
+    assert names == ["rows"] + ["margins"] * 10 + ["done"]
+    assert not any(row["margin_available"] for row in events[0]["data"])
+    assert {(row["strike_price"], row["option_type"]) for event in events[1:-1] for row in event["data"]} == \
+        {(row["strike_price"], row["option_type"]) for row in events[0]["data"]}
+    assert events[-1]["data"]["rows"] == events[-1]["data"]["margins_available"] == 10
+
+    assert sse.headers["content-type"].startswith("text/event-stream")
+    assert [line[len("event: "):] for line in sse.text.splitlines() if line.startswith("event: ")] == names
+
+
+def test_screener_streams_chains_through_a_bounded_heap(app):
+    instruments = [f"STOCK{i}" for i in range(12)]
+    symbol_master.load_records({
+        f"NSE:{instrument}24DEC24000{option_type}": {
+            "optType": option_type, "underSym": instrument, "expiryDate": "1735207200", "minLotSize": 25
+        }
+        for instrument in instruments for option_type in ("CE", "PE")
+    })
+
+    class RecordingMarginClient(StubMarginClient):
+        def __init__(self):
+            self.priced = []
+
+        async def get_position_margins(self, positions, stats=None, prices=None, reused=None):
+            self.priced.append(len(positions))
+            return await super().get_position_margins(positions, stats, prices, reused)
+
+    async def scenario():
+        screen = TopKScreener(top_k=3)
+        margin_client = RecordingMarginClient()
+        pushed = []
+        peak_rows = 0
+        stats = {}
+        async for result in iter_bulk_option_chain_data(
+            [(instrument, EXPIRY, "BOTH") for instrument in instruments],
+            StubFyersService(), margin_client, stats, max_concurrency=2,
+            estimator=MarginEstimator(), margin_mode="hybrid", confirm_top_k=3
+        ):
+            pushed.append(weakref.ref(result["data"]))
+            screen.push(result)
+            del result
+            gc.collect()
+            # Chains still in flight plus the heap, never the whole scan
+            live = [frame() for frame in pushed if frame() is not None]
+            peak_rows = max(peak_rows, sum(len(frame) for frame in live) + len(screen))
+            del live
+        return screen, margin_client, peak_rows, stats
+
+    screen, margin_client, peak_rows, stats = asyncio.run(scenario())
+
+    chain_rows = 2 * len(STRIKES)
+    assert screen.counts["rows_scanned"] == len(instruments) * chain_rows
+    assert len(screen) == 3
+    assert peak_rows <= 3 * chain_rows + 3
+    # Hybrid pricing only confirms each chain's best candidates exactly
+    assert margin_client.priced == [3] * len(instruments)
+    assert stats["items"] == stats["chain_fetches"] == len(instruments) and stats["errors"] == 0
+
+    app.include_router(screener.router, prefix="/api/v1")
+    screen_body = {"instruments": ["STOCK0", "MISSING"], "expiry_dates": [EXPIRY], "top_k": 4}
+    with TestClient(app) as client:
+        response = client.post("/api/v1/screener", json=screen_body)
+        no_estimator = client.post("/api/v1/screener", json={**screen_body, "margin_mode": "hybrid"})
+        app.state.margin_estimator = MarginEstimator()
+        estimated = client.post("/api/v1/screener", json={**screen_body, "margin_mode": "estimate"})
+    body = response.json()
+    assert response.status_code == 200
+    assert len(body["data"]) == 4 and body["data"][0]["yield"] >= body["data"][-1]["yield"]
+    assert [error["instrument_name"] for error in body["errors"]] == ["MISSING"]
+    assert body["stats"]["rows_scanned"] == chain_rows
+    # Exact SPAN margins unless estimates are asked for, and then every row says so
+    assert not any(row["margin_estimated"] for row in body["data"])
+    assert no_estimator.status_code == 503
+    assert estimated.status_code == 200 and all(row["margin_estimated"] for row in estimated.json()["data"])
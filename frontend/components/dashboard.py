@@ -3,7 +3,41 @@ import streamlit as st
 import pandas as pd
 import plotly.express as px
 
+ROW_KEY = ['strike_price', 'option_type']
+
 def display_dashboard(data):
-    df = pd.DataFrame(data)
+    """
+    Render option chain rows.
+
+    `data` is either the full result (list of rows or DataFrame) or an
+    iterable of (event, data) pairs from the streaming endpoint, in which
+    case the table is drawn as soon as quotes arrive and filled in as
+    margins resolve. A stream that ends without rows or an error event
+    reports that no data is available. Returns the final DataFrame.
+    """
     st.subheader("Option Chain Data")
-    st.dataframe(df)
+    if isinstance(data, (list, pd.DataFrame)):
+        df = pd.DataFrame(data)
+        st.dataframe(df)
+        return df
+
+    table = st.empty()
+    status = st.empty()
+    df = pd.DataFrame()
+    failed = False
+    for event, payload in data:
+        if event == 'rows':
+            df = pd.DataFrame(payload).set_index(ROW_KEY, drop=False)
+            status.caption("Fetching margins...")
+        elif event == 'margins':
+            update = pd.DataFrame(payload).set_index(ROW_KEY)
+            df.loc[update.index, update.columns] = update
+        elif event == 'done':
+            status.caption(f"Margins available for {payload['margins_available']} of {payload['rows']} strikes")
+        elif event == 'error':
+            failed = True
+            status.error(payload['detail'])
+        table.dataframe(df.reset_index(drop=True))
+    if df.empty and not failed:
+        status.error("No data available.")
+    return df.reset_index(drop=True)
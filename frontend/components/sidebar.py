@@ -12,6 +12,6 @@ def sidebar():
     
     expiry_date = st.sidebar.date_input("Expiry Date", min_value=datetime.now())
     expiry_date_str = expiry_date.strftime("%Y-%m-%d")
-    side = st.sidebar.selectbox("Option Side", ["PE", "CE"])
+    side = st.sidebar.selectbox("Option Side", ["PE", "CE", "BOTH"])
     
     return instrument_name, expiry_date_str, side
\ No newline at end of file
@@ -1,22 +1,27 @@
 # frontend/utils/api_client.py
 import requests
 import os
-import streamlit as st
+import json
 
 BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:8000/api/v1")
 
-def get_option_chain_data(instrument_name, expiry_date, side):
+def stream_option_chain_data(instrument_name, expiry_date, side):
+    """
+    Yield (event, data) pairs from the streaming option chain endpoint.
+    Request failures end the stream with an 'error' event.
+    """
     try:
-        url = f"{BACKEND_URL}/option-chain"
+        url = f"{BACKEND_URL}/option-chain/stream"
         params = {
             'instrument_name': instrument_name,
             'expiry_date': expiry_date,
             'side': side
         }
-        response = requests.get(url, params=params)
-        response.raise_for_status()
-        data = response.json()
-        return data
+        with requests.get(url, params=params, stream=True) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if line:
+                    message = json.loads(line)
+                    yield message['event'], message['data']
     except Exception as e:
-        st.error(f"Error fetching data: {e}")
-        return None
+        yield 'error', {'detail': f"Error fetching data: {e}"}